@@ -3,10 +3,154 @@ import numpy as np
 import pandas as pd
 
 from metrics import compute_auroc_scores
+from profiling import profiled
 
+NORMALIZATIONS = ('zscore', 'percentile', 'rrf')
+RRF_K = 60  # Reciprocal rank fusion constant
 
+
+def _grouped_ranks(values, codes, offsets):
+    """
+    Computes average (tie-aware) ascending ranks of each column of ``values``
+    within groups, with one sort per column.
+
+    Args:
+        values: np.ndarray
+            2D array of scores (rows x columns). NaNs get NaN ranks.
+
+        codes: np.ndarray
+            Integer group code of each row, in range [0, number of groups).
+
+        offsets: np.ndarray
+            Start of each group in rows sorted by code (length: number of
+            groups + 1).
+
+    Returns:
+        ranks: np.ndarray
+            Ranks starting from 1, with the same shape as ``values``.
+    """
+    ranks = np.empty(values.shape, dtype=np.float64)
+    for j in range(values.shape[1]):
+        order = np.lexsort((values[:, j], codes))
+        sorted_values = values[order, j]
+        sorted_codes = codes[order]
+        # Position of each row within its group
+        position = np.arange(1, len(order) + 1) - offsets[sorted_codes]
+        # Runs of tied values
+        run_start = np.ones(len(order), dtype=bool)
+        run_start[1:] = (sorted_codes[1:] != sorted_codes[:-1]) | \
+            (sorted_values[1:] != sorted_values[:-1])
+        run_id = np.cumsum(run_start) - 1
+        run_first = position[run_start]
+        run_last = np.append(position[np.flatnonzero(run_start)[1:] - 1],
+                             position[-1:])
+        sorted_ranks = (run_first[run_id] + run_last[run_id]) / 2.
+        sorted_ranks[np.isnan(sorted_values)] = np.nan
+        ranks[order, j] = sorted_ranks
+
+    return ranks
+
+
+@profiled
+def normalize_scores(results, normalization, group_cols=None,
+                     score_cols=None, rrf_k=RRF_K):
+    """
+    Normalizes scores per target, so that scores of models on different scales
+    can be averaged. Groups are integer-coded once and all score columns are
+    normalized in the same pass.
+
+    Args:
+        results: pd.DataFrame
+            Results DataFrame.
+
+        normalization: str
+            One of the following:
+            - 'zscore': Subtracts the mean and divides by the standard
+              deviation of each target.
+            - 'percentile': Average rank divided by the number of ligands of
+              each target (in range (0, 1], higher is better).
+            - 'rrf': Reciprocal rank fusion score ``1 / (rrf_k + rank)``,
+              where ``rank`` is the descending rank within each target.
+
+        group_cols: list, optional (default: ['target_id'])
+            Columns that specify the groups that are normalized independently.
+
+        score_cols: list, optional (default: float columns)
+            Columns that will be normalized.
+
+        rrf_k: int, optional (default: 60)
+            Constant of reciprocal rank fusion.
+
+    Returns:
+        results: pd.DataFrame
+            Results DataFrame with normalized scores. NaN scores are ignored
+            and remain NaN.
+    """
+    if normalization not in NORMALIZATIONS:
+        raise ValueError(f"``normalization`` must be one of {NORMALIZATIONS} "
+                         f"but '{normalization}' was provided.")
+    if group_cols is None:
+        group_cols = ['target_id']
+    if score_cols is None:
+        score_cols = [col for col in results.select_dtypes('floating')
+                      if col not in group_cols]
+
+    results = results.copy()
+    if len(results) == 0 or len(score_cols) == 0:
+        return results
+
+    codes = results.groupby(by=group_cols, sort=False, observed=True,
+                            dropna=False).ngroup().to_numpy()
+    values = results[score_cols].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(values)
+    # Number of non-NaN scores of each group and column
+    counts = np.stack([np.bincount(codes, weights=valid[:, j])
+                       for j in range(len(score_cols))], axis=1)
+
+    if normalization == 'zscore':
+        filled = np.where(valid, values, 0.)
+        sums = np.stack([np.bincount(codes, weights=filled[:, j])
+                         for j in range(len(score_cols))], axis=1)
+        sums_sq = np.stack([np.bincount(codes, weights=filled[:, j] ** 2)
+                            for j in range(len(score_cols))], axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+            stds = np.sqrt(np.maximum(sums_sq / counts - means ** 2, 0.))
+            normalized = (values - means[codes]) / stds[codes]
+        # Constant scores
+        normalized[valid & (stds[codes] == 0.)] = 0.
+    else:
+        offsets = np.zeros(codes.max() + 2, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(codes))
+        ranks = _grouped_ranks(values, codes, offsets)
+        if normalization == 'percentile':
+            normalized = ranks / counts[codes]
+        else:
+            normalized = 1. / (rrf_k + counts[codes] + 1. - ranks)
+
+    for j, col in enumerate(score_cols):
+        results[col] = normalized[:, j]
+    return results
+
+
+def _normalize_components(results, normalization, target_cols, model_cols,
+                          non_avg_cols):
+    """Normalizes the averaged columns of each model (``model_cols``) per
+    target. """
+    if target_cols is None:
+        target_cols = ['target_id']
+    # Integer columns (e.g. model version/checkpoint ids) are not scores
+    score_cols = [col for col in results.select_dtypes('floating')
+                  if col not in non_avg_cols + model_cols + target_cols]
+    return normalize_scores(results, normalization,
+                            group_cols=target_cols + model_cols,
+                            score_cols=score_cols)
+
+
+@profiled
 def compute_ensemble_scores(results, ckpt=False, version=False,
-                            pair_id_cols=None, exclude_cols=None):
+                            pair_id_cols=None, exclude_cols=None,
+                            normalization=None, target_cols=None):
     """
     Computes average scores using ensembling.
 
@@ -29,6 +173,13 @@ def compute_ensemble_scores(results, ckpt=False, version=False,
         exclude_cols: tuple, optional (default: ['y_true']
             These columns will be excluded from averaging computations.
 
+        normalization: str, optional (default: None)
+            If specified, the scores of each model/checkpoint are normalized
+            per target before averaging. See `normalize_scores`.
+
+        target_cols: list, optional (default: ['target_id'])
+            The columns that specify a target, used for normalization.
+
     Returns:
         results: pd.DataFrame
             Results DataFrame with average scores using model/checkpoint
@@ -50,14 +201,22 @@ def compute_ensemble_scores(results, ckpt=False, version=False,
         non_avg_cols = non_avg_cols + ['ckpt']
         drop_columns.remove('ckpt')
 
+    if normalization is not None:
+        results = _normalize_components(
+            results, normalization, target_cols,
+            [col for col in ['version', 'ckpt'] if col in results],
+            non_avg_cols)
+
     results = results.drop(columns=drop_columns)
-    return results.groupby(by=non_avg_cols).mean(
+    return results.groupby(by=non_avg_cols, observed=True).mean(
         numeric_only=True).reset_index(drop=False)
 
 
+@profiled
 def compute_level_ensemble_scores(results_atom, results_surface, atom_weight,
                                   use_target_intersection=False,
-                                  pair_id_cols=None, exclude_cols=None):
+                                  pair_id_cols=None, exclude_cols=None,
+                                  normalization=None, target_cols=None):
     """
     Computes weighted average scores from atom-level and surface-level scores.
     Averages will be computed across all columns that have are of float type.
@@ -87,6 +246,15 @@ def compute_level_ensemble_scores(results_atom, results_surface, atom_weight,
         exclude_cols: tuple, optional (default: ['y_true']
             These columns will be excluded from averaging computations.
 
+        normalization: str, optional (default: None)
+            If specified, atom-level and surface-level scores are normalized
+            per target before weighting. See `normalize_scores`. Scores are
+            normalized over all targets of each model, before the target
+            intersection is taken.
+
+        target_cols: list, optional (default: ['target_id'])
+            The columns that specify a target, used for normalization.
+
     Returns:
         results: pd.DataFrame
             DataFrame with ensemble results.
@@ -99,6 +267,12 @@ def compute_level_ensemble_scores(results_atom, results_surface, atom_weight,
 
     non_avg_cols = pair_id_cols + exclude_cols  # excluded from averaging
 
+    if normalization is not None:
+        results_atom = _normalize_components(
+            results_atom, normalization, target_cols, [], non_avg_cols)
+        results_surface = _normalize_components(
+            results_surface, normalization, target_cols, [], non_avg_cols)
+
     # Intersection of two DataFrames (protein-ligand pairs)
     pairs_inter = pd.merge(results_atom, results_surface, how='inner',
                            on=pair_id_cols)
@@ -131,7 +305,7 @@ def compute_level_ensemble_scores(results_atom, results_surface, atom_weight,
     # Compute average across same protein-ligand pairs. Weights have already
     # been applied so we can just use groupby().sum().
     atom_surface_inter_weighted = atom_surface_inter_weighted.groupby(
-        by=non_avg_cols).sum(numeric_only=True).reset_index(
+        by=non_avg_cols, observed=True).sum(numeric_only=True).reset_index(
         drop=False)
 
     if use_target_intersection:
@@ -145,6 +319,7 @@ def compute_level_ensemble_scores(results_atom, results_surface, atom_weight,
     return atom_surface_ensemble
 
 
+@profiled
 def level_ensemble_grid_search(results_atom, results_surface,
                                atom_weight_grid=None, metric_avg_fun=None,
                                prog_bar=False):
@@ -0,0 +1,123 @@
+import math
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+import pandas as pd
+
+from filtering import TargetIndex
+from profiling import profiled
+
+"""
+Parallel computation of per-target metrics for multiple models. The scores,
+labels and targets of all models are placed in shared memory once, and the
+(model, target, metric) tasks are distributed to a process pool as offsets
+into the shared arrays, so that no DataFrames are pickled.
+"""
+
+# Shared arrays and scoring functions of the worker processes (set by
+# `_init_worker`)
+_worker = dict()
+
+
+def _init_worker(scores, labels, scoring_funs):
+    _worker['y_score'] = np.frombuffer(scores, dtype=np.float64)
+    _worker['y_true'] = np.frombuffer(labels, dtype=np.bool_)
+    _worker['scoring_funs'] = scoring_funs
+
+
+def _run_task(task):
+    """Computes a metric on a slice of the shared arrays. Returns the task
+    with the score. """
+    row, metric, start, stop = task
+    try:
+        score = _worker['scoring_funs'][metric](
+            _worker['y_true'][start:stop], _worker['y_score'][start:stop])
+    except ValueError:  # E.g. AUROC with only one class
+        score = np.nan
+    return row, metric, score
+
+
+@profiled
+def evaluate_models(results, scoring, n_jobs=None):
+    """
+    Computes per-target metrics for multiple models in parallel.
+
+    Args:
+        results: dict
+            Keys are model names and values are results DataFrames with one
+            row per target-ligand pair (columns `target_id`, `y_true` and
+            `y_score`).
+
+        scoring: dict
+            Keys are metric names and values are scoring functions following
+            the sklearn API (see `metrics.score_per_target`), e.g.
+            ``functools.partial(metrics.ef_score, alpha=0.01)``. Functions
+            must be picklable (e.g. module-level functions or partials of
+            them).
+
+        n_jobs: int, optional (default: None)
+            Number of worker processes. Defaults to the number of CPUs. If 1,
+            metrics are computed in the current process.
+
+    Returns:
+        scores: pd.DataFrame
+            Tidy DataFrame with one row per model and target and the
+            following columns: `['Model', 'Target'] + list(scoring)`. Average
+            scores can be computed with e.g. ``scores.groupby('Model')
+            .median()``.
+    """
+    models = list(results)
+    metrics = list(scoring)
+
+    # Row layout: targets of each model are contiguous, in sorted order
+    num_rows = sum(len(df) for df in results.values())
+    scores = RawArray('d', num_rows)
+    labels = RawArray('B', num_rows)
+    scores_np = np.frombuffer(scores, dtype=np.float64)
+    labels_np = np.frombuffer(labels, dtype=np.bool_)
+
+    model_col, target_col, tasks = [], [], []
+    offset = 0
+    for model in models:
+        df = results[model]
+        target_index = TargetIndex(df['target_id'].to_numpy())
+        order = target_index.order if target_index.order is not None else \
+            slice(None)
+        scores_np[offset:offset + len(df)] = \
+            df['y_score'].to_numpy(dtype=np.float64)[order]
+        labels_np[offset:offset + len(df)] = \
+            df['y_true'].to_numpy(dtype=bool)[order]
+
+        for i, target in enumerate(target_index.vocabulary):
+            row = len(model_col)
+            model_col.append(model)
+            target_col.append(target)
+            start = offset + target_index.offsets[i]
+            stop = offset + target_index.offsets[i + 1]
+            tasks.extend((row, j, start, stop) for j in range(len(metrics)))
+        offset += len(df)
+
+    values = np.full((len(model_col), len(metrics)), np.nan)
+    scoring_funs = [scoring[metric] for metric in metrics]
+    if n_jobs == 1:
+        _init_worker(scores, labels, scoring_funs)
+        for row, metric, score in map(_run_task, tasks):
+            values[row, metric] = score
+    else:
+        n_jobs = n_jobs or multiprocessing.cpu_count()
+        chunksize = max(1, math.ceil(len(tasks) / (4 * n_jobs)))
+        with multiprocessing.Pool(
+                n_jobs, initializer=_init_worker,
+                initargs=(scores, labels, scoring_funs)) as pool:
+            for row, metric, score in pool.imap_unordered(
+                    _run_task, tasks, chunksize=chunksize):
+                values[row, metric] = score
+
+    scores_df = pd.DataFrame({
+        'Model': pd.Categorical(model_col, categories=models),
+        'Target': np.asarray(target_col, dtype=object)})
+    for j, metric in enumerate(metrics):
+        scores_df[metric] = values[:, j]
+
+    return scores_df
@@ -1,3 +1,10 @@
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+
+
+@profiled
 def target_intersection(targets):
     """
     Returns target intersection.
@@ -13,6 +20,7 @@ def target_intersection(targets):
     return list(set.intersection(*map(set, targets)))
 
 
+@profiled
 def target_union(targets):
     """
     Returns target union.
@@ -28,6 +36,7 @@ def target_union(targets):
     return list(set.union(*map(set, targets)))
 
 
+@profiled
 def target_difference(targets_1, targets_2):
     """
     Returns difference between two iterables (e.g. list, sets) of targets.
@@ -46,7 +55,8 @@ def target_difference(targets_1, targets_2):
     return set(targets_1) - set(targets_2)
 
 
-def filter_targets(results, targets):
+@profiled
+def filter_targets(results, targets, target_index=None):
     """
     Filters results DataFrame so that only specified targets are kept.
 
@@ -57,8 +67,213 @@ def filter_targets(results, targets):
         targets: list
             List of targets to keep.
 
+        target_index: TargetIndex, optional (default: None)
+            Target index of ``results``. If provided, rows are selected using
+            the index offsets instead of a full scan of the `target_id`
+            column. If ``results`` is sorted by target (see `sort_by_target`)
+            and the targets are contiguous, rows are selected with a slice.
+
     Returns:
         results_filtered: pd.DataFrame
-            Filtered results DataFrame.
+            Filtered results DataFrame (with a reset index).
+    """
+    if target_index is None:
+        return results[results['target_id'].isin(targets)].reset_index(
+            drop=True)
+
+    positions = target_index.positions(targets)
+    return results.iloc[positions].reset_index(drop=True)
+
+
+class TargetIndex:
+    """
+    Target-partitioned index of a results table. Rows are grouped by target
+    using a stable sort of integer-coded targets, and an offsets table gives
+    the rows of each target, so that per-target slices can be retrieved
+    without boolean masks.
+
+    Args:
+        target_ids: 1d array-like
+            Target id of each row (e.g. ``results['target_id']``).
+
+    Attributes:
+        vocabulary: np.ndarray
+            Sorted unique target ids. The code of a target is its position.
+
+        offsets: np.ndarray
+            Rows of target with code ``i`` are ``order[offsets[i]:offsets[i +
+            1]]``.
+
+        order: np.ndarray or None
+            Row positions sorted by target. ``None`` if rows are already
+            sorted by target (e.g. after `sort_by_target`), in which case the
+            rows of each target are a contiguous slice.
     """
-    return results[results['target_id'].isin(targets)].reset_index(drop=True)
\ No newline at end of file
+
+    def __init__(self, target_ids):
+        codes, vocabulary = pd.factorize(np.asarray(target_ids), sort=True)
+        self.vocabulary = np.asarray(vocabulary, dtype=object)
+        # Rows with missing target ids are placed last and are not indexed
+        codes[codes < 0] = len(self.vocabulary)
+        counts = np.bincount(codes, minlength=len(self.vocabulary) + 1)
+        self.offsets = np.concatenate(([0], np.cumsum(counts[:-1])))
+        if np.all(codes[1:] >= codes[:-1]):
+            self.order = None
+        else:
+            self.order = np.argsort(codes, kind='stable')
+        self._codes = {target: code for code, target in
+                       enumerate(self.vocabulary)}
+
+    def __len__(self):
+        return len(self.vocabulary)
+
+    def __contains__(self, target):
+        return target in self._codes
+
+    @property
+    def targets(self):
+        return list(self.vocabulary)
+
+    def rows(self, target):
+        """
+        Returns the rows of a target.
+
+        Args:
+            target: str
+                Target id.
+
+        Returns:
+            rows: slice or np.ndarray
+                A slice if rows are sorted by target, else an array with row
+                positions.
+        """
+        code = self._codes[target]
+        start, stop = self.offsets[code], self.offsets[code + 1]
+        if self.order is None:
+            return slice(start, stop)
+        return self.order[start:stop]
+
+    def items(self):
+        """Iterates over (target, rows) pairs. See `rows`. """
+        for target in self.vocabulary:
+            yield target, self.rows(target)
+
+    def positions(self, targets):
+        """
+        Returns the row positions of multiple targets. Targets not in the index
+        are ignored.
+
+        Args:
+            targets: list
+                Target ids.
+
+        Returns:
+            positions: np.ndarray or slice
+                Row positions, in ascending order. A slice is returned if rows
+                are sorted by target and the requested targets are contiguous
+                in the vocabulary.
+        """
+        codes = np.unique([self._codes[target] for target in targets
+                           if target in self._codes]).astype(int)
+        if len(codes) == 0:
+            return np.array([], dtype=int)
+
+        if self.order is None and codes[-1] - codes[0] + 1 == len(codes):
+            return slice(self.offsets[codes[0]], self.offsets[codes[-1] + 1])
+
+        starts, stops = self.offsets[codes], self.offsets[codes + 1]
+        lengths = stops - starts
+        # Concatenated ranges [start, stop) for each target, without a loop
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths,
+                              lengths) + np.arange(lengths.sum())
+        if self.order is None:
+            return positions
+        return np.sort(self.order[positions])
+
+    def mask(self, vocabulary):
+        """
+        Returns a boolean mask (bitset) over a target vocabulary, indicating
+        the targets present in the index.
+
+        Args:
+            vocabulary: np.ndarray
+                Sorted target ids (e.g. as returned by `target_membership`).
+
+        Returns:
+            mask: np.ndarray
+                Boolean array with one entry per target in ``vocabulary``.
+        """
+        vocabulary = np.asarray(vocabulary, dtype=object)
+        pos = np.searchsorted(vocabulary, self.vocabulary)
+        mask = np.zeros(len(vocabulary), dtype=bool)
+        found = pos < len(vocabulary)
+        found[found] = vocabulary[pos[found]] == self.vocabulary[found]
+        mask[pos[found]] = True
+        return mask
+
+
+@profiled
+def sort_by_target(results, target_col='target_id'):
+    """
+    Sorts a results DataFrame by target (stable) and builds its target index.
+    Per-target slices of the sorted DataFrame are contiguous, so filtering by
+    target only requires slicing.
+
+    Args:
+        results: pd.DataFrame
+            Results DataFrame that has column `target_id`.
+
+        target_col: str, optional (default: 'target_id')
+            Target column name.
+
+    Returns:
+        results_sorted: pd.DataFrame
+            Results DataFrame sorted by target.
+
+        target_index: TargetIndex
+            Target index of the sorted DataFrame.
+    """
+    target_index = TargetIndex(results[target_col].values)
+    if target_index.order is not None:
+        results = results.iloc[target_index.order].reset_index(drop=True)
+        target_index = TargetIndex(results[target_col].values)
+
+    return results, target_index
+
+
+@profiled
+def target_membership(target_indexes):
+    """
+    Returns the target membership of multiple results tables as boolean masks
+    over a common target vocabulary. Target set operations then become
+    boolean operations, e.g. union: ``masks.any(axis=0)``, intersection:
+    ``masks.all(axis=0)``, missing targets of table ``i``: ``~masks[i] &
+    masks.any(axis=0)``.
+
+    Args:
+        target_indexes: list or dict
+            Target indexes (`TargetIndex`), one per results table.
+
+    Returns:
+        vocabulary: np.ndarray
+            Sorted union of target ids.
+
+        masks: np.ndarray or dict
+            Boolean array of shape (n_tables, n_targets), or dict with one
+            boolean array per key if ``target_indexes`` is a dict. Both the
+            vocabulary and the masks are empty if no target indexes are
+            provided.
+    """
+    indexes = list(target_indexes.values()) if isinstance(
+        target_indexes, dict) else list(target_indexes)
+    if not indexes:
+        vocabulary = np.array([], dtype=object)
+        masks = np.zeros((0, 0), dtype=bool)
+    else:
+        vocabulary = np.unique(np.concatenate(
+            [index.vocabulary for index in indexes]).astype(object))
+        masks = np.vstack([index.mask(vocabulary) for index in indexes])
+    if isinstance(target_indexes, dict):
+        masks = dict(zip(target_indexes, masks))
+
+    return vocabulary, masks
@@ -0,0 +1,229 @@
+import math
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from postprocessing import combine_outputs_batch, \
+    OUTPUT_COMBINATION_DEFAULTS, REGRESSION_OUTPUTS
+from profiling import profiled
+
+"""
+Streaming extraction of the top-scoring ligands (hit list) of each target
+from screening results that do not fit in memory. Results are read batch by
+batch and merged into a bounded table with at most `k` rows per target, so
+that memory does not depend on the size of the ligand library.
+"""
+
+PAIR_ID_COLS = ['target_id', 'ligand_id']
+
+
+def _iter_batches(paths, columns, batch_size, prog_bar=False):
+    """Iterates over the record batches of parquet files as DataFrames. """
+    files = [pq.ParquetFile(path) for path in paths]
+    batches = (batch.to_pandas() for file in files for batch in
+               file.iter_batches(batch_size=batch_size, columns=columns))
+    if prog_bar:
+        num_rows = sum(file.metadata.num_rows for file in files)
+        batches = tqdm(batches, total=math.ceil(num_rows / batch_size))
+    return batches
+
+
+def _select_top(candidates, k):
+    """Keeps the top ``k`` rows of each target (``k`` is an int or a Series
+    indexed by target). Ties are broken by ligand id, so that the selection
+    does not depend on the order in which results are read. """
+    candidates = candidates.sort_values(
+        by=['target_id', 'y_score', 'ligand_id'],
+        ascending=[True, False, True], na_position='last', kind='mergesort')
+    rank = candidates.groupby('target_id', sort=False,
+                              observed=True).cumcount().to_numpy()
+    limit = k if np.isscalar(k) else \
+        candidates['target_id'].map(k).to_numpy()
+    return candidates[rank < limit]
+
+
+def _merge_top(hits, batch, k):
+    """Merges a batch into the current hit list. The batch is reduced to its
+    own top ``k`` rows per target first, so that only few rows are merged. """
+    batch = _select_top(batch, k)
+    if hits is None:
+        return batch
+    return _select_top(pd.concat((hits, batch), axis='index',
+                                 ignore_index=True), k)
+
+
+def _required_outputs(combine, columns):
+    """Returns the output columns used by an output combination and whether
+    the combination is linear (no classification gating). """
+    combine = dict(OUTPUT_COMBINATION_DEFAULTS, **combine)
+    outputs = [output for output, weight in REGRESSION_OUTPUTS.items()
+               if combine[weight] and output in columns]
+    if combine['use_clf']:
+        outputs.append('y_clf')
+    return outputs, not combine['use_clf']
+
+
+@profiled
+def top_hits(paths, k=100, fraction=None, combine=None, score_col='y_score',
+             average=False, batch_size=2 ** 16, rows_per_partition=2 ** 22,
+             tmp_dir=None, prog_bar=False):
+    """
+    Returns the top-scoring ligands of each target, reading screening results
+    in batches.
+
+    Args:
+        paths: str or list
+            Path(s) of results saved in parquet format (e.g. the shards of a
+            results set). All files must have the same columns.
+
+        k: int, optional (default: 100)
+            Number of hits per target. Ignored if ``fraction`` is specified.
+
+        fraction: float, optional (default: None)
+            Fraction of the ligands of each target to return (at least one
+            ligand per target). Requires an additional pass to count the
+            ligands of each target.
+
+        combine: dict, optional (default: None)
+            Keyword arguments of `postprocessing.combine_outputs`, used to
+            compute the scores. If not specified, the ``score_col`` column is
+            used.
+
+        score_col: str, optional (default: 'y_score')
+            Score column, if ``combine`` is not specified.
+
+        average: bool, optional (default: False)
+            Whether to average scores across rows of the same protein-ligand
+            pair (e.g. across versions/checkpoints, see
+            `ensembling.compute_ensemble_scores`). Rows are spilled to
+            temporary files partitioned by pair, which are then averaged one
+            at a time. If False, each row is ranked as is.
+
+        batch_size: int, optional (default: 65536)
+            Number of rows per batch.
+
+        rows_per_partition: int, optional (default: 4194304)
+            Approximate number of rows per temporary partition, if
+            ``average`` is True.
+
+        tmp_dir: str, optional (default: None)
+            Directory for temporary partitions. Defaults to the system
+            temporary directory.
+
+        prog_bar: bool, optional (default: False)
+            Whether to display a progress bar.
+
+    Returns:
+        hits: pd.DataFrame
+            DataFrame with the following columns: `['target_id', 'ligand_id',
+            'y_true', 'y_score', 'rank']` (`y_true` only if available), sorted
+            by target and rank. Ranks start from 1 and ties are broken by
+            ligand id.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    if fraction is not None and not (0. < fraction <= 1.):
+        raise ValueError(f"``fraction`` must be in range (0, 1] but "
+                         f"{fraction} was provided.")
+
+    columns = pq.read_schema(paths[0]).names
+    label_cols = ['y_true'] if 'y_true' in columns else []
+    if combine is not None:
+        outputs, linear = _required_outputs(combine, columns)
+    else:
+        outputs, linear = [score_col], True
+    # Linear combinations are computed before averaging, so that only one
+    # score column is averaged
+    score_cols = ['y_score'] if linear else outputs
+
+    def score(results):
+        if combine is None:
+            scores = results[score_col].to_numpy(dtype=float)
+        else:
+            scores = combine_outputs_batch(results, [combine])[:, 0]
+        return results[PAIR_ID_COLS + label_cols].assign(y_score=scores)
+
+    batches = _iter_batches(paths, PAIR_ID_COLS + label_cols + outputs,
+                            batch_size, prog_bar=prog_bar)
+    if not average:
+        k = _pair_counts(_iter_batches(
+            paths, ['target_id'], batch_size), fraction) \
+            if fraction is not None else k
+        hits = None
+        for batch in batches:
+            hits = _merge_top(hits, score(batch), k)
+    else:
+        if linear:
+            batches = (score(batch) for batch in batches)
+        num_rows = sum(pq.ParquetFile(path).metadata.num_rows
+                       for path in paths)
+        n_partitions = max(1, math.ceil(num_rows / rows_per_partition))
+        with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp_path:
+            partitions = _spill_partitions(batches, tmp_path, n_partitions)
+
+            def averaged():
+                for partition in partitions:
+                    results = pd.read_parquet(partition).groupby(
+                        by=PAIR_ID_COLS, sort=False, observed=True).agg(
+                        {**{col: 'first' for col in label_cols},
+                         **{col: 'mean' for col in score_cols}}) \
+                        .reset_index(drop=False)
+                    yield results if linear else score(results)
+
+            k = _pair_counts(averaged(), fraction) if fraction is not None \
+                else k
+            hits = None
+            for results in averaged():
+                hits = _merge_top(hits, results, k)
+
+    if hits is None:
+        hits = pd.DataFrame(columns=PAIR_ID_COLS + label_cols + ['y_score'])
+    hits = hits.reset_index(drop=True)
+    hits['rank'] = hits.groupby('target_id', sort=False,
+                                observed=True).cumcount().to_numpy() + 1
+    return hits
+
+
+def _pair_counts(batches, fraction):
+    """Returns the number of hits of each target for a given fraction. """
+    counts = None
+    for batch in batches:
+        batch_counts = batch['target_id'].value_counts()
+        counts = batch_counts if counts is None else counts.add(
+            batch_counts, fill_value=0)
+    if counts is None:
+        return 0
+    return np.maximum(1, np.ceil(fraction * counts)).astype(np.int64)
+
+
+def _spill_partitions(batches, path, n_partitions):
+    """Writes batches into temporary parquet files, partitioned by the hash
+    of the protein-ligand pair, so that all rows of a pair end up in the same
+    partition. Returns the paths of the non-empty partitions. """
+    writers = dict()
+    schema = None
+    try:
+        for batch in batches:
+            partition = pd.util.hash_pandas_object(
+                batch[PAIR_ID_COLS], index=False).to_numpy() % n_partitions
+            if schema is None:
+                schema = pa.Table.from_pandas(batch, preserve_index=False) \
+                    .schema
+            for i in np.unique(partition):
+                table = pa.Table.from_pandas(
+                    batch[partition == i], schema=schema, preserve_index=False)
+                if i not in writers:
+                    writers[i] = pq.ParquetWriter(
+                        os.path.join(path, f'partition_{i}.parquet'), schema)
+                writers[i].write_table(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return [os.path.join(path, f'partition_{i}.parquet')
+            for i in sorted(writers)]
@@ -0,0 +1,589 @@
+import functools
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from ensembling import compute_level_ensemble_scores
+from filtering import TargetIndex
+from metrics import average_score_across_targets
+from parsing import process_target_id, reduce_templates
+from postprocessing import combine_outputs, OUTPUT_COMBINATION_DEFAULTS
+from profiling import profiled
+
+"""
+Incremental evaluation of DENVIS screening results. When new base models
+(version/checkpoint pairs) are added to the output parquet files, only the new
+base models are read, the ensemble averages are updated from running sums and
+counts, and metrics are only recomputed for targets whose final scores have
+changed. The state of each stage is persisted in a directory, so that
+evaluation can be resumed across sessions:
+
+* parsing: size, modification time and md5 checksum of each parquet file;
+* ensembling: content hash of each base model, running sums/counts per
+  protein-ligand pair (`<level>_ensemble.<generation>.parquet`);
+* metrics: content hash of the final scores and metrics of each target
+  (`metrics.parquet`).
+
+Each update writes the running sums/counts into new files (a new generation)
+and then replaces the state file, which names the files of the current
+generation. A crash at any point thus leaves the state of the previous update
+intact, and base models are never counted twice.
+"""
+
+STATE_FILENAME = 'state.json'
+MODEL_COLS = ['version', 'ckpt']
+
+
+def _file_md5(path, chunk_size=2 ** 20):
+    """Returns the md5 checksum of a file, reading it in chunks. """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+
+    return md5.hexdigest()
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _hash_rows(df):
+    """Returns one 64-bit hash per row. """
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def _digest(row_hashes):
+    return hashlib.sha1(np.ascontiguousarray(row_hashes).tobytes()).hexdigest()
+
+
+def _model_hashes(results):
+    """Returns a dict with the content hash of each base model. """
+    row_hashes = _hash_rows(results)
+    return {_model_key(model): _digest(row_hashes[rows]) for model, rows in
+            results.groupby(MODEL_COLS, sort=False).indices.items()}
+
+
+def _model_key(model):
+    """Json-serializable key of a (version, ckpt) tuple. """
+    return json.dumps([np.asarray(value).item() for value in model])
+
+
+def _callable_key(fun):
+    """Stable description of a scoring function (including the arguments of
+    partial functions), used to detect configuration changes. """
+    if isinstance(fun, functools.partial):
+        return [_callable_key(fun.func), [repr(arg) for arg in fun.args],
+                {key: repr(value) for key, value in
+                 sorted(fun.keywords.items())}]
+    return f"{getattr(fun, '__module__', '')}." \
+           f"{getattr(fun, '__qualname__', repr(fun))}"
+
+
+def _write_atomic(path, write):
+    """Writes into a temporary file first, so that a crash does not leave a
+    partially written file behind. """
+    dirname, basename = os.path.split(path)
+    tmp_path = os.path.join(dirname, '.' + basename + '.tmp')
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class EnsembleAccumulator:
+    """
+    Running sums and counts of the scores of each protein-ligand pair across
+    base models. Averages are equivalent to
+    `ensembling.compute_ensemble_scores` with ``version=True`` and
+    ``ckpt=True``, and adding base models takes time linear in the number of
+    added rows.
+
+    Args:
+        pair_id_cols: list
+            The columns that specify a unique protein-ligand pair.
+
+        score_cols: list
+            The columns that will be averaged.
+    """
+
+    def __init__(self, pair_id_cols, score_cols):
+        self.pair_id_cols = list(pair_id_cols)
+        self.score_cols = list(score_cols)
+        self.pairs = pd.DataFrame(columns=self.pair_id_cols + ['y_true'])
+        self.sums = np.zeros((0, len(self.score_cols)))
+        self.counts = np.zeros((0, len(self.score_cols)), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def _positions(self, results):
+        """Returns the pair position of each row, appending unseen pairs. """
+        keys = pd.MultiIndex.from_frame(results[self.pair_id_cols])
+        if len(self.pairs) > 0:
+            positions = pd.MultiIndex.from_frame(
+                self.pairs[self.pair_id_cols]).get_indexer(keys)
+        else:
+            positions = np.full(len(results), -1, dtype=np.intp)
+
+        new = positions < 0
+        if new.any():
+            new_pairs = results.loc[new, self.pair_id_cols + ['y_true']]
+            new_pairs = new_pairs.drop_duplicates(subset=self.pair_id_cols)
+            new_positions = len(self.pairs) + pd.MultiIndex.from_frame(
+                new_pairs[self.pair_id_cols]).get_indexer(keys[new])
+            positions[new] = new_positions
+            self.pairs = new_pairs.reset_index(drop=True) if \
+                len(self.pairs) == 0 else pd.concat(
+                    (self.pairs, new_pairs), axis='index', ignore_index=True)
+            padding = ((0, len(new_pairs)), (0, 0))
+            self.sums = np.pad(self.sums, padding)
+            self.counts = np.pad(self.counts, padding)
+
+        return positions
+
+    def add(self, results):
+        """
+        Adds the scores of one or more base models.
+
+        Args:
+            results: pd.DataFrame
+                Results DataFrame with the pair, `y_true` and score columns.
+
+        Returns:
+            targets: np.ndarray
+                Targets whose scores have changed.
+        """
+        if len(results) == 0:
+            return np.array([], dtype=object)
+
+        positions = self._positions(results)
+        for j, col in enumerate(self.score_cols):
+            values = results[col].to_numpy(dtype=float)
+            valid = ~np.isnan(values)
+            self.sums[:, j] += np.bincount(
+                positions[valid], weights=values[valid],
+                minlength=len(self.pairs))
+            self.counts[:, j] += np.bincount(
+                positions[valid], minlength=len(self.pairs))
+
+        return pd.unique(results['target_id'])
+
+    def means(self, targets=None):
+        """
+        Returns the average scores.
+
+        Args:
+            targets: list, optional (default: None)
+                Only return the pairs of these targets.
+
+        Returns:
+            results: pd.DataFrame
+                Results DataFrame with one row per protein-ligand pair.
+        """
+        if targets is None:
+            rows = slice(None)
+        else:
+            rows = self.pairs['target_id'].isin(targets).to_numpy()
+
+        results = self.pairs[rows].reset_index(drop=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self.sums[rows] / self.counts[rows]
+        for j, col in enumerate(self.score_cols):
+            results[col] = means[:, j]
+
+        return results
+
+    def save(self, path):
+        state = self.pairs.copy()
+        for j, col in enumerate(self.score_cols):
+            state[f'sum__{col}'] = self.sums[:, j]
+            state[f'count__{col}'] = self.counts[:, j]
+        _write_atomic(path, lambda tmp_path: state.to_parquet(
+            tmp_path, index=False))
+
+    @classmethod
+    def load(cls, path, pair_id_cols):
+        state = pd.read_parquet(path)
+        score_cols = [col[len('sum__'):] for col in state.columns
+                      if col.startswith('sum__')]
+        accumulator = cls(pair_id_cols, score_cols)
+        accumulator.pairs = state[accumulator.pair_id_cols + ['y_true']]
+        accumulator.sums = np.array(
+            state[[f'sum__{col}' for col in score_cols]], dtype=float)
+        accumulator.counts = np.array(
+            state[[f'count__{col}' for col in score_cols]], dtype=np.int64)
+        return accumulator
+
+
+class IncrementalEvaluator:
+    """
+    Incrementally evaluates DENVIS screening results (ensembling across all
+    versions and checkpoints, level ensembling, output combination and
+    per-target metrics) as new base models are added to the outputs.
+
+    Base models are assumed to be append-only: base models already included
+    in the ensemble are not re-read, unless the set of base models in a file
+    shrinks (the ensemble of that level is then rebuilt) or ``verify`` is set,
+    in which case all base models are re-read and the ensemble is rebuilt if
+    any of their content hashes has changed.
+
+    Args:
+        state_dir: str
+            Directory where the evaluation state is persisted.
+
+        paths: str or dict
+            Path of results saved in parquet format, or dict with one path per
+            level (e.g. ``{'atom': path_atom, 'surface': path_surface}``).
+
+        scoring: dict
+            Keys are metric names and values are per-target scoring functions
+            that follow the sklearn API (see `metrics.score_per_target`), e.g.
+            ``functools.partial(metrics.ef_score, alpha=0.01)``.
+
+        combine: dict
+            Keyword arguments of `postprocessing.combine_outputs`.
+
+        atom_weight: float, optional (default: 0.5)
+            Weight of the first level, if there are two levels (see
+            `ensembling.compute_level_ensemble_scores`).
+
+        use_target_intersection: bool, optional (default: False)
+            See `ensembling.compute_level_ensemble_scores`.
+
+        dataset: str, optional (default: None)
+            Dataset name. For `LIT-PCBA`, target ids are split into
+            `target_id` and `target_pdb` and scores are reduced (max) across
+            PDB templates after output combination.
+
+        target_binary: bool, optional (default: True)
+            Whether the target variable should be boolean.
+
+        verify: bool, optional (default: False)
+            Whether to verify the content of base models that have already
+            been included when a file changes.
+    """
+
+    def __init__(self, state_dir, paths, scoring, combine, atom_weight=0.5,
+                 use_target_intersection=False, dataset=None,
+                 target_binary=True, verify=False):
+        if isinstance(paths, str):
+            paths = {None: paths}
+        if len(paths) not in (1, 2):
+            raise ValueError("Either one or two levels are supported.")
+        for name in combine:
+            if name not in OUTPUT_COMBINATION_DEFAULTS:
+                raise ValueError(f"Unsupported output combination argument "
+                                 f"``{name}``.")
+
+        self.state_dir = state_dir
+        self.paths = dict(paths)
+        self.scoring = dict(scoring)
+        self.combine = dict(combine)
+        self.atom_weight = atom_weight
+        self.use_target_intersection = use_target_intersection
+        self.dataset = dataset
+        self.target_binary = target_binary
+        self.verify = verify
+        self.pair_id_cols = ['target_id', 'target_pdb', 'ligand_id'] \
+            if dataset == 'LIT-PCBA' else ['target_id', 'ligand_id']
+
+        os.makedirs(state_dir, exist_ok=True)
+        self._state = self._read_state()
+        self._accumulators = dict()
+        for level_ in self.paths:
+            level_state = self._state['levels'].get(self._level_key(level_))
+            if level_state is not None and 'accumulator' in level_state:
+                self._accumulators[level_] = EnsembleAccumulator.load(
+                    os.path.join(state_dir, level_state['accumulator']),
+                    self.pair_id_cols)
+        self._metrics = pd.read_parquet(self._metrics_path()) \
+            if os.path.exists(self._metrics_path()) else None
+
+    @staticmethod
+    def _level_key(level_):
+        return 'default' if level_ is None else str(level_)
+
+    def _accumulator_filename(self, level_, generation):
+        return f'{self._level_key(level_)}_ensemble.{generation:06d}.parquet'
+
+    def _remove_old_accumulators(self):
+        """Removes the accumulator files that are not used by the state (e.g.
+        of previous generations or interrupted updates). """
+        used = {level_state.get('accumulator') for level_state in
+                self._state['levels'].values()}
+        for file in os.listdir(self.state_dir):
+            if '_ensemble.' in file and file.endswith('.parquet') and \
+                    file not in used:
+                os.remove(os.path.join(self.state_dir, file))
+
+    def _metrics_path(self):
+        return os.path.join(self.state_dir, 'metrics.parquet')
+
+    def _config(self):
+        """Configuration of the stages following ensembling. Cached metrics
+        are discarded when it changes. """
+        return {
+            'levels': [self._level_key(level_) for level_ in self.paths],
+            'atom_weight': self.atom_weight,
+            'use_target_intersection': self.use_target_intersection,
+            'combine': dict(OUTPUT_COMBINATION_DEFAULTS, **self.combine),
+            'dataset': self.dataset,
+            'target_binary': self.target_binary,
+            'scoring': {name: _callable_key(fun) for name, fun in
+                        sorted(self.scoring.items())}}
+
+    def _read_state(self):
+        path = os.path.join(self.state_dir, STATE_FILENAME)
+        if not os.path.exists(path):
+            return {'levels': dict(), 'config': None, 'generation': 0}
+
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_state(self):
+        def write(tmp_path):
+            with open(tmp_path, 'w') as f:
+                json.dump(self._state, f, indent=2, sort_keys=True)
+
+        _write_atomic(os.path.join(self.state_dir, STATE_FILENAME), write)
+
+    def _read(self, path, models=None):
+        """Reads (the specified base models of) a parquet file. Returns the
+        results and the content hashes of the base models. """
+        filters = None if models is None else [
+            [(col, '=', value) for col, value in zip(MODEL_COLS, model)]
+            for model in models]
+        results = pd.read_parquet(path, filters=filters)
+        model_hashes = _model_hashes(results)
+
+        if self.dataset == 'LIT-PCBA':
+            results = process_target_id(results, self.dataset)
+        if self.target_binary:
+            results['y_true'] = results['y_true'].astype(bool)
+
+        return results, model_hashes
+
+    def _update_level(self, level_):
+        """Brings the ensemble of a level up to date. Returns a status string,
+        the number of added base models and the targets whose scores have
+        changed (None for all targets). """
+        path = self.paths[level_]
+        key = self._level_key(level_)
+        level_state = self._state['levels'].get(key)
+        signature = _file_signature(path)
+
+        if level_state is not None and level_ in self._accumulators:
+            # Checksums are only computed if the file may have changed
+            if all(level_state['file'][name] == value for name, value in
+                   signature.items()):
+                return 'unchanged', 0, []
+            md5 = _file_md5(path)
+            if md5 == level_state['file']['md5']:
+                level_state['file'].update(signature)
+                return 'unchanged', 0, []
+        else:
+            level_state, md5 = None, _file_md5(path)
+
+        models = pq.read_table(path, columns=MODEL_COLS).to_pandas() \
+            .drop_duplicates()
+        models = [tuple(model) for model in models.itertuples(index=False)]
+        known = dict() if level_state is None else level_state['models']
+        new_models = [model for model in models
+                      if _model_key(model) not in known]
+        removed = set(known) - {_model_key(model) for model in models}
+
+        if not (level_state is None or removed or self.verify or new_models):
+            level_state['file'].update(signature, md5=md5)
+            return 'unchanged', 0, []
+
+        if level_state is None or removed or self.verify:
+            results, model_hashes = self._read(path)
+            rebuild = level_state is None or bool(removed) or any(
+                model_hashes[model] != model_hash
+                for model, model_hash in known.items())
+        else:
+            results, model_hashes = self._read(path, new_models)
+            rebuild = False
+
+        if rebuild:
+            status = 'rebuilt'
+            score_cols = [col for col in results.columns if col not in
+                          self.pair_id_cols + MODEL_COLS + ['y_true']]
+            self._accumulators[level_] = EnsembleAccumulator(
+                self.pair_id_cols, score_cols)
+            known = dict()
+        else:
+            status = 'updated' if new_models else 'unchanged'
+            new_keys = {_model_key(model) for model in new_models}
+            rows = np.zeros(len(results), dtype=bool)
+            for model, model_rows in results.groupby(
+                    MODEL_COLS, sort=False).indices.items():
+                rows[model_rows] = _model_key(model) in new_keys
+            results = results[rows]
+
+        targets = self._accumulators[level_].add(results)
+        changed_targets = None if rebuild else list(targets)
+        known = dict(known, **{model: model_hashes[model] for model in
+                               model_hashes if model not in known})
+        self._state['levels'][key] = dict(
+            self._state['levels'].get(key, dict()),
+            file=dict(signature, md5=md5, path=os.path.abspath(path)),
+            models=known)
+
+        return status, len(model_hashes) if rebuild else len(new_models), \
+            changed_targets
+
+    def _final_results(self, targets=None):
+        """Final (combined) scores of the specified targets. """
+        levels = list(self.paths)
+        if len(levels) == 2:
+            results = compute_level_ensemble_scores(
+                self._accumulators[levels[0]].means(targets),
+                self._accumulators[levels[1]].means(targets),
+                atom_weight=self.atom_weight,
+                use_target_intersection=self.use_target_intersection,
+                pair_id_cols=self.pair_id_cols)
+        else:
+            results = self._accumulators[levels[0]].means(targets)
+
+        results = combine_outputs(results, **self.combine)
+        if self.dataset == 'LIT-PCBA':
+            results = reduce_templates(results, reduce='max')
+        return results.sort_values(
+            by=['target_id', 'ligand_id']).reset_index(drop=True)
+
+    def _all_targets(self):
+        targets = [self._accumulators[level_].pairs['target_id'] for level_ in
+                   self.paths]
+        if len(targets) == 2 and self.use_target_intersection:
+            return set(targets[0]) & set(targets[1])
+        return set(pd.concat(targets).unique())
+
+    @profiled
+    def update(self):
+        """
+        Brings the evaluation up to date with the result files.
+
+        Returns:
+            report: dict
+                Status of each level (`unchanged`, `updated` or `rebuilt`),
+                number of new base models, and number of targets whose scores
+                and metrics have been recomputed.
+        """
+        report = {'levels': dict()}
+        changed_targets = set()
+        recompute_all = self._state['config'] != self._config() or \
+            self._metrics is None
+        for level_ in self.paths:
+            status, n_models, targets = self._update_level(level_)
+            report['levels'][self._level_key(level_)] = {
+                'status': status, 'new_models': n_models}
+            if targets is None:
+                recompute_all = True
+            else:
+                changed_targets.update(targets)
+
+        all_targets = self._all_targets()
+        if recompute_all:
+            changed_targets = all_targets
+        changed_targets = sorted(changed_targets & all_targets)
+
+        recomputed = self._update_metrics(changed_targets, all_targets)
+        report.update({'changed_targets': len(changed_targets),
+                       'recomputed_targets': recomputed})
+
+        # The accumulators of the new generation are only used once the state
+        # has been replaced
+        generation = self._state.get('generation', 0) + 1
+        for level_, accumulator in self._accumulators.items():
+            level_state = self._state['levels'][self._level_key(level_)]
+            if report['levels'][self._level_key(level_)]['status'] != \
+                    'unchanged' or 'accumulator' not in level_state:
+                level_state['accumulator'] = self._accumulator_filename(
+                    level_, generation)
+                accumulator.save(os.path.join(self.state_dir,
+                                              level_state['accumulator']))
+        self._state['generation'] = generation
+        self._state['config'] = self._config()
+        self._write_state()
+        self._remove_old_accumulators()
+
+        return report
+
+    def _update_metrics(self, targets, all_targets):
+        """Recomputes metrics of targets whose final scores have changed.
+        Returns the number of recomputed targets. """
+        metrics = self._metrics
+        if metrics is None or self._state['config'] != self._config():
+            metrics = pd.DataFrame(columns=['target_id', 'hash'] + list(
+                self.scoring))
+        metrics = metrics[metrics['target_id'].isin(all_targets)]
+
+        if len(targets) == 0:
+            self._metrics = metrics.reset_index(drop=True)
+            return 0
+
+        results = self._final_results(targets)
+        y_true = results['y_true'].to_numpy()
+        y_score = results['y_score'].to_numpy()
+        row_hashes = _hash_rows(results[['ligand_id', 'y_true', 'y_score']])
+        cached = dict(zip(metrics['target_id'], metrics['hash']))
+
+        rows = []
+        for target, target_rows in TargetIndex(
+                results['target_id'].to_numpy()).items():
+            target_hash = _digest(row_hashes[target_rows])
+            if cached.get(target) == target_hash:
+                continue
+            row = {'target_id': target, 'hash': target_hash}
+            for name, scoring_fun in self.scoring.items():
+                try:
+                    row[name] = scoring_fun(y_true[target_rows],
+                                            y_score[target_rows])
+                except ValueError:
+                    row[name] = np.nan
+            rows.append(row)
+
+        if rows:
+            recomputed = pd.DataFrame(rows, columns=metrics.columns)
+            metrics = pd.concat((metrics[~metrics['target_id'].isin(
+                recomputed['target_id'])], recomputed), axis='index')
+        self._metrics = metrics.sort_values(by='target_id').reset_index(
+            drop=True)
+        _write_atomic(self._metrics_path(), lambda tmp_path: (
+            self._metrics.to_parquet(tmp_path, index=False)))
+
+        return len(rows)
+
+    def scores(self, avg_fun=np.mean):
+        """
+        Returns the metrics of the last `update`.
+
+        Args:
+            avg_fun: callable, optional (default: np.mean)
+                It will be passed to `metrics.average_score_across_targets`.
+
+        Returns:
+            scores: dict
+                Keys are metric names and values are (per-target dict,
+                average) tuples, as returned by e.g.
+                `metrics.compute_auroc_scores`.
+        """
+        if self._metrics is None:
+            raise ValueError("No metrics available; call `update` first.")
+
+        scores = dict()
+        for name in self.scoring:
+            per_target = dict(zip(self._metrics['target_id'],
+                                  self._metrics[name].astype(float)))
+            scores[name] = (per_target, average_score_across_targets(
+                per_target, avg_fun=avg_fun))
+        return scores
+
+    def results(self):
+        """Returns the final (combined) scores of all targets. """
+        return self._final_results()
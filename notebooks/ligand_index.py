@@ -0,0 +1,264 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from ensembling import normalize_scores
+from profiling import profiled
+
+"""
+Ligand-centric inverted index over screening results, e.g. to find the targets
+on which a set of ligands score in the top percentile (selectivity/off-target
+checks) without scanning the results of every target.
+
+The index is stored in a directory as a list of segments. Each segment holds
+the entries (target code, score, per-target percentile rank) of the targets
+that were added together, sorted by ligand code, in CSR format: the entries
+of the ligand with code ``i`` are rows ``indptr[i]:indptr[i + 1]``. Segment
+arrays are saved in `.npy` format and memory-mapped, so that lookups only
+read the rows of the requested ligands. New targets are added as new
+segments, which can be merged with `LigandIndex.compact`.
+"""
+
+INDEX_FILENAME = 'index.json'
+LIGANDS_FILENAME = 'ligands.parquet'
+SEGMENT_ARRAYS = ('indptr', 'targets', 'scores', 'percentiles')
+
+
+def _write_segment(path, ligand_codes, target_codes, scores, percentiles,
+                   num_ligands):
+    """Writes the entries of a segment in CSR format (sorted by ligand). """
+    order = np.lexsort((target_codes, ligand_codes))
+    arrays = {
+        'indptr': np.concatenate(([0], np.cumsum(np.bincount(
+            ligand_codes, minlength=num_ligands)))).astype(np.int64),
+        'targets': target_codes[order].astype(np.int32),
+        'scores': scores[order].astype(np.float32),
+        'percentiles': percentiles[order].astype(np.float32)}
+
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, name + '.npy'), array)
+    os.replace(tmp_path, path)
+
+
+class LigandIndex:
+    """
+    Inverted index from ligands to their (target, score, percentile rank)
+    entries.
+
+    Args:
+        index_dir: str
+            Directory where the index is stored. It is created if it does not
+            exist.
+
+    Attributes:
+        targets: list
+            Indexed targets. The code of a target is its position.
+
+        ligands: pd.Index
+            Indexed ligand ids. The code of a ligand is its position.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        os.makedirs(index_dir, exist_ok=True)
+
+        path = os.path.join(index_dir, INDEX_FILENAME)
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.ligands = pd.Index(pd.read_parquet(os.path.join(
+                index_dir, LIGANDS_FILENAME))['ligand_id'].to_numpy(
+                dtype=object))
+        else:
+            state = {'targets': [], 'segments': [], 'next_segment': 0}
+            self.ligands = pd.Index([], dtype=object)
+        self.targets = state['targets']
+        self._segments = state['segments']
+        self._next_segment = state['next_segment']
+        self._arrays = dict()
+
+    def __len__(self):
+        """Number of entries (target-ligand pairs). """
+        return sum(len(self._segment(segment)['targets'])
+                   for segment in self._segments)
+
+    def _segment(self, segment):
+        """Returns the memory-mapped arrays of a segment. """
+        if segment not in self._arrays:
+            self._arrays[segment] = {
+                name: np.load(os.path.join(self.index_dir, segment,
+                                           name + '.npy'), mmap_mode='r')
+                for name in SEGMENT_ARRAYS}
+        return self._arrays[segment]
+
+    def _write_state(self):
+        """Writes the ligand vocabulary and the list of segments. The index
+        file is replaced last, so that an interrupted update leaves the
+        previous index intact. """
+        ligands_path = os.path.join(self.index_dir, LIGANDS_FILENAME)
+        pd.DataFrame({'ligand_id': self.ligands.to_numpy(dtype=object)}) \
+            .to_parquet(ligands_path + '.tmp', index=False)
+        os.replace(ligands_path + '.tmp', ligands_path)
+
+        path = os.path.join(self.index_dir, INDEX_FILENAME)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'targets': self.targets, 'segments': self._segments,
+                       'next_segment': self._next_segment}, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def _new_segment(self):
+        segment = f'segment_{self._next_segment:06d}'
+        self._next_segment += 1
+        return segment
+
+    @profiled
+    def add(self, results, score_col='y_score'):
+        """
+        Adds the results of new targets to the index, as a new segment.
+
+        Args:
+            results: pd.DataFrame
+                Results DataFrame with one entry (row) per target-ligand pair
+                (e.g. after ensembling and output combination), with columns
+                `target_id`, `ligand_id` and ``score_col``. Targets must not
+                be already indexed.
+
+            score_col: str, optional (default: 'y_score')
+                Score column. Higher scores are better.
+        """
+        results = results[['target_id', 'ligand_id', score_col]]
+        results = results.reset_index(drop=True)
+        target_ids = results['target_id'].astype(str)
+        ligand_ids = results['ligand_id'].astype(str)
+        if len(results) == 0:
+            return
+        indexed = set(self.targets).intersection(target_ids.unique())
+        if indexed:
+            raise ValueError(f"Targets {sorted(indexed)} are already "
+                             f"indexed.")
+        if pd.DataFrame({'target_id': target_ids, 'ligand_id': ligand_ids}) \
+                .duplicated().any():
+            raise ValueError("Found multiple entries for the same "
+                             "target-ligand pair. Results must be ensembled "
+                             "first.")
+
+        percentiles = normalize_scores(
+            results.assign(target_id=target_ids), 'percentile',
+            score_cols=[score_col])[score_col].to_numpy()
+
+        # Codes of new targets and ligands are appended to the vocabularies
+        target_codes, new_targets = pd.factorize(target_ids)
+        target_codes = target_codes + len(self.targets)
+        ligand_codes = self.ligands.get_indexer(ligand_ids)
+        unknown = ligand_codes < 0
+        new_codes, new_ligands = pd.factorize(ligand_ids[unknown])
+        ligand_codes[unknown] = new_codes + len(self.ligands)
+        ligands = self.ligands.append(pd.Index(np.asarray(
+            new_ligands, dtype=object)))
+
+        segment = self._new_segment()
+        _write_segment(os.path.join(self.index_dir, segment), ligand_codes,
+                       target_codes, results[score_col].to_numpy(
+                           dtype=np.float64), percentiles, len(ligands))
+        self.targets = self.targets + list(new_targets)
+        self.ligands = ligands
+        self._segments = self._segments + [segment]
+        self._write_state()
+
+    @profiled
+    def lookup(self, ligand_ids, min_percentile=None):
+        """
+        Returns the entries of multiple ligands.
+
+        Args:
+            ligand_ids: list
+                Ligand ids. Ligands that are not indexed are ignored.
+
+            min_percentile: float, optional (default: None)
+                If specified, only entries with a per-target percentile rank
+                of at least ``min_percentile`` are returned (e.g. ``0.99`` for
+                the top 1%).
+
+        Returns:
+            entries: pd.DataFrame
+                DataFrame with the following columns: `['ligand_id',
+                'target_id', 'score', 'percentile']`. Percentile ranks are in
+                range (0, 1] (1 is the highest score of a target). Entries
+                follow the order of ``ligand_ids``, then the order in which
+                targets were added.
+        """
+        query = np.asarray(ligand_ids, dtype=str).astype(object)
+        codes = self.ligands.get_indexer(query)
+        query_pos = np.flatnonzero(codes >= 0)
+        codes = codes[query_pos]
+
+        frames = []
+        for segment in self._segments:
+            arrays = self._segment(segment)
+            indptr = arrays['indptr']
+            # Ligands added after the segment have no entries in it
+            in_segment = codes < len(indptr) - 1
+            seg_codes, seg_pos = codes[in_segment], query_pos[in_segment]
+            starts = indptr[seg_codes]
+            lengths = indptr[seg_codes + 1] - starts
+            # Rows of all requested ligands: concatenated [start, stop) ranges
+            rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) \
+                + np.arange(lengths.sum())
+            frame = pd.DataFrame({
+                'query_pos': np.repeat(seg_pos, lengths),
+                'target_code': arrays['targets'][rows],
+                'score': arrays['scores'][rows],
+                'percentile': arrays['percentiles'][rows]})
+            if min_percentile is not None:
+                frame = frame[frame['percentile'] >= min_percentile]
+            frames.append(frame)
+
+        if not frames:
+            return pd.DataFrame(columns=['ligand_id', 'target_id', 'score',
+                                         'percentile'])
+        entries = pd.concat(frames, axis='index', ignore_index=True)
+        entries = entries.sort_values(by=['query_pos', 'target_code'],
+                                      kind='mergesort')
+        targets = np.asarray(self.targets, dtype=object)
+        return pd.DataFrame({
+            'ligand_id': query[entries['query_pos'].to_numpy()],
+            'target_id': targets[entries['target_code'].to_numpy()],
+            'score': entries['score'].to_numpy(),
+            'percentile': entries['percentile'].to_numpy()})
+
+    @profiled
+    def compact(self):
+        """Merges all segments into a single segment. """
+        if len(self._segments) <= 1:
+            return
+
+        ligand_codes, target_codes, scores, percentiles = [], [], [], []
+        for segment in self._segments:
+            arrays = self._segment(segment)
+            indptr = np.asarray(arrays['indptr'])
+            ligand_codes.append(np.repeat(np.arange(len(indptr) - 1),
+                                          np.diff(indptr)))
+            target_codes.append(np.asarray(arrays['targets']))
+            scores.append(np.asarray(arrays['scores']))
+            percentiles.append(np.asarray(arrays['percentiles']))
+
+        segment = self._new_segment()
+        _write_segment(os.path.join(self.index_dir, segment),
+                       np.concatenate(ligand_codes),
+                       np.concatenate(target_codes),
+                       np.concatenate(scores), np.concatenate(percentiles),
+                       len(self.ligands))
+        old_segments = self._segments
+        self._segments = [segment]
+        self._write_state()
+
+        self._arrays = dict()
+        for old_segment in old_segments:
+            shutil.rmtree(os.path.join(self.index_dir, old_segment))
@@ -1,9 +1,21 @@
 import math
+import zlib
+
 import numpy as np
+import pandas as pd
+from scipy.stats import norm, rankdata
 from sklearn import metrics as skmetrics
 
 from rdkit.ML.Scoring.Scoring import CalcBEDROC
 
+from filtering import TargetIndex
+from profiling import profiled
+
+# Depth of the ranked list (times BEDROC alpha) above which inactives are
+# counted exactly by `compute_subsampled_scores`. BEDROC weights are at most
+# exp(-BEDROC_DEPTH) times the weight of the first position below it.
+BEDROC_DEPTH = 4.
+
 
 def ef_score(y_true, y_pred, alpha):
     """Enhancement factor score.
@@ -104,7 +116,9 @@ def average_score_across_targets(score, targets=None, avg_fun=np.mean):
             return avg_fun(np.array([score[k] for k in targets]))
 
 
-def score_per_target(y_true, y_score, y_target_id, scoring_fun, **kwargs):
+@profiled
+def score_per_target(y_true, y_score, y_target_id, scoring_fun,
+                     target_index=None, **kwargs):
     """Wrapper function that calculates a specified score for each target
     protein in a screening dataset.
 
@@ -125,6 +139,10 @@ def score_per_target(y_true, y_score, y_target_id, scoring_fun, **kwargs):
             inputs a ``y_true`` and ``y_pred`` or ``y_score``
             array-like objects and return a single score value.
 
+        target_index: filtering.TargetIndex, optional (default: None)
+            Target index of ``y_target_id``. It will be built if not provided;
+            pass it to reuse the same index across multiple metrics.
+
         **kwargs: key, value mappings
             These will be passed into the scoring function call to specify
             additional arguments.
@@ -136,20 +154,21 @@ def score_per_target(y_true, y_score, y_target_id, scoring_fun, **kwargs):
             `sklearn.metrics.roc_auc_score` for which there are only positive/
             negative ground truth labels) a `nan` value is returned.
     """
-    targets = set(y_target_id)
+    if target_index is None:
+        target_index = TargetIndex(y_target_id)
+
     score = dict()
-    for target in targets:
+    for target, rows in target_index.items():
         try:
-            score[target] = scoring_fun(y_true[y_target_id == target],
-                                        y_score[y_target_id == target],
-                                        **kwargs)
+            score[target] = scoring_fun(y_true[rows], y_score[rows], **kwargs)
         except ValueError:
             score[target] = np.nan
 
     return score
 
 
-def compute_auroc_scores(results, avg_fun):
+@profiled
+def compute_auroc_scores(results, avg_fun, target_index=None):
     """
     Computes AUROC metrics (per-target and micro-average).
 
@@ -160,6 +179,9 @@ def compute_auroc_scores(results, avg_fun):
         avg_fun: callable
             It will be passed to `average_score_across_targets`.
 
+        target_index: filtering.TargetIndex, optional (default: None)
+            Target index of ``results``, passed to `score_per_target`.
+
     Returns:
         auroc_per_target: dict
             One key-value pair target protein. Keys are target names and
@@ -172,6 +194,7 @@ def compute_auroc_scores(results, avg_fun):
         y_true=results['y_true'].values,
         y_score=results['y_score'].values,
         y_target_id=results['target_id'].values,
+        target_index=target_index,
         scoring_fun=skmetrics.roc_auc_score)
     auroc_micro = average_score_across_targets(auroc_per_target,
                                                avg_fun=avg_fun)
@@ -179,7 +202,8 @@ def compute_auroc_scores(results, avg_fun):
     return auroc_per_target, auroc_micro
 
 
-def compute_ef_scores(results, alpha, avg_fun):
+@profiled
+def compute_ef_scores(results, alpha, avg_fun, target_index=None):
     """
     Computes EF metrics (per-target and micro-average).
 
@@ -194,6 +218,9 @@ def compute_ef_scores(results, alpha, avg_fun):
         avg_fun: callable
             It will be passed to `average_score_across_targets`.
 
+        target_index: filtering.TargetIndex, optional (default: None)
+            Target index of ``results``, passed to `score_per_target`.
+
     Returns:
         ef_per_target: dict
             One key-value pair target protein. Keys are target names and
@@ -210,6 +237,7 @@ def compute_ef_scores(results, alpha, avg_fun):
         y_true=results['y_true'].values,
         y_score=results['y_score'].values,
         y_target_id=results['target_id'].values,
+        target_index=target_index,
         scoring_fun=ef_score,
         alpha=alpha)
     ef_micro = average_score_across_targets(ef_per_target, avg_fun=avg_fun)
@@ -217,7 +245,8 @@ def compute_ef_scores(results, alpha, avg_fun):
     return ef_per_target, ef_micro
 
 
-def compute_pr_scores(results):
+@profiled
+def compute_pr_scores(results, target_index=None):
     """
     Computes precision-recall curve metrics (per-target and micro-average).
 
@@ -225,6 +254,9 @@ def compute_pr_scores(results):
         results: pd.DataFrame
             Results DataFrame with one entry (row) per target-ligand pair.
 
+        target_index: filtering.TargetIndex, optional (default: None)
+            Target index of ``results``, passed to `score_per_target`.
+
     Returns:
         pr_per_target: dict
             One key-value pair target protein. Keys are target names and
@@ -237,15 +269,18 @@ def compute_pr_scores(results):
         y_true=results['y_true'].values,
         y_score=results['y_score'].values,
         y_target_id=results['target_id'].values,
+        target_index=target_index,
         scoring_fun=skmetrics.precision_recall_curve)
+    # The score argument is passed by position, since it has been renamed
+    # from `probas_pred` to `y_score` in newer versions of scikit-learn
     pr_macro = skmetrics.precision_recall_curve(
-        y_true=results['y_true'].values,
-        probas_pred=results['y_score'].values)
+        results['y_true'].values, results['y_score'].values)
 
     return pr_per_target, pr_macro
 
 
-def compute_bedroc_scores(results, alpha, avg_fun):
+@profiled
+def compute_bedroc_scores(results, alpha, avg_fun, target_index=None):
     """
     Computes BEDROC metrics (per-target and micro-average).
 
@@ -259,6 +294,9 @@ def compute_bedroc_scores(results, alpha, avg_fun):
         avg_fun: callable
             It will be passed to `average_score_across_targets`.
 
+        target_index: filtering.TargetIndex, optional (default: None)
+            Target index of ``results``, passed to `score_per_target`.
+
     Returns:
         bedroc_per_target: dict
             One key-value pair target protein. Keys are target names and
@@ -272,6 +310,7 @@ def compute_bedroc_scores(results, alpha, avg_fun):
         y_true=results['y_true'].values,
         y_score=results['y_score'].values,
         y_target_id=results['target_id'].values,
+        target_index=target_index,
         scoring_fun=bedroc_score,
         alpha=alpha)
     bedroc_micro = average_score_across_targets(bedroc_per_target,
@@ -280,3 +319,392 @@ def compute_bedroc_scores(results, alpha, avg_fun):
     return bedroc_per_target, bedroc_micro
 
 
+def _batched_scores(y_true, y_score, ef_alpha, bedroc_alpha, row_order=None):
+    """Computes AUROC, EF and BEDROC for each column of a score matrix with
+    shared labels. Matches `roc_auc_score`, `ef_score` and `bedroc_score`,
+    including tie handling, if the rows of each column are passed to them in
+    the order given by ``row_order`` (array with the same shape as
+    ``y_score``, defaults to the row order of the matrix). Returns an array
+    of shape (3, number of columns). """
+    num_rows, num_cols = y_score.shape
+    num_actives = y_true.sum()
+    num_inactives = num_rows - num_actives
+    scores = np.full((3, num_cols), np.nan)
+    if num_rows == 0:
+        return scores
+
+    # AUROC (Mann-Whitney U statistic with average ranks for ties)
+    if num_actives > 0 and num_inactives > 0:
+        ranks = rankdata(y_score, axis=0)
+        scores[0] = (ranks[y_true].sum(axis=0) -
+                     num_actives * (num_actives + 1) / 2) / \
+            (num_actives * num_inactives)
+
+    # Labels sorted by descending score, in the same order as `ef_score` and
+    # `bedroc_score` (the order of tied scores depends on the input order)
+    if row_order is None:
+        sorted_true = y_true[np.argsort(y_score, axis=0)[::-1]]
+    else:
+        ordered_score = np.take_along_axis(y_score, row_order, axis=0)
+        sorted_true = np.take_along_axis(
+            y_true[row_order], np.argsort(ordered_score, axis=0)[::-1],
+            axis=0)
+
+    # EF
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores[1] = sorted_true[:math.ceil(num_rows * ef_alpha)].sum(axis=0) \
+            / (num_actives * ef_alpha)
+
+    # BEDROC (see rdkit.ML.Scoring.Scoring.CalcBEDROC)
+    if num_actives > 0:
+        weights = np.exp(-bedroc_alpha * np.arange(1, num_rows + 1) /
+                         num_rows)
+        denom = 1. / num_rows * ((1 - math.exp(-bedroc_alpha)) /
+                                 (math.exp(bedroc_alpha / num_rows) - 1))
+        rie = (weights @ sorted_true) / (num_actives * denom)
+        ratio = num_actives / num_rows
+        rie_max = (1 - math.exp(-bedroc_alpha * ratio)) / \
+            (ratio * (1 - math.exp(-bedroc_alpha)))
+        rie_min = (1 - math.exp(bedroc_alpha * ratio)) / \
+            (ratio * (1 - math.exp(bedroc_alpha)))
+        scores[2] = (rie - rie_min) / (rie_max - rie_min) \
+            if rie_max != rie_min else 1.
+    else:
+        scores[2] = 0.
+
+    return scores
+
+
+@profiled
+def compute_leaderboard(results, avg_fun, ef_alpha=0.01, bedroc_alpha=80.5,
+                        model_cols=None, pair_id_cols=None):
+    """
+    Computes AUROC, EF and BEDROC metrics for each base model (e.g. each
+    version and checkpoint) without ensembling. Results are pivoted once into
+    a (protein-ligand pairs x base models) score matrix, and the metrics of
+    all base models are computed together for each target. Scores are the
+    same as those of `compute_auroc_scores`, `compute_ef_scores` and
+    `compute_bedroc_scores` for each base model, including the order of
+    tied scores, which follows the order of the rows of each base model in
+    ``results``.
+
+    Args:
+        results: pd.DataFrame
+            Results DataFrame with one entry (row) per target-ligand pair and
+            base model (e.g. as returned by `parsing.parse_results_denvis`).
+
+        avg_fun: callable
+            Function that will be used to compute average scores across
+            targets (see `average_score_across_targets`).
+
+        ef_alpha: float, range (0, 1], optional (default: 0.01)
+            Τop-ranking threshold of EF (see `ef_score`).
+
+        bedroc_alpha: float, optional (default: 80.5)
+            Early recognition parameter of BEDROC (see `bedroc_score`).
+
+        model_cols: list, optional (default: ['version', 'ckpt'])
+            The columns that specify a base model.
+
+        pair_id_cols: list, optional (default: ['target_id', 'ligand_id'])
+            The columns that specify a unique protein-ligand pair.
+
+    Returns:
+        scores_per_target: pd.DataFrame
+            Tidy DataFrame with one row per base model and target and the
+            following columns: ``model_cols + ['Target', 'AUROC', 'EF<a>',
+            'BEDROC<a>']`` (e.g. `'EF1'` and `'BEDROC80.5'`).
+
+        scores_per_model: pd.DataFrame
+            DataFrame with one row per base model and the average scores
+            across targets.
+    """
+    if not (0. < ef_alpha <= 1.):
+        raise ValueError("``ef_alpha`` argument must be in range (0, 1] but "
+                         "{} was provided.".format(ef_alpha))
+    if model_cols is None:
+        model_cols = ['version', 'ckpt']
+    if pair_id_cols is None:
+        pair_id_cols = ['target_id', 'ligand_id']
+    metric_names = ['AUROC', 'EF{:g}'.format(100 * ef_alpha),
+                    'BEDROC{:g}'.format(bedroc_alpha)]
+
+    # Score matrix. Pairs that are missing from a base model have NaN scores.
+    pair_codes = results.groupby(by=pair_id_cols, sort=False,
+                                 observed=True).ngroup().to_numpy()
+    model_groups = results.groupby(by=model_cols, sort=True, observed=True)
+    model_codes = model_groups.ngroup().to_numpy()
+    models = model_groups.size().index.to_frame(index=False)
+    num_pairs = pair_codes.max() + 1 if len(results) > 0 else 0
+    score_matrix = np.full((num_pairs, len(models)), np.nan)
+    score_matrix[pair_codes, model_codes] = results['y_score'].to_numpy(
+        dtype=np.float64)
+    # Position of each pair in the rows of each base model (missing pairs are
+    # last)
+    row_matrix = np.full((num_pairs, len(models)), len(results),
+                         dtype=np.int64)
+    row_matrix[pair_codes, model_codes] = np.arange(len(results))
+    pair_rows = np.zeros(num_pairs, dtype=np.int64)
+    pair_rows[pair_codes] = np.arange(len(results))
+    y_true = results['y_true'].to_numpy()[pair_rows].astype(bool)
+
+    target_index = TargetIndex(results['target_id'].to_numpy()[pair_rows])
+    values = np.full((len(target_index), len(models), len(metric_names)),
+                     np.nan)
+    for i, (target, rows) in enumerate(target_index.items()):
+        target_true, target_scores = y_true[rows], score_matrix[rows]
+        row_order = np.argsort(row_matrix[rows], axis=0, kind='stable')
+        missing = np.isnan(target_scores).any(axis=0)
+        complete = np.flatnonzero(~missing)
+        values[i, complete] = _batched_scores(
+            target_true, target_scores[:, complete], ef_alpha,
+            bedroc_alpha, row_order[:, complete]).T
+        # Base models with missing pairs are scored on their own pairs
+        for j in np.flatnonzero(missing):
+            available = ~np.isnan(target_scores[:, j])
+            if available.any():
+                values[i, j] = _batched_scores(
+                    target_true[available], target_scores[available, j:j + 1],
+                    ef_alpha, bedroc_alpha, np.argsort(
+                        row_matrix[rows][available, j:j + 1], axis=0,
+                        kind='stable'))[:, 0]
+
+    scores_per_target = models.iloc[np.tile(
+        np.arange(len(models)), len(target_index))].reset_index(drop=True)
+    scores_per_target['Target'] = np.repeat(target_index.vocabulary,
+                                            len(models))
+    scores_per_model = models.copy()
+    for k, metric in enumerate(metric_names):
+        scores_per_target[metric] = values[:, :, k].ravel()
+        scores_per_model[metric] = [avg_fun(values[:, j, k])
+                                    for j in range(len(models))]
+
+    return scores_per_target, scores_per_model
+
+
+def subsample_size(num_inactives, tolerance, confidence=0.95):
+    """Returns the number of inactives to sample so that the half-width of the
+    confidence interval of a proportion (e.g. AUROC) is at most
+    ``tolerance``: ``n0 = (z * 0.5 / tolerance) ** 2``, with finite population
+    correction. """
+    z = norm.ppf((1 + confidence) / 2)
+    n0 = (z * 0.5 / tolerance) ** 2
+    return int(min(num_inactives, math.ceil(
+        n0 / (1 + (n0 - 1) / max(num_inactives, 1)))))
+
+
+def _bedroc_from_positions(positions, num_rows, alpha):
+    """BEDROC (see `bedroc_score`) computed from the (1-based) positions of
+    the actives in the ranked list. ``positions`` has one row per estimate
+    and one column per active. """
+    num_actives = positions.shape[-1]
+    denom = 1. / num_rows * ((1 - math.exp(-alpha)) /
+                             (math.exp(alpha / num_rows) - 1))
+    rie = np.exp(-alpha * positions / num_rows).sum(axis=-1) / \
+        (num_actives * denom)
+    ratio = num_actives / num_rows
+    rie_max = (1 - math.exp(-alpha * ratio)) / \
+        (ratio * (1 - math.exp(-alpha)))
+    rie_min = (1 - math.exp(alpha * ratio)) / (ratio * (1 - math.exp(alpha)))
+    if rie_max == rie_min:
+        return np.ones(positions.shape[:-1])
+    return (rie - rie_min) / (rie_max - rie_min)
+
+
+def _subsampled_target_scores(y_true, y_score, tolerance, confidence,
+                              ef_alpha, bedroc_alpha, n_draws, rng):
+    """Estimates AUROC, EF and BEDROC of a single target from all actives and
+    a random sample of inactives. Returns the number of sampled inactives and
+    the (estimate, lower bound, upper bound) of each metric. """
+    active_scores = np.sort(y_score[y_true])
+    inactive_scores = y_score[~y_true]
+    num_actives, num_inactives = len(active_scores), len(inactive_scores)
+    num_rows = num_actives + num_inactives
+    num_sampled = subsample_size(num_inactives, tolerance, confidence)
+    sample = np.sort(inactive_scores[rng.choice(
+        num_inactives, size=num_sampled, replace=False)])
+    weight = num_inactives / num_sampled if num_sampled > 0 else 0.
+    z = norm.ppf((1 + confidence) / 2)
+    estimates = np.full((3, 3), np.nan)
+    if num_actives == 0:
+        estimates[2] = 0.  # As in `bedroc_score`
+        return num_sampled, estimates
+
+    # AUROC: mean over sampled inactives of the fraction of actives ranked
+    # above them (ties count as half), with finite population correction
+    if num_sampled > 0:
+        above = num_actives - np.searchsorted(active_scores, sample, 'right')
+        ties = np.searchsorted(active_scores, sample, 'right') - \
+            np.searchsorted(active_scores, sample, 'left')
+        u = (above + 0.5 * ties) / num_actives
+        auroc = u.mean()
+        fpc = 1 - num_sampled / num_inactives
+        se = u.std(ddof=1) * math.sqrt(fpc / num_sampled) \
+            if num_sampled > 1 else 0.
+        estimates[0] = auroc, max(0., auroc - z * se), min(1., auroc + z * se)
+
+    # EF and BEDROC only depend on the positions of the actives, i.e. on the
+    # number of inactives between consecutive actives (gaps). Inactives
+    # scored at or above a threshold (a sampled score below the EF cutoff and
+    # most of the BEDROC weight) are counted exactly, so that EF is exact.
+    # The other gap counts are drawn from the Polya posterior of the sampled
+    # inactives below the threshold (Dirichlet-multinomial, whose mean is the
+    # sampled counts weighted by the inverse sampling fraction). Estimates
+    # are posterior means and bounds use the posterior standard deviation.
+    top = math.ceil(num_rows * ef_alpha)
+    depth = num_rows * max(ef_alpha, min(1., BEDROC_DEPTH / bedroc_alpha))
+    exact, threshold = inactive_scores, -np.inf
+    num_above = math.ceil(depth / weight) if num_sampled > 0 else 0
+    while num_above < num_sampled:
+        candidate = sample[num_sampled - num_above]
+        candidate_exact = inactive_scores[inactive_scores >= candidate]
+        if len(candidate_exact) + num_actives - np.searchsorted(
+                active_scores, candidate, 'left') >= top:
+            exact, threshold = candidate_exact, candidate
+            break
+        num_above *= 2
+    below = sample[sample < threshold]
+    num_unsampled = num_inactives - len(exact) - len(below)
+
+    def gap_counts(scores):
+        # Number of inactives in each gap, by number of actives above them
+        return np.bincount(num_actives - np.searchsorted(
+            active_scores, scores, 'right'), minlength=num_actives + 1)
+
+    sampled_counts = gap_counts(below)
+    gap_draws = np.tile(gap_counts(exact) + sampled_counts,
+                        (max(n_draws, 1), 1))
+    if num_unsampled > 0:
+        # Gaps below the threshold
+        lower = np.arange(num_actives + 1) >= num_actives - np.searchsorted(
+            active_scores, threshold, 'left')
+        proportions = np.zeros(gap_draws.shape)
+        proportions[:, lower] = rng.gamma(
+            sampled_counts[lower] + 0.5, size=(len(gap_draws), lower.sum()))
+        proportions /= proportions.sum(axis=1, keepdims=True)
+        gap_draws += rng.multinomial(num_unsampled, proportions)
+    # Inactives above each active (in ascending order of scores)
+    actives_above = num_actives - np.searchsorted(
+        active_scores, active_scores, 'right')
+    inactives_above = np.cumsum(gap_draws[:, :-1], axis=1)[:, ::-1]
+    positions = 1 + actives_above + inactives_above
+
+    ef = (positions <= top).sum(axis=1) / (num_actives * ef_alpha)
+    bedroc = _bedroc_from_positions(positions, num_rows, bedroc_alpha)
+    for k, values, max_value in ((1, ef, 1 / ef_alpha), (2, bedroc, 1.)):
+        estimate = values.mean()
+        se = values.std(ddof=1) if len(values) > 1 else 0.
+        estimates[k] = estimate, max(0., estimate - z * se), \
+            min(max_value, estimate + z * se)
+
+    return num_sampled, estimates
+
+
+@profiled
+def compute_subsampled_scores(results, avg_fun, tolerance=0.01,
+                              confidence=0.95, ef_alpha=0.01,
+                              bedroc_alpha=80.5, n_draws=200, seed=0,
+                              target_index=None):
+    """
+    Estimates AUROC, EF and BEDROC metrics (per-target and micro-average) from
+    a subsample of the inactives of each target, with confidence bounds.
+
+    All actives of a target are kept, and a random sample of its inactives is
+    drawn without replacement. The sample size is chosen from ``tolerance``
+    (see `subsample_size`), so that targets with fewer inactives are
+    evaluated exactly. Sampled inactives are weighted by the inverse sampling
+    fraction:
+    - AUROC is the mean over sampled inactives of the fraction of actives
+      ranked above them, which is unbiased, and bounds use its standard error
+      with finite population correction.
+    - EF and BEDROC depend on the number of inactives ranked above each
+      active. Inactives ranked above the EF cutoff and most of the BEDROC
+      weight (see `BEDROC_DEPTH`) are counted exactly, using a score
+      threshold estimated from the sample, so that EF is exact. The number
+      of the other inactives above each active is drawn from the Polya
+      posterior of the sample, whose mean is the inverse sampling fraction
+      times the sampled count. BEDROC is estimated by its posterior mean, and
+      bounds use its posterior standard deviation.
+
+    Use it for quick iterations (e.g. grid searches) and confirm the results
+    with `compute_leaderboard` or the `compute_*_scores` functions.
+
+    Args:
+        results: pd.DataFrame
+            Results DataFrame with one entry (row) per target-ligand pair.
+
+        avg_fun: callable
+            Function that will be used to compute average scores across
+            targets (see `average_score_across_targets`).
+
+        tolerance: float, optional (default: 0.01)
+            Target half-width of the AUROC confidence interval.
+
+        confidence: float, optional (default: 0.95)
+            Confidence level of the bounds.
+
+        ef_alpha: float, range (0, 1], optional (default: 0.01)
+            Τop-ranking threshold of EF (see `ef_score`).
+
+        bedroc_alpha: float, optional (default: 80.5)
+            Early recognition parameter of BEDROC (see `bedroc_score`).
+
+        n_draws: int, optional (default: 200)
+            Number of posterior draws for the EF and BEDROC estimates.
+
+        seed: int, optional (default: 0)
+            Random seed. Each target has its own random stream (derived from
+            the seed and the target id), so that the sample of a target does
+            not depend on the other targets.
+
+        target_index: filtering.TargetIndex, optional (default: None)
+            Target index of ``results``.
+
+    Returns:
+        scores_per_target: pd.DataFrame
+            DataFrame with one row per target and the following columns:
+            `['Target', 'num_actives', 'num_inactives', 'num_sampled']` and,
+            for each metric (`'AUROC'`, `'EF<a>'` and `'BEDROC<a>'`), the
+            estimate and its lower/upper bounds (e.g. `'AUROC'`,
+            `'AUROC_low'` and `'AUROC_high'`).
+
+        scores: pd.Series
+            Average estimates across targets.
+    """
+    if not (0. < ef_alpha <= 1.):
+        raise ValueError("``ef_alpha`` argument must be in range (0, 1] but "
+                         "{} was provided.".format(ef_alpha))
+    if not (0. < tolerance < 1.):
+        raise ValueError("``tolerance`` argument must be in range (0, 1) but "
+                         "{} was provided.".format(tolerance))
+    metric_names = ['AUROC', 'EF{:g}'.format(100 * ef_alpha),
+                    'BEDROC{:g}'.format(bedroc_alpha)]
+
+    y_true = results['y_true'].to_numpy().astype(bool)
+    y_score = results['y_score'].to_numpy(dtype=np.float64)
+    if target_index is None:
+        target_index = TargetIndex(results['target_id'].to_numpy())
+
+    rows = []
+    for target, target_rows in target_index.items():
+        rng = np.random.default_rng([seed, zlib.crc32(str(target).encode())])
+        target_true = y_true[target_rows]
+        num_sampled, estimates = _subsampled_target_scores(
+            target_true, y_score[target_rows], tolerance, confidence,
+            ef_alpha, bedroc_alpha, n_draws, rng)
+        row = {'Target': target, 'num_actives': target_true.sum(),
+               'num_inactives': (~target_true).sum(),
+               'num_sampled': num_sampled}
+        for metric, (estimate, low, high) in zip(metric_names, estimates):
+            row.update({metric: estimate, metric + '_low': low,
+                        metric + '_high': high})
+        rows.append(row)
+
+    columns = ['Target', 'num_actives', 'num_inactives', 'num_sampled'] + [
+        metric + suffix for metric in metric_names
+        for suffix in ('', '_low', '_high')]
+    scores_per_target = pd.DataFrame(rows, columns=columns)
+    scores = pd.Series({metric: avg_fun(scores_per_target[metric].to_numpy())
+                        for metric in metric_names})
+
+    return scores_per_target, scores
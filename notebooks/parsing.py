@@ -1,12 +1,30 @@
+import concurrent.futures
+import io
 import os
 import re
+import warnings
 
 import json
 from tqdm import tqdm
 import numpy as np
 import pandas as pd
 
+from profiling import profiled
 
+# Line format of the PDBbind index files (e.g. `INDEX_general_PL_data.2019`):
+# PDB code, resolution, release year, -logKd/Ki, Kd/Ki, reference, ligand name
+PDBBIND_INDEX_PATTERN = (
+    r'^(?P<pdb_code>\w{4})\s+(?P<resolution>\S+)\s+(?P<release_year>\d{4})'
+    r'\s+\S+\s+(?P<metric>Kd|Ki|IC50)(?P<relation><=|>=|=|<|>|~)'
+    r'(?P<value>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)(?P<unit>[munpf]?M)'
+    r'\s+//\s+(?P<reference>\S+)\s*(?P<ligand_name>.*?)\s*$')
+PDBBIND_UNITS = {'M': 1., 'mM': 1e-3, 'uM': 1e-6, 'nM': 1e-9, 'pM': 1e-12,
+                 'fM': 1e-15}
+PDBBIND_METRICS = ['Kd', 'Ki', 'IC50']
+PDBBIND_RELATIONS = ['=', '<', '<=', '>', '>=', '~']
+
+
+@profiled
 def parse_results_denvis(path, metadata_path=None, target_binary=True):
     """
     Parses screening results from (possibly) multiple runs/checkpoints into a
@@ -77,13 +95,15 @@ def _read_format_metadata(path):
     return _format_metadata(_read_metadata(path))
 
 
+@profiled
 def parse_results_vina(path, reduce='max'):
     """
     Parses VINA screening results.
 
     Args:
         path: str
-            Path of results saved in json format.
+            Path of results saved in csv format, or directory with per-target
+            parquet shards produced by `parse_autodock_outputs.py`.
 
         reduce: str, {'max', 'mean', None}
             If `max`, the maximum score for each target-ligand pair
@@ -97,8 +117,12 @@ def parse_results_vina(path, reduce='max'):
             `['target_id', 'ligand_id', 'y_true', 'y_score',
             'version', 'ckpt']`.
     """
-    # First column is index --> discard
-    results_df = pd.read_csv(path)
+    if os.path.isdir(path):
+        # Shard directory: all shards are read as a single dataset (files
+        # starting with '_' or '.', e.g. the manifest, are ignored)
+        results_df = pd.read_parquet(path)
+    else:
+        results_df = pd.read_csv(path)
     # Compatible column names
     results_df = results_df.rename(columns={
         'target_list': 'target_id',
@@ -113,6 +137,7 @@ def parse_results_vina(path, reduce='max'):
         ['target_id', 'ligand_id', 'y_true', 'y_score']]  # Reorder columns
 
 
+@profiled
 def parse_results_gnina(path):
     """
     Parses GNINA screening results.
@@ -138,6 +163,7 @@ def parse_results_gnina(path):
         ['target_id', 'ligand_id', 'y_true', 'y_score']]  # Reorder columns
 
 
+@profiled
 def parse_results_rf_score(path, reduce='max', prog_bar=False):
     """
     Parses RF-score screening results.
@@ -166,6 +192,7 @@ def parse_results_rf_score(path, reduce='max', prog_bar=False):
         prog_bar=prog_bar)
 
 
+@profiled
 def parse_results_nn_score(path, reduce='max', prog_bar=False):
     """
     Parses NN-score screening results.
@@ -225,6 +252,8 @@ def _parse_results_rf_nn_score(path, method, reduce, prog_bar):
 
     results_df['y_true'] = pd.to_numeric(
         results_df['y_true'])  # Convert `y_true` to numeric (int)
+    # Columns of the concatenated rows are of object dtype
+    results_df['y_score'] = pd.to_numeric(results_df['y_score'])
 
     if method == 'rfscore':
         results_df = results_df.dropna()  # Discard invalid entries (null)
@@ -234,6 +263,7 @@ def _parse_results_rf_nn_score(path, method, reduce, prog_bar):
         ['target_id', 'ligand_id', 'y_true', 'y_score']]  # Reorder columns
 
 
+@profiled
 def parse_results_deeppurpose(path, reduce='max'):
     """
     Parses screening results into a single DataFrame.
@@ -259,7 +289,8 @@ def parse_results_deeppurpose(path, reduce='max'):
     with open(path) as f:
         results_json = json.load(f)
 
-    results_df = pd.read_json(results_json)
+    # The file holds the DataFrame as a json string
+    results_df = pd.read_json(io.StringIO(results_json))
 
     # Reduction for multiple chains
     results_df = target_ligand_pair_reduction(results_df, reduce)
@@ -267,20 +298,65 @@ def parse_results_deeppurpose(path, reduce='max'):
     return results_df.reset_index(drop=True)
 
 
+@profiled
+def parse_results_webservice(output, target_id=None):
+    """
+    Parses the output of the Web service (REST API) into the results format
+    used for the other DENVIS outputs.
+
+    Args:
+        output: str or pd.DataFrame
+            Path of the Web service output saved in json format, or the output
+            already loaded into a DataFrame (e.g., with ``pd.read_json``).
+
+        target_id: str, optional (default: None)
+            Target id of the screened protein. If provided, it will be stored
+            in a `target_id` column; the Web service output does not include
+            it.
+
+    Returns:
+        results_df: pd.DataFrame
+            Results DataFrame with the following columns:
+            `['target_id', 'ligand_id', 'modality', 'version', 'y_score_*']`.
+            Duplicate ligand entries are removed keeping the last one, which is
+            how duplicate ligands have been handled in the DENVIS outputs.
+    """
+    if isinstance(output, str):
+        output = pd.read_json(output)
+
+    results_df = output.drop_duplicates(
+        subset=['modality', 'version', 'ligand_id'], keep='last')
+    results_df = results_df.reset_index(drop=True)
+    # Versions are returned as `version_<n>`, convert to int as in the
+    # DENVIS outputs
+    results_df['version'] = results_df['version'].astype(str).str.split(
+        '_').str[-1].astype(int)
+    results_df.insert(0, 'target_id', target_id)
+
+    score_cols = [col for col in results_df if col.startswith('y_score')]
+    return results_df[
+        ['target_id', 'ligand_id', 'modality', 'version'] + score_cols]
+
+
+@profiled
 def target_ligand_pair_reduction(results_df, reduce):
     """Helper function implementing the target/ligand pair reduction logic. """
     # Reduction logic
     if reduce == 'max':
-        results_df = results_df.groupby(by=['target_id', 'ligand_id']).max(
+        results_df = results_df.groupby(
+            by=['target_id', 'ligand_id'], observed=True).max(
             numeric_only=True).reset_index(drop=False)
     elif reduce == 'mean':
-        results_df = results_df.groupby(by=['target_id', 'ligand_id']).mean(
+        results_df = results_df.groupby(
+            by=['target_id', 'ligand_id'], observed=True).mean(
             numeric_only=True).reset_index(drop=False)
     else:
         raise ValueError(f"Unsupported reduce argument f{reduce}.")
 
     return results_df
 
+
+@profiled
 def process_target_id(results_df, dataset):
     """Decouples the `target_id` column into two columns `target_id` and
     target_pdb`. This is required because LIT-PCBA targets are saved as:
@@ -302,12 +378,274 @@ def process_target_id(results_df, dataset):
             'version', 'ckpt']`.
     """
     if dataset == 'LIT-PCBA':
-        def process_row(row):
-            target = row['target_id']
-            target_id, target_pdb = target.split('#')
-            return target_id, target_pdb
+        # Split the unique ids only and map them back to the rows. PDB
+        # templates are stored as a categorical column (integer codes).
+        codes, uniques = pd.factorize(results_df['target_id'])
+        split = pd.Series(uniques).str.split('#', n=1, expand=True)
+        if split.shape[1] != 2 or split[1].isna().any():
+            raise ValueError("LIT-PCBA target ids must be in the "
+                             "`<lit_pcba_id>#<pdb_code>` format.")
+        pdb_codes, pdb_uniques = pd.factorize(split[1], sort=True)
+        results_df['target_id'] = split[0].to_numpy(dtype=object)[codes]
+        results_df['target_pdb'] = pd.Categorical.from_codes(
+            pdb_codes[codes], categories=pdb_uniques)
+
+    return results_df
+
+
+@profiled
+def reduce_templates(results_df, reduce='max', validation_scores=None,
+                     pair_id_cols=None, template_col='target_pdb'):
+    """
+    Reduces the scores of each protein-ligand pair across the PDB templates
+    of a target (LIT-PCBA), in a single grouped reduction.
+
+    Args:
+        results_df: pd.DataFrame
+            Results DataFrame with one row per target, template and ligand
+            (see `process_target_id`).
 
-        results_df[['target_id', 'target_pdb']] = results_df.apply(
-            lambda row: process_row(row), axis=1, result_type='expand')
+        reduce: str, optional (default: 'max')
+            Reduction across templates. One of:
+            * `max`: maximum score across templates;
+            * `mean`: average score across templates;
+            * `best`: scores of the template of each target with the highest
+              validation score (see ``validation_scores``).
+
+        validation_scores: dict or pd.Series, optional (default: None)
+            Validation score of each template, with (target_id, target_pdb)
+            keys. Required if ``reduce == 'best'``.
+
+        pair_id_cols: list, optional (default: ['target_id', 'ligand_id'])
+            The columns that specify a unique protein-ligand pair after
+            reduction. Other numeric columns (apart from `y_true`) are
+            reduced.
+
+        template_col: str, optional (default: 'target_pdb')
+            Template column.
+
+    Returns:
+        results_df: pd.DataFrame
+            Results DataFrame with one row per protein-ligand pair, sorted by
+            pair. The template column is dropped.
+    """
+    if pair_id_cols is None:
+        pair_id_cols = ['target_id', 'ligand_id']
+
+    if reduce == 'best':
+        if validation_scores is None:
+            raise ValueError("``validation_scores`` must be provided when "
+                             "``reduce == 'best'``.")
+        validation_scores = pd.Series(validation_scores, dtype=float)
+        targets = pd.unique(results_df['target_id'])
+        missing = set(targets) - set(
+            validation_scores.index.get_level_values(0))
+        if missing:
+            raise ValueError(f"Validation scores are missing for targets "
+                             f"{sorted(missing)}.")
+        best = pd.MultiIndex.from_tuples(validation_scores.groupby(
+            level=0).idxmax().to_list())
+        keep = pd.MultiIndex.from_arrays([
+            results_df['target_id'],
+            results_df[template_col].astype(object)]).isin(best)
+        results_df = results_df[keep].drop(columns=template_col)
+        return results_df.sort_values(by=pair_id_cols).reset_index(drop=True)
+
+    if reduce not in ('max', 'mean'):
+        raise ValueError(f"Unsupported reduce argument {reduce}.")
+
+    score_cols = [col for col in results_df.select_dtypes('number').columns
+                  if col not in pair_id_cols + ['y_true']]
+    aggregations = {col: reduce for col in score_cols}
+    if 'y_true' in results_df:
+        aggregations['y_true'] = 'first'  # Same label for all templates
+    results_df = results_df.groupby(
+        by=pair_id_cols, sort=True, observed=True).agg(aggregations)
+
+    return results_df.reset_index(drop=False)[
+        pair_id_cols + [col for col in ['y_true'] if col in aggregations] +
+        score_cols]
+
+
+@profiled
+def parse_pdbbind_index(path, cache_path=None):
+    """
+    Parses a PDBbind index file with binding data (e.g.
+    `INDEX_general_PL_data.2019`) into a typed DataFrame. Affinities are
+    converted to molar units, so that Kd, Ki and IC50 values reported in
+    different units are comparable. Lines that cannot be parsed are skipped
+    with a warning.
+
+    Args:
+        path: str
+            Path of the index file.
+
+        cache_path: str, optional (default: None)
+            Path of a parquet cache. If it exists and is more recent than the
+            index file it is read instead; otherwise it is (re-)written after
+            parsing.
+
+    Returns:
+        affinity_df: pd.DataFrame
+            DataFrame with the following columns:
+            * `pdb_code`: PDB code of the complex;
+            * `resolution`: resolution in Angstrom (`nan` for NMR structures);
+            * `release_year`: release year;
+            * `metric`: affinity metric (`Kd`, `Ki` or `IC50`, categorical);
+            * `relation`: relation operator of the reported value (`=`, `<`,
+              `<=`, `>`, `>=`, `~`, categorical);
+            * `affinity`: affinity in molar units (M);
+            * `neg_log_affinity`: -log10 of the affinity in molar units,
+              i.e. pKd/pKi/pIC50;
+            * `reference`: reference file;
+            * `ligand_name`: ligand name (without parentheses).
+    """
+    if cache_path is not None and os.path.exists(cache_path) and \
+            os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        return pd.read_parquet(cache_path)
+
+    with open(path) as f:
+        lines = pd.Series(f.read().splitlines(), dtype=object)
+    lines = lines[~lines.str.startswith('#') & (lines.str.strip() != '')]
+
+    fields = lines.str.extract(PDBBIND_INDEX_PATTERN)
+    invalid = fields['pdb_code'].isna()
+    if invalid.any():
+        warnings.warn(f"Skipped {invalid.sum()} line(s) of {path} that could "
+                      f"not be parsed.")
+        fields = fields[~invalid]
+
+    affinity = fields['value'].astype(float) * fields['unit'].map(
+        PDBBIND_UNITS)
+    affinity_df = pd.DataFrame({
+        'pdb_code': fields['pdb_code'],
+        'resolution': pd.to_numeric(fields['resolution'], errors='coerce'),
+        'release_year': fields['release_year'].astype(int),
+        'metric': pd.Categorical(fields['metric'],
+                                 categories=PDBBIND_METRICS),
+        'relation': pd.Categorical(fields['relation'],
+                                   categories=PDBBIND_RELATIONS),
+        'affinity': affinity,
+        'neg_log_affinity': -np.log10(affinity),
+        'reference': fields['reference'],
+        'ligand_name': fields['ligand_name'].str.replace(
+            r'^\((.*)\)$', r'\1', regex=True)}).reset_index(drop=True)
+
+    if cache_path is not None:
+        affinity_df.to_parquet(cache_path, index=False)
+
+    return affinity_df
+
+
+# Parsers of `load_results`
+PARSERS = {
+    'denvis': parse_results_denvis,
+    'vina': parse_results_vina,
+    'gnina': parse_results_gnina,
+    'rf_score': parse_results_rf_score,
+    'nn_score': parse_results_nn_score,
+    'deeppurpose': parse_results_deeppurpose,
+    'csv': pd.read_csv}
+
+
+def _flatten_paths(path_results, prefix=()):
+    """Returns (key path, path) pairs of a nested dict of paths. """
+    paths = []
+    for key, value in path_results.items():
+        if isinstance(value, dict):
+            paths.extend(_flatten_paths(value, prefix + (key,)))
+        else:
+            paths.append((prefix + (key,), value))
+    return paths
+
+
+def _load_source(path, options):
+    """Parses the results of a single source. """
+    options = dict(options)
+    parser = PARSERS[options.pop('parser')]
+    dataset = options.pop('dataset', None)
+    if parser in (parse_results_rf_score, parse_results_nn_score):
+        options['prog_bar'] = False  # Progress is displayed by the caller
+
+    results_df = parser(path, **options)
+    if parser is parse_results_denvis:
+        results_df, _ = results_df  # Metadata are not returned
+    if dataset is not None:
+        results_df = process_target_id(results_df, dataset)
 
     return results_df
+
+
+@profiled
+def load_results(path_results, parser_options, n_jobs=None,
+                 use_processes=False, prog_bar=False):
+    """
+    Loads the results of multiple sources (e.g. the `PATH_RESULTS` dict of the
+    benchmark notebooks) concurrently.
+
+    Args:
+        path_results: dict
+            Keys are model names and values are paths or (nested) dicts with
+            paths, e.g. ``{'DENVIS-G': {'atom': ..., 'surface': ...}, 'Vina':
+            ...}``.
+
+        parser_options: dict
+            Keys are the (top-level) model names of ``path_results`` and values
+            are dicts with the parser name (`'parser'`, one of the keys of
+            `PARSERS`) and its keyword arguments, e.g. ``{'parser': 'vina',
+            'reduce': 'max'}``. If a `'dataset'` key is provided,
+            `process_target_id` is applied to the parsed results (e.g.
+            ``'dataset': 'LIT-PCBA'``).
+
+        n_jobs: int, optional (default: None)
+            Number of workers. Defaults to the number of CPUs (at most one
+            worker per source).
+
+        use_processes: bool, optional (default: False)
+            Whether to use a process pool instead of a thread pool. Threads
+            are sufficient for parquet sources, since reading and
+            decompression release the GIL, while processes are faster for
+            sources that are parsed in Python (e.g. RF/NN-score).
+
+        prog_bar: bool, optional (default: False)
+            Whether to display a progress bar (one step per source).
+
+    Returns:
+        results: dict
+            Dict with the same structure as ``path_results`` where paths are
+            replaced by results DataFrames, as returned by the respective
+            parser (only the results DataFrame for `parse_results_denvis`).
+    """
+    paths = _flatten_paths(path_results)
+    for keys, _ in paths:
+        if keys[0] not in parser_options:
+            raise ValueError(f"No parser options were provided for "
+                             f"``{keys[0]}``.")
+        if parser_options[keys[0]].get('parser') not in PARSERS:
+            raise ValueError(f"``parser`` of ``{keys[0]}`` must be one of "
+                             f"{list(PARSERS)}.")
+
+    n_jobs = max(1, min(n_jobs or os.cpu_count(), len(paths)))
+    executor_class = concurrent.futures.ProcessPoolExecutor if use_processes \
+        else concurrent.futures.ThreadPoolExecutor
+    results = dict()
+    with executor_class(n_jobs) as executor:
+        futures = {executor.submit(_load_source, path,
+                                   parser_options[keys[0]]): keys
+                   for keys, path in paths}
+        completed = concurrent.futures.as_completed(futures)
+        for future in tqdm(completed, total=len(futures)) if prog_bar \
+                else completed:
+            keys = futures[future]
+            node = results
+            for key in keys[:-1]:
+                node = node.setdefault(key, dict())
+            node[keys[-1]] = future.result()
+
+    # Same key order as ``path_results``
+    def reorder(paths_node, results_node):
+        return {key: reorder(value, results_node.get(key, dict()))
+                if isinstance(value, dict) else results_node[key]
+                for key, value in paths_node.items()}
+
+    return reorder(path_results, results)
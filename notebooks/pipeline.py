@@ -0,0 +1,366 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from parsing import process_target_id
+from postprocessing import combine_outputs_batch, \
+    OUTPUT_COMBINATION_DEFAULTS, REGRESSION_OUTPUTS
+
+
+def read_denvis(paths, dataset=None, target_binary=True, pair_id_cols=None):
+    """
+    Starts a lazy evaluation pipeline from DENVIS screening results.
+
+    Args:
+        paths: str or dict
+            Path of results saved in parquet format, or dict with one path per
+            level (e.g. ``{'atom': path_atom, 'surface': path_surface}``).
+
+        dataset: str, optional (default: None)
+            Dataset name. For `LIT-PCBA`, the `target_id` column will be split
+            into `target_id` and `target_pdb` (see
+            `parsing.process_target_id`).
+
+        target_binary: bool, optional (default: True)
+            Whether the target variable should be boolean.
+
+        pair_id_cols: tuple, optional (default: ['target_id', 'ligand_id'])
+            The columns that specify a unique protein-ligand pair.
+
+    Returns:
+        pipeline: EvaluationPipeline
+            Pipeline with a single read step.
+    """
+    if isinstance(paths, str):
+        paths = {None: paths}
+
+    if pair_id_cols is None:
+        pair_id_cols = ['target_id', 'target_pdb', 'ligand_id'] \
+            if dataset == 'LIT-PCBA' else ['target_id', 'ligand_id']
+
+    return EvaluationPipeline([('read_denvis', {
+        'paths': dict(paths), 'dataset': dataset,
+        'target_binary': target_binary, 'pair_id_cols': list(pair_id_cols)})])
+
+
+class EvaluationPipeline:
+    """
+    Lazy evaluation pipeline. Steps equivalent to
+    `parsing.parse_results_denvis` -> `ensembling.compute_ensemble_scores` ->
+    `ensembling.compute_level_ensemble_scores` ->
+    `postprocessing.combine_outputs` -> `filtering.filter_targets` are
+    recorded as a plan and only executed when results are requested. The plan
+    is optimized before execution:
+
+    * target filters and column selections are pushed down to the parquet
+      read, so only the required targets, outputs and keys are loaded;
+    * averaging, level weighting and output combination are fused in a single
+      pass. If the classification output is not used, the output combination
+      is linear and is applied on each row before averaging, so that only one
+      score column is averaged and blended.
+
+    Checkpoint/version columns that are not averaged are treated as part of
+    the protein-ligand pair key, so levels are only blended within the same
+    checkpoint/version.
+
+    Pipelines are immutable; each method returns a new pipeline. Use
+    `pipeline.read_denvis` to create one.
+
+    Args:
+        steps: list
+            Recorded steps, as (name, parameters) tuples.
+    """
+
+    def __init__(self, steps):
+        self._steps = list(steps)
+
+    def _add_step(self, name, **params):
+        return EvaluationPipeline(self._steps + [(name, params)])
+
+    def _get_steps(self, name):
+        return [params for step, params in self._steps if step == name]
+
+    def ensemble(self, ckpt=False, version=False):
+        """Averages scores across checkpoints and/or versions. See
+        `ensembling.compute_ensemble_scores`. """
+        if self._get_steps('ensemble'):
+            raise ValueError("Ensembling has already been specified.")
+        return self._add_step('ensemble', ckpt=ckpt, version=version)
+
+    def level_ensemble(self, atom_weight, use_target_intersection=False,
+                       levels=('atom', 'surface')):
+        """Computes weighted average scores from two levels (e.g. atom-level
+        and surface-level). See `ensembling.compute_level_ensemble_scores`. """
+        if self._get_steps('level_ensemble'):
+            raise ValueError("Level ensembling has already been specified.")
+        if not (0. <= atom_weight <= 1.):
+            raise ValueError(f"``atom_weight`` must be in range [0, 1] but "
+                             f"{atom_weight} was provided.")
+        return self._add_step(
+            'level_ensemble', atom_weight=atom_weight,
+            use_target_intersection=use_target_intersection,
+            levels=tuple(levels))
+
+    def combine_outputs(self, **kwargs):
+        """Combines network outputs into a final prediction (`y_score`). See
+        `postprocessing.combine_outputs` for the arguments. """
+        if self._get_steps('combine_outputs'):
+            raise ValueError("Output combination has already been specified.")
+        for name in kwargs:
+            if name not in OUTPUT_COMBINATION_DEFAULTS:
+                raise ValueError(f"Unsupported output combination argument "
+                                 f"``{name}``.")
+        return self._add_step(
+            'combine_outputs', **dict(OUTPUT_COMBINATION_DEFAULTS, **kwargs))
+
+    def filter_targets(self, targets):
+        """Keeps only the specified targets. See
+        `filtering.filter_targets`. """
+        return self._add_step('filter_targets', targets=list(targets))
+
+    def select(self, columns):
+        """Keeps only the specified columns in the output. """
+        return self._add_step('select', columns=list(columns))
+
+    def _plan(self, output_cols=None):
+        """Returns the optimized physical plan as a dict. """
+        read = self._steps[0][1]
+        paths = read['paths']
+        pair_id_cols = read['pair_id_cols']
+        ensemble = (self._get_steps('ensemble') or [None])[0]
+        level = (self._get_steps('level_ensemble') or [None])[0]
+        combine = (self._get_steps('combine_outputs') or [None])[0]
+
+        if level is not None:
+            if set(level['levels']) != set(paths):
+                raise ValueError(f"Level ensembling requires results for "
+                                 f"levels {list(level['levels'])}, but "
+                                 f"results for {list(paths)} were "
+                                 f"provided.")
+        elif len(paths) > 1:
+            raise ValueError("Results for multiple levels were provided, but "
+                             "level ensembling has not been specified.")
+
+        # Targets: intersection of all filters
+        targets = None
+        for params in self._get_steps('filter_targets'):
+            targets = params['targets'] if targets is None else [
+                target for target in targets if target in set(
+                    params['targets'])]
+
+        # Keys: version/ckpt remain keys if they are not averaged
+        keys = list(pair_id_cols)
+        for col in ['version', 'ckpt']:
+            if ensemble is None or not ensemble[col]:
+                keys.append(col)
+        averaged = [col for col in ['version', 'ckpt']
+                    if ensemble is not None and ensemble[col]]
+
+        # Outputs required by the output combination
+        available = {level_: pq.read_schema(path).names
+                     for level_, path in paths.items()}
+        if combine is not None:
+            outputs = [output for output, weight in REGRESSION_OUTPUTS.items()
+                       if combine[weight]]
+            if combine['use_clf']:
+                outputs.append('y_clf')
+            # Linear combinations can be applied before averaging
+            fuse_combine = not combine['use_clf']
+        else:
+            outputs = sorted(set.intersection(*[
+                set(col for col in names if col.startswith('y_score') or
+                    col == 'y_clf') for names in available.values()]))
+            fuse_combine = False
+
+        # LIT-PCBA target ids are stored as <lit_pcba_id>#<pdb_code>, so target
+        # filters can only be applied after splitting
+        split_targets = read['dataset'] == 'LIT-PCBA'
+        read_keys = [col for col in keys + averaged if col != 'target_pdb'] \
+            if split_targets else keys + averaged
+        scans = dict()
+        for level_, path in paths.items():
+            columns = list(dict.fromkeys(read_keys + ['y_true'] + outputs))
+            missing = [col for col in columns if col not in available[level_]]
+            if missing:
+                raise ValueError(f"Columns {missing} are not available in "
+                                 f"{path}.")
+            scans[level_] = {
+                'path': path,
+                'columns': columns,
+                'filters': None if (targets is None or split_targets) else [
+                    ('target_id', 'in', targets)]}
+
+        if output_cols is None:
+            selects = self._get_steps('select')
+            output_cols = selects[-1]['columns'] if selects else None
+
+        return {
+            'scans': scans,
+            'targets': targets,
+            'post_filter': split_targets and targets is not None,
+            'keys': keys,
+            'averaged': averaged,
+            'outputs': outputs,
+            'combine': combine,
+            'fuse_combine': fuse_combine,
+            'level': level,
+            'output_cols': output_cols,
+            'dataset': read['dataset'],
+            'target_binary': read['target_binary']}
+
+    def explain(self):
+        """
+        Returns a description of the recorded and optimized plans.
+
+        Returns:
+            explanation: str
+                Human-readable description of the plans.
+        """
+        lines = ['Recorded plan:']
+        for i, (name, params) in enumerate(self._steps, 1):
+            params_str = ', '.join(
+                f'{k}=<{len(v)} targets>' if k == 'targets' else f'{k}={v!r}'
+                for k, v in params.items())
+            lines.append(f'  {i}. {name}({params_str})')
+
+        plan = self._plan()
+        lines.append('Optimized plan:')
+        for level_, scan in plan['scans'].items():
+            name = 'scan' if level_ is None else f'scan[{level_}]'
+            filters = 'none' if scan['filters'] is None else \
+                f"target_id in <{len(plan['targets'])} targets>"
+            lines.append(f"  {name}: {scan['path']}")
+            lines.append(f"    columns={scan['columns']}")
+            lines.append(f"    filters={filters}")
+        if plan['dataset'] == 'LIT-PCBA':
+            lines.append('  split target_id -> (target_id, target_pdb)')
+        if plan['post_filter']:
+            lines.append(f"  filter target_id in <{len(plan['targets'])} "
+                         f"targets>")
+        if plan['fuse_combine']:
+            lines.append(f"  fused per level: combine {plan['outputs']} -> "
+                         f"y_score (per row)")
+        if plan['averaged']:
+            averaged_cols = ['y_score'] if plan['fuse_combine'] else \
+                plan['outputs']
+            lines.append(f"  fused per level: mean of {averaged_cols} over "
+                         f"{plan['averaged']} by {plan['keys']} + ['y_true']")
+        if plan['level'] is not None:
+            how = 'inner' if plan['level']['use_target_intersection'] else \
+                'outer'
+            levels = plan['level']['levels']
+            lines.append(
+                f"  blend levels: {plan['level']['atom_weight']} x "
+                f"{levels[0]} + {1 - plan['level']['atom_weight']} x "
+                f"{levels[1]} ({how} join on {plan['keys']})")
+        if plan['combine'] is not None and not plan['fuse_combine']:
+            lines.append(f"  combine {plan['outputs']} -> y_score")
+        output_cols = plan['output_cols'] or 'all'
+        lines.append(f"  materialize: {output_cols}")
+
+        return '\n'.join(lines)
+
+    def collect(self):
+        """
+        Executes the pipeline.
+
+        Returns:
+            results: pd.DataFrame
+                Results DataFrame, sorted by protein-ligand pair.
+        """
+        return self._execute(self._plan())
+
+    def evaluate(self, scoring):
+        """
+        Executes the pipeline and computes metrics. Only the columns required
+        for computing metrics (`target_id`, `y_true`, `y_score`) are
+        materialized.
+
+        Args:
+            scoring: dict
+                Keys are metric names and values are callables that take a
+                results DataFrame (e.g. ``functools.partial(
+                metrics.compute_auroc_scores, avg_fun=np.median)``).
+
+        Returns:
+            scores: dict
+                Keys are metric names and values are the outputs of the
+                corresponding callables.
+        """
+        if not self._get_steps('combine_outputs'):
+            raise ValueError("Output combination must be specified before "
+                             "computing metrics.")
+        results = self._execute(self._plan(
+            output_cols=['target_id', 'y_true', 'y_score']))
+        return {name: fun(results) for name, fun in scoring.items()}
+
+    def _execute(self, plan):
+        keys = plan['keys']
+        score_cols = ['y_score'] if plan['fuse_combine'] else plan['outputs']
+
+        level_results = dict()
+        for level_, scan in plan['scans'].items():
+            results = pd.read_parquet(scan['path'], columns=scan['columns'],
+                                      filters=scan['filters'])
+            if plan['dataset'] == 'LIT-PCBA':
+                results = process_target_id(results, plan['dataset'])
+            if plan['post_filter']:
+                results = results[results['target_id'].isin(plan['targets'])]
+            if plan['target_binary']:
+                results['y_true'] = results['y_true'].astype(bool)
+
+            if plan['fuse_combine']:
+                # Linear output combination: combine first, so that only one
+                # column is averaged and blended
+                y_score = combine_outputs_batch(results, [plan['combine']])
+                results = results[keys + plan['averaged'] + ['y_true']]
+                results = results.assign(y_score=y_score[:, 0])
+
+            if plan['averaged']:
+                results = results.groupby(
+                    by=keys + ['y_true'], sort=False, observed=True)[
+                    score_cols].mean().reset_index(drop=False)
+            level_results[level_] = results[keys + ['y_true'] + score_cols]
+
+        if plan['level'] is not None:
+            results = _blend_levels(level_results, keys, score_cols,
+                                    **plan['level'])
+        else:
+            results = level_results[None]
+
+        if plan['combine'] is not None and not plan['fuse_combine']:
+            y_score = combine_outputs_batch(results, [plan['combine']])
+            results = results[keys + ['y_true']].assign(y_score=y_score[:, 0])
+
+        results = results.sort_values(by=keys).reset_index(drop=True)
+        if plan['output_cols'] is not None:
+            results = results[plan['output_cols']]
+
+        return results
+
+
+def _blend_levels(level_results, keys, score_cols, atom_weight,
+                  use_target_intersection, levels):
+    """Computes weighted average scores from two levels with a single join.
+    Pairs present in only one level keep the scores of that level, unless
+    ``use_target_intersection`` is set. """
+    first, second = level_results[levels[0]], level_results[levels[1]]
+    merged = pd.merge(first, second, how='inner' if use_target_intersection
+                      else 'outer', on=keys, suffixes=('_1', '_2'),
+                      indicator=True)
+
+    results = merged[keys].copy()
+    both = (merged['_merge'] == 'both').to_numpy()
+    only_first = (merged['_merge'] == 'left_only').to_numpy()
+    results['y_true'] = np.where(only_first | both, merged['y_true_1'],
+                                 merged['y_true_2'])
+    if first['y_true'].dtype == bool:
+        results['y_true'] = results['y_true'].astype(bool)
+    for col in score_cols:
+        score_1 = merged[f'{col}_1'].to_numpy(dtype=float)
+        score_2 = merged[f'{col}_2'].to_numpy(dtype=float)
+        results[col] = np.where(
+            both, atom_weight * score_1 + (1 - atom_weight) * score_2,
+            np.where(only_first, score_1, score_2))
+
+    return results
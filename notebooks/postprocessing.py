@@ -1,9 +1,36 @@
+import itertools
 import warnings
 
 import numpy as np
+import pandas as pd
 from scipy.special import expit as sigmoid
 
+from profiling import profiled
 
+# Regression outputs and the corresponding `combine_outputs` weight arguments
+REGRESSION_OUTPUTS = {
+    'y_score_aff': 'y_aff_weight',
+    'y_score_Kd': 'y_kd_weight',
+    'y_score_Ki': 'y_ki_weight',
+    'y_score_IC50': 'y_ic50_weight'}
+
+# Default values of `combine_outputs` keyword arguments
+OUTPUT_COMBINATION_DEFAULTS = {
+    'y_aff_weight': 0.0,
+    'y_kd_weight': 0.0,
+    'y_ki_weight': 0.0,
+    'y_ic50_weight': 0.0,
+    'use_clf': False,
+    'clf_strategy': None}
+
+
+def _warn_ignored_clf_strategy(clf_strategy):
+    warnings.warn(f"Argument ``clf_strategy`` was set to {clf_strategy}, "
+                  f"but will be ignored because all regression output "
+                  f"weights were set to zero.")
+
+
+@profiled
 def combine_outputs(results, y_aff_weight=0.0, y_kd_weight=0.0,
                     y_ki_weight=0.0, y_ic50_weight=0.0, use_clf=False,
                     clf_strategy=None):
@@ -55,29 +82,6 @@ def combine_outputs(results, y_aff_weight=0.0, y_kd_weight=0.0,
             Results DataFrame with final prediction (`y_score`).
     """
 
-    # Argument checking: raise Exception in case of negative weights
-    for weight, weight_name in zip(
-            [y_aff_weight, y_kd_weight, y_ki_weight, y_ic50_weight],
-            ['y_aff_weight', 'y_Kd_weight', 'y_Ki_weight', 'y_IC50_weight']):
-        if weight < 0.0:
-            raise ValueError(f'Non-zero weights are only supported, but '
-                             f'``{weight_name}`` parameter was set to'
-                             f'{weight}.')
-
-    # Argument checking: raise Exception if output specified but not available
-    for weight, weight_name, output_name in zip(
-            [y_aff_weight, y_kd_weight, y_ki_weight, y_ic50_weight, use_clf],
-            ['y_aff_weight', 'y_kd_weight', 'y_ki_weight', 'y_ic50_weight',
-             'use_clf'],
-            ['y_score_aff', 'y_score_Kd', 'y_score_Ki', 'y_score_IC50',
-             'y_clf']):
-        if weight and (output_name not in results):
-            raise ValueError(
-                f"You have specified that the ``{output_name}`` output should"
-                f"be used (``{weight_name}`` parameter was set to"
-                f"``{weight}``), but the output is not available in the"
-                f"results DataFrame.")
-
     # Issue warning if final output already computed (old screening results)
     if 'y_score' in results:
         warnings.warn(
@@ -85,28 +89,10 @@ def combine_outputs(results, y_aff_weight=0.0, y_kd_weight=0.0,
             "results having been produced prior to this implementation). The "
             "final scores will now be overridden.")
 
-    # Issue warning if both `y_aff_weight` and one of {`y_kd_weight`,
-    # `y_ki_weight, `y_ic50_weight`} are non-negative.
-    if y_aff_weight > 0 and (y_kd_weight > 0 or y_ki_weight > 0 or
-                             y_ic50_weight > 0):
-        warnings.warn(
-            "Both `y_aff_weight` and at least one of {``y_kd_weight``,"
-            "``y_ki_weight``, ``y_ic50_weight``} were set to larger than zero."
-            "Are you sure you want to use both the aggregated and individual"
-            "network outputs?")
-
-    sum_weights_reg = y_aff_weight + y_kd_weight + y_ki_weight + y_ic50_weight
-
-    # If all weights are set to 0.0 and use_clf is False raise an Exception
-    if sum_weights_reg == 0.0:
-        if not use_clf:
-            raise ValueError("At least one of {``y_kd_weight``,"
-                             "``y_ki_weight``, ``y_ic50_weight``} must be"
-                             "non-zero, or ``use_clf``must be ``True``.")
-        else:
-            use_only_clf = True
-    else:
-        use_only_clf = False
+    sum_weights_reg, use_only_clf = _check_output_combination(
+        results, y_aff_weight=y_aff_weight, y_kd_weight=y_kd_weight,
+        y_ki_weight=y_ki_weight, y_ic50_weight=y_ic50_weight,
+        use_clf=use_clf)
 
     if not use_only_clf:  # At least one regression output
         y_score = np.zeros((results.shape[0],))
@@ -141,9 +127,7 @@ def combine_outputs(results, y_aff_weight=0.0, y_kd_weight=0.0,
                                  "DataFrame.")
     else:  # Only classification output
         if clf_strategy is not None:
-            warnings.warn(f"Argument ``clf_strategy`` was set to"
-                          f"{clf_strategy}, but will be ignored because all"
-                          f"regression output weights were set to zero.")
+            _warn_ignored_clf_strategy(clf_strategy)
 
         if 'y_clf' in results:
             y_score = sigmoid(results['y_clf'])
@@ -156,3 +140,255 @@ def combine_outputs(results, y_aff_weight=0.0, y_kd_weight=0.0,
     results_out = results.copy(deep=True)
     results_out['y_score'] = y_score
     return results_out
+
+
+def output_combination_grid(**grid):
+    """
+    Returns all combinations of output combination arguments.
+
+    Args:
+        **grid: key, list mappings
+            Keys are `combine_outputs` arguments (e.g. `y_kd_weight`,
+            `clf_strategy`) and values are lists of values to evaluate.
+            Arguments that are not specified take their default values.
+
+    Returns:
+        configs: list
+            List of dicts with `combine_outputs` keyword arguments, one for
+            each combination of values (cartesian product).
+    """
+    for name in grid:
+        if name not in OUTPUT_COMBINATION_DEFAULTS:
+            raise ValueError(f"Unsupported output combination argument "
+                             f"``{name}``.")
+
+    names = list(grid)
+    return [dict(OUTPUT_COMBINATION_DEFAULTS, **dict(zip(names, values)))
+            for values in itertools.product(*[grid[name] for name in names])]
+
+
+@profiled
+def combine_outputs_batch(results, configs):
+    """
+    Combines network outputs for multiple output combination configurations
+    at once. The regression outputs are stacked once into a matrix and the
+    combined scores for all configurations are computed with a single matrix
+    product. Classification gating is applied to all configurations at once.
+    Scores are equal to the ones computed by `combine_outputs` (up to floating
+    point precision), but the results DataFrame is not copied.
+
+    Args:
+        results: pd.DataFrame
+            Results DataFrame with scores for multiple outputs (e.g.
+            `y_score_aff`, `y_score_Kd`, `y_score_Ki`, `y_score_IC50`,
+            `y_score_clf`).
+
+        configs: list
+            List of dicts with `combine_outputs` keyword arguments (e.g. as
+            returned by `output_combination_grid`).
+
+    Returns:
+        scores: np.ndarray, shape (n_pairs, n_configs)
+            Final predictions, one column per configuration. The array is
+            column-major, so that the scores of each configuration are
+            contiguous in memory.
+    """
+    configs = [dict(OUTPUT_COMBINATION_DEFAULTS, **config)
+               for config in configs]
+    outputs = [output for output in REGRESSION_OUTPUTS if output in results]
+
+    weights = np.zeros((len(outputs), len(configs)))
+    use_only_clf = np.zeros(len(configs), dtype=bool)
+    soft = np.zeros(len(configs), dtype=bool)
+    hard = np.zeros(len(configs), dtype=bool)
+    for j, config in enumerate(configs):
+        for name in config:
+            if name not in OUTPUT_COMBINATION_DEFAULTS:
+                raise ValueError(f"Unsupported output combination argument "
+                                 f"``{name}``.")
+        sum_weights_reg, use_only_clf[j] = _check_output_combination(
+            results, **{name: config[name] for name in REGRESSION_OUTPUTS.
+                        values()}, use_clf=config['use_clf'])
+        if use_only_clf[j]:
+            if config['clf_strategy'] is not None:
+                _warn_ignored_clf_strategy(config['clf_strategy'])
+            continue
+
+        for i, output in enumerate(outputs):
+            weights[i, j] = config[REGRESSION_OUTPUTS[output]] / \
+                sum_weights_reg
+        if config['use_clf']:
+            if config['clf_strategy'] == 'soft':
+                soft[j] = True
+            elif config['clf_strategy'] == 'hard':
+                hard[j] = True
+            else:
+                raise ValueError("Argument ``clf_strategy`` has to be "
+                                 "specified when using a combination of"
+                                 "regression and classification outputs.")
+
+    # Stack outputs once, (n_outputs, n_pairs), and compute all scores with a
+    # single matrix product. Transposing the result gives a column-major
+    # (n_pairs, n_configs) array.
+    outputs_matrix = np.vstack(
+        [results[output].to_numpy(dtype=float) for output in outputs]) \
+        if outputs else np.zeros((0, len(results)))
+    scores = (weights.T @ outputs_matrix).T
+
+    if soft.any() or hard.any() or use_only_clf.any():
+        y_clf = results['y_clf'].to_numpy(dtype=float)
+        if soft.any() or use_only_clf.any():
+            clf_prob = sigmoid(y_clf)
+            scores[:, soft] *= clf_prob[:, np.newaxis]
+            scores[:, use_only_clf] = clf_prob[:, np.newaxis]
+        if hard.any():
+            scores[:, hard] *= (y_clf > 0.)[:, np.newaxis]
+
+    return scores
+
+
+def combined_output_views(results, configs, scores=None):
+    """
+    Lazily yields the combined outputs for multiple output combination
+    configurations. Each view shares the columns of ``results`` and one column
+    of the score matrix, so no data is copied.
+
+    Args:
+        results: pd.DataFrame
+            Results DataFrame with scores for multiple outputs.
+
+        configs: list
+            List of dicts with `combine_outputs` keyword arguments.
+
+        scores: np.ndarray, optional (default: None)
+            Score matrix returned by `combine_outputs_batch` for the same
+            results and configurations. It will be computed if not provided.
+
+    Yields:
+        config: dict
+            Output combination configuration.
+
+        view: CombinedOutputView
+            Results view with final prediction (`y_score`). It can be passed
+            directly to the functions in `metrics`.
+    """
+    if scores is None:
+        scores = combine_outputs_batch(results, configs)
+
+    for j, config in enumerate(configs):
+        yield config, CombinedOutputView(results, scores[:, j])
+
+
+class CombinedOutputView:
+    """
+    Read-only view of a results DataFrame with a final prediction column
+    (`y_score`). Columns are accessed as in a DataFrame (e.g.
+    ``view['y_true']``) without copying the underlying data.
+
+    Args:
+        results: pd.DataFrame
+            Results DataFrame.
+
+        y_score: np.ndarray
+            Final prediction, one value per row of ``results``.
+    """
+
+    def __init__(self, results, y_score):
+        if len(y_score) != len(results):
+            raise ValueError("``y_score`` must have one value per row of "
+                             "``results``.")
+        self._results = results
+        self._y_score = y_score
+
+    @property
+    def columns(self):
+        return self._results.columns.drop('y_score', errors='ignore').append(
+            pd.Index(['y_score']))
+
+    @property
+    def shape(self):
+        return len(self._results), len(self.columns)
+
+    def __len__(self):
+        return len(self._results)
+
+    def __contains__(self, column):
+        return column == 'y_score' or column in self._results
+
+    def __getitem__(self, column):
+        if column == 'y_score':
+            return pd.Series(self._y_score, index=self._results.index,
+                             name='y_score', copy=False)
+        return self._results[column]
+
+    def to_frame(self, columns=None):
+        """
+        Materializes the view into a DataFrame.
+
+        Args:
+            columns: list, optional (default: None)
+                Columns of ``results`` to include along with `y_score`. If not
+                specified, all columns will be included.
+
+        Returns:
+            results: pd.DataFrame
+                Results DataFrame with final prediction (`y_score`).
+        """
+        if columns is None:
+            columns = [col for col in self._results if col != 'y_score']
+        results_out = self._results[list(columns)].copy()
+        results_out['y_score'] = self._y_score
+        return results_out
+
+
+def _check_output_combination(results, y_aff_weight, y_kd_weight, y_ki_weight,
+                              y_ic50_weight, use_clf):
+    """Checks output combination arguments. Returns the sum of regression
+    weights and whether only the classification output is used. """
+    # Argument checking: raise Exception in case of negative weights
+    for weight, weight_name in zip(
+            [y_aff_weight, y_kd_weight, y_ki_weight, y_ic50_weight],
+            ['y_aff_weight', 'y_Kd_weight', 'y_Ki_weight', 'y_IC50_weight']):
+        if weight < 0.0:
+            raise ValueError(f'Non-zero weights are only supported, but '
+                             f'``{weight_name}`` parameter was set to'
+                             f'{weight}.')
+
+    # Argument checking: raise Exception if output specified but not available
+    for weight, weight_name, output_name in zip(
+            [y_aff_weight, y_kd_weight, y_ki_weight, y_ic50_weight, use_clf],
+            ['y_aff_weight', 'y_kd_weight', 'y_ki_weight', 'y_ic50_weight',
+             'use_clf'],
+            ['y_score_aff', 'y_score_Kd', 'y_score_Ki', 'y_score_IC50',
+             'y_clf']):
+        if weight and (output_name not in results):
+            raise ValueError(
+                f"You have specified that the ``{output_name}`` output should"
+                f"be used (``{weight_name}`` parameter was set to"
+                f"``{weight}``), but the output is not available in the"
+                f"results DataFrame.")
+
+    # Issue warning if both `y_aff_weight` and one of {`y_kd_weight`,
+    # `y_ki_weight, `y_ic50_weight`} are non-negative.
+    if y_aff_weight > 0 and (y_kd_weight > 0 or y_ki_weight > 0 or
+                             y_ic50_weight > 0):
+        warnings.warn(
+            "Both `y_aff_weight` and at least one of {``y_kd_weight``,"
+            "``y_ki_weight``, ``y_ic50_weight``} were set to larger than zero."
+            "Are you sure you want to use both the aggregated and individual"
+            "network outputs?")
+
+    sum_weights_reg = y_aff_weight + y_kd_weight + y_ki_weight + y_ic50_weight
+
+    # If all weights are set to 0.0 and use_clf is False raise an Exception
+    if sum_weights_reg == 0.0:
+        if not use_clf:
+            raise ValueError("At least one of {``y_kd_weight``,"
+                             "``y_ki_weight``, ``y_ic50_weight``} must be"
+                             "non-zero, or ``use_clf``must be ``True``.")
+        else:
+            use_only_clf = True
+    else:
+        use_only_clf = False
+
+    return sum_weights_reg, use_only_clf
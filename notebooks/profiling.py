@@ -0,0 +1,281 @@
+import contextlib
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+"""
+Opt-in instrumentation of the evaluation stages. Functions decorated with
+`profiled` record wall time, CPU time, peak allocations (optional) and
+input/output row counts per call, as well as the peak RSS of the process so
+far, while profiling is enabled, e.g.:
+
+    import profiling
+    with profiling.profile(memory=True):
+        results = parse_results_denvis(path)[0]
+        ...
+    profiling.summary()
+    profiling.to_chrome_trace('trace.json')  # Open with chrome://tracing
+
+When profiling is disabled (default), decorated functions only check a flag
+before calling the wrapped function.
+"""
+
+# `tracemalloc.reset_peak` is only available in python>=3.9. Without it, the
+# peak allocations of nested calls are upper bounds.
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+class _State(threading.local):
+    """Per-thread stack of active calls. """
+
+    def __init__(self):
+        self.stack = []
+
+
+_enabled = False
+_memory = False
+_origin = time.perf_counter()
+_records = []
+_state = _State()
+
+
+def _process_max_rss():
+    """Peak resident set size of the process since it started, in bytes (not
+    a per-call peak). """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _num_rows(obj):
+    """Number of rows of a DataFrame, or of the first DataFrame in a tuple
+    (e.g., parser outputs). Returns None for other objects. """
+    if isinstance(obj, tuple) and len(obj) > 0:
+        obj = obj[0]
+    if isinstance(obj, pd.DataFrame):
+        return len(obj)
+    return None
+
+
+def _first_num_rows(args, kwargs):
+    for arg in list(args) + list(kwargs.values()):
+        num_rows = _num_rows(arg)
+        if num_rows is not None:
+            return num_rows
+    return None
+
+
+class _Frame:
+    """Measurements of an active call. """
+
+    def __init__(self, name):
+        self.name = name
+        self.children_wall_time = 0.
+        self.peak_alloc = 0  # Peak allocations of finished nested calls
+        self.start_alloc = None
+        if _memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self.start_alloc = current
+            if _reset_peak is not None:
+                # Keep the peak reached so far by the caller
+                if _state.stack:
+                    parent = _state.stack[-1]
+                    parent.peak_alloc = max(parent.peak_alloc, peak)
+                _reset_peak()
+        self.start_cpu = time.process_time()
+        self.start = time.perf_counter()
+
+    def finish(self):
+        end = time.perf_counter()
+        end_cpu = time.process_time()
+        record = {
+            'name': self.name,
+            'start': self.start - _origin,
+            'wall_time': end - self.start,
+            'cpu_time': end_cpu - self.start_cpu,
+            'self_time': end - self.start - self.children_wall_time,
+            'process_max_rss': _process_max_rss(),
+            'peak_alloc': None}
+        if self.start_alloc is not None and tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], self.peak_alloc)
+            self.peak_alloc = peak
+            record['peak_alloc'] = peak - self.start_alloc
+        return record
+
+
+def profiled(func):
+    """Decorator recording a call of ``func`` every time it is called while
+    profiling is enabled. """
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+
+        stack = _state.stack
+        frame = _Frame(name)
+        stack.append(frame)
+        try:
+            output = func(*args, **kwargs)
+        finally:
+            stack.pop()
+            record = frame.finish()
+            if stack:
+                parent = stack[-1]
+                parent.children_wall_time += record['wall_time']
+                parent.peak_alloc = max(parent.peak_alloc, frame.peak_alloc)
+            # Calls that raise have no output
+            record.update({
+                'depth': len(stack),
+                'thread_id': threading.get_ident(),
+                'rows_in': _first_num_rows(args, kwargs),
+                'rows_out': None})
+            _records.append(record)
+
+        record['rows_out'] = _num_rows(output)
+        return output
+
+    return wrapper
+
+
+def enable(memory=False):
+    """
+    Enables profiling.
+
+    Args:
+        memory: bool, optional (default: False)
+            Whether to measure peak allocations with `tracemalloc`. Tracing
+            allocations slows down execution considerably.
+    """
+    global _enabled, _memory
+    _memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+
+def disable():
+    """Disables profiling (recorded calls are kept, see `reset`). """
+    global _enabled, _memory
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _enabled = False
+    _memory = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Discards all recorded calls. """
+    global _origin
+    del _records[:]
+    _origin = time.perf_counter()
+
+
+@contextlib.contextmanager
+def profile(memory=False, reset_records=True):
+    """
+    Context manager enabling profiling within a block.
+
+    Args:
+        memory: bool, optional (default: False)
+            Whether to measure peak allocations (see `enable`).
+
+        reset_records: bool, optional (default: True)
+            Whether to discard previously recorded calls.
+    """
+    if reset_records:
+        reset()
+    enable(memory=memory)
+    try:
+        yield
+    finally:
+        disable()
+
+
+def records():
+    """
+    Returns the recorded calls.
+
+    Returns:
+        records: pd.DataFrame
+            One row per call with the following columns: `['name', 'start',
+            'wall_time', 'cpu_time', 'self_time', 'process_max_rss',
+            'peak_alloc', 'depth', 'thread_id', 'rows_in', 'rows_out']`.
+            Times are in seconds (`start` is relative to the last `reset`),
+            memory in bytes. `self_time` excludes the time spent in nested
+            profiled calls. `process_max_rss` is the high-water mark of the
+            resident set size of the whole process at the end of the call,
+            including memory used before it. `rows_out` is None for calls that
+            raised an exception.
+    """
+    columns = ['name', 'start', 'wall_time', 'cpu_time', 'self_time',
+               'process_max_rss', 'peak_alloc', 'depth', 'thread_id',
+               'rows_in', 'rows_out']
+    return pd.DataFrame(list(_records), columns=columns)
+
+
+def summary(sort_by='self_time'):
+    """
+    Summarizes the recorded calls per stage (function).
+
+    Args:
+        sort_by: str, optional (default: 'self_time')
+            Column used to sort the stages (descending).
+
+    Returns:
+        summary: pd.DataFrame
+            One row per stage with the number of calls, total wall, CPU and
+            self time, mean wall time, process peak RSS, maximum peak
+            allocations and total input/output rows.
+    """
+    calls = records()
+    summary = calls.groupby('name', sort=False).agg(
+        calls=('wall_time', 'size'),
+        wall_time=('wall_time', 'sum'),
+        mean_wall_time=('wall_time', 'mean'),
+        cpu_time=('cpu_time', 'sum'),
+        self_time=('self_time', 'sum'),
+        process_max_rss=('process_max_rss', 'max'),
+        peak_alloc=('peak_alloc', 'max'),
+        rows_in=('rows_in', 'sum'),
+        rows_out=('rows_out', 'sum'))
+    return summary.sort_values(sort_by, ascending=False)
+
+
+def to_json(path):
+    """Saves the recorded calls in json format (one object per call). """
+    with open(path, 'w') as f:
+        f.write(records().to_json(orient='records', indent=2))
+
+
+def to_chrome_trace(path):
+    """Saves the recorded calls in the Chrome trace event format, which can be
+    opened with chrome://tracing or https://ui.perfetto.dev. """
+    events = []
+    pid = os.getpid()
+    for record in _records:
+        module, _, function = record['name'].rpartition('.')
+        events.append({
+            'name': function,
+            'cat': module,
+            'ph': 'X',  # Complete event
+            'ts': record['start'] * 1e6,  # Microseconds
+            'dur': record['wall_time'] * 1e6,
+            'pid': pid,
+            'tid': record['thread_id'],
+            'args': {key: record[key] for key in [
+                'cpu_time', 'self_time', 'process_max_rss', 'peak_alloc',
+                'rows_in', 'rows_out']}})
+
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,351 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tensorboard.compat.proto import event_pb2, summary_pb2
+from tensorboard.summary.writer.event_file_writer import EventFileWriter
+
+# Network outputs of models trained on PDBbind refined/general sets
+REFINED_HEADS = ('Kd', 'Ki')
+GENERAL_HEADS = ('Kd', 'Ki', 'IC50')
+
+# Synthetic dataset presets. `dude` and `litpcba` mimic the size and class
+# balance of the respective benchmarks; `stress` has ~10^8 pairs per base
+# model in total and is meant to be written to disk with
+# `write_denvis_results`.
+SCALES = {
+    'small': dict(n_targets=10, n_ligands=2000, active_ratio=1 / 51,
+                  n_templates=1, versions=3, ckpts=1),
+    'dude': dict(n_targets=102, n_ligands=11000, active_ratio=1 / 51,
+                 n_templates=1, versions=5, ckpts=3),
+    'litpcba': dict(n_targets=15, n_ligands=(2000, 350000),
+                    active_ratio=1 / 1000, n_templates=(1, 15), versions=5,
+                    ckpts=3),
+    'stress': dict(n_targets=100, n_ligands=1000000, active_ratio=1 / 51,
+                   n_templates=1, versions=1, ckpts=1),
+}
+
+
+def _draw(value, rng):
+    """Returns ``value``, or a random integer in [low, high] if ``value`` is
+    a (low, high) tuple. """
+    if isinstance(value, tuple):
+        low, high = value
+        return int(rng.integers(low, high + 1))
+    return value
+
+
+def iter_denvis_results(n_targets, n_ligands, active_ratio, n_templates=1,
+                        versions=1, ckpts=1, heads=REFINED_HEADS, clf=False,
+                        library_size=None, signal=1.0, seed=0):
+    """
+    Iterates over synthetic DENVIS screening results, one target at a time.
+    Scores of actives are shifted by ``signal`` with respect to decoys, with
+    noise shared across base models (ligand effect) and noise specific to
+    each base model and output.
+
+    Args:
+        n_targets: int
+            Number of targets.
+
+        n_ligands: int or tuple
+            Number of ligands per target, or (low, high) range to draw the
+            number of ligands of each target from.
+
+        active_ratio: float
+            Fraction of active ligands for each target (at least one active).
+
+        n_templates: int or tuple, optional (default: 1)
+            Number of PDB templates per target, or (low, high) range. If the
+            range allows more than one template, target ids are stored as
+            `<target_id>#<pdb_code>` (LIT-PCBA format).
+
+        versions: int, optional (default: 1)
+            Number of versions (runs).
+
+        ckpts: int, optional (default: 1)
+            Number of checkpoints per version.
+
+        heads: tuple, optional (default: ('Kd', 'Ki'))
+            Regression outputs, stored as `y_score_<head>` columns.
+
+        clf: bool, optional (default: False)
+            Whether to include a classification output (`y_clf`).
+
+        library_size: int, optional (default: None)
+            Ligand ids are drawn from a library of this size, so that ligands
+            are shared across targets. Defaults to twice the maximum number of
+            ligands per target.
+
+        signal: float, optional (default: 1.0)
+            Score shift of actives.
+
+        seed: int, optional (default: 0)
+            Random seed.
+
+    Yields:
+        results: pd.DataFrame
+            Results of one target with the following columns:
+            `['target_id', 'ligand_id', 'y_true', 'version', 'ckpt',
+            'y_score_*']`.
+    """
+    rng = np.random.default_rng(seed)
+    max_ligands = max(n_ligands) if isinstance(n_ligands, tuple) else \
+        n_ligands
+    if library_size is None:
+        library_size = 2 * max_ligands
+    multi_template = isinstance(n_templates, tuple) or n_templates > 1
+
+    for target in range(n_targets):
+        n_lig = _draw(n_ligands, rng)
+        n_active = max(1, int(round(n_lig * active_ratio)))
+        y_true = np.zeros(n_lig, dtype=np.int64)
+        y_true[rng.choice(n_lig, size=n_active, replace=False)] = 1
+        # Contiguous window of the library, so that ligands overlap across
+        # targets
+        offset = int(rng.integers(library_size))
+        ligand_id = np.char.add('LIG', ((offset + np.arange(n_lig)) %
+                                        library_size).astype(str))
+        ligand_effect = rng.normal(size=n_lig)
+
+        target_name = f'T{target:04d}'
+        n_tpl = _draw(n_templates, rng)
+        for template in range(n_tpl):
+            target_id = f'{target_name}#P{template:03d}' \
+                if multi_template else target_name
+            template_effect = rng.normal(scale=0.5)
+            frames = []
+            for version in range(versions):
+                for ckpt in range(ckpts):
+                    frame = {
+                        'target_id': np.full(n_lig, target_id, dtype=object),
+                        'ligand_id': ligand_id.astype(object),
+                        'y_true': y_true,
+                        'version': np.full(n_lig, version, dtype=np.int64),
+                        'ckpt': np.full(n_lig, ckpt, dtype=np.int64)}
+                    base = signal * y_true + ligand_effect + template_effect
+                    for head in heads:
+                        frame[f'y_score_{head}'] = (
+                            base + rng.normal(size=n_lig)).astype(np.float32)
+                    if clf:
+                        frame['y_clf'] = (base - 1. + rng.normal(
+                            size=n_lig)).astype(np.float32)
+                    frames.append(pd.DataFrame(frame))
+            yield pd.concat(frames, axis='index', ignore_index=True)
+
+
+def generate_denvis_results(seed=0, **kwargs):
+    """
+    Generates synthetic DENVIS screening results in memory. See
+    `iter_denvis_results` for the arguments.
+
+    Returns:
+        results: pd.DataFrame
+            Results DataFrame in the format of the DENVIS outputs.
+    """
+    return pd.concat(list(iter_denvis_results(seed=seed, **kwargs)),
+                     axis='index', ignore_index=True)
+
+
+def write_denvis_results(path, seed=0, **kwargs):
+    """
+    Generates synthetic DENVIS screening results and writes them to a parquet
+    file one target at a time, so that results larger than memory can be
+    generated. See `iter_denvis_results` for the arguments.
+
+    Args:
+        path: str
+            Output parquet path.
+
+    Returns:
+        num_rows: int
+            Number of rows written.
+    """
+    writer = None
+    num_rows = 0
+    try:
+        for results in iter_denvis_results(seed=seed, **kwargs):
+            table = pa.Table.from_pandas(results, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            num_rows += len(results)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return num_rows
+
+
+def generate_pair_results(n_poses=1, seed=0, **kwargs):
+    """
+    Generates synthetic results with one score per protein-ligand pair (and
+    docking pose), as produced by the baseline methods. See
+    `iter_denvis_results` for the arguments.
+
+    Args:
+        n_poses: int, optional (default: 1)
+            Number of scores (docking poses) per protein-ligand pair.
+
+    Returns:
+        results: pd.DataFrame
+            Results DataFrame with the following columns:
+            `['target_id', 'ligand_id', 'y_true', 'y_score', 'docking_id']`.
+    """
+    kwargs = dict(kwargs, versions=n_poses, ckpts=1, heads=('pose',),
+                  clf=False)
+    results = generate_denvis_results(seed=seed, **kwargs)
+    results = results.rename(columns={'y_score_pose': 'y_score',
+                                      'version': 'docking_id'})
+    return results[['target_id', 'ligand_id', 'y_true', 'y_score',
+                    'docking_id']]
+
+
+def write_vina_results(path, results):
+    """Writes pair results in the AutoDock Vina csv format (see
+    `parsing.parse_results_vina`). """
+    pd.DataFrame({
+        'target_list': results['target_id'],
+        'ligand_list': results['ligand_id'],
+        'score_list': -results['y_score'],  # Scores are stored as negative
+        'y_list': results['y_true']}).to_csv(path, index=False)
+
+
+def write_gnina_results(path, results):
+    """Writes pair results in the GNINA summary format (see
+    `parsing.parse_results_gnina`). """
+    pd.DataFrame({
+        'y_true': results['y_true'],
+        'y_score': results['y_score'],
+        'target_id': results['target_id'],
+        'ligand_id': results['ligand_id'],
+        'model': 'default'}).to_csv(path, sep=' ', header=False, index=False)
+
+
+def write_deeppurpose_results(path, results):
+    """Writes pair results in the DeepPurpose json format (see
+    `parsing.parse_results_deeppurpose`). """
+    with open(path, 'w') as f:
+        json.dump(results[['target_id', 'ligand_id', 'y_true',
+                           'y_score']].to_json(), f)
+
+
+def write_rf_nn_results(path, results):
+    """Writes pair results in the RF-score/NN-score directory format, with one
+    score file per target and method (see `parsing.parse_results_rf_score`
+    and `parsing.parse_results_nn_score`). """
+    for target_id, group in results.groupby('target_id', sort=False):
+        ligand = np.where(group['y_true'].values == 1, 'active', 'decoy')
+        ligand = pd.Series(ligand).str.cat(
+            [group['ligand_id'].astype(str).values,
+             group['docking_id'].astype(str).values], sep='_') + '.pdbqt'
+        os.makedirs(os.path.join(path, target_id, 'pdbqt'), exist_ok=True)
+        for method in ['rfscore', 'nnscore3']:
+            pd.DataFrame({'ligand': ligand.values,
+                          'y_score': group['y_score'].values}).to_csv(
+                os.path.join(path, target_id, 'pdbqt', method), sep=' ',
+                header=False, index=False)
+
+
+def write_pdbbind_index(path, n_complexes, seed=0):
+    """
+    Writes a synthetic PDBbind binding data index (in the format of e.g.
+    `INDEX_general_PL_data.2019`, see `parsing.parse_pdbbind_index`), with
+    affinities of different metrics, relations and units, and NMR structures
+    without resolution.
+
+    Args:
+        path: str
+            Output path.
+
+        n_complexes: int
+            Number of complexes (lines).
+
+        seed: int, optional (default: 0)
+            Random seed.
+    """
+    rng = np.random.default_rng(seed)
+    alphabet = np.array(list('0123456789abcdefghijklmnopqrstuvwxyz'))
+    pdb_code = pd.Series(rng.integers(1, 10, size=n_complexes).astype(str))
+    pdb_code = pdb_code.str.cat([alphabet[rng.integers(
+        len(alphabet), size=n_complexes)] for _ in range(3)])
+    resolution = pd.Series(rng.uniform(1., 3.5, size=n_complexes)).map(
+        '{:.2f}'.format).mask(rng.random(n_complexes) < 0.05, 'NMR')
+    neg_log_affinity = rng.uniform(2., 11., size=n_complexes)
+    # Values are reported in the unit that keeps them in [1, 1000)
+    exponent = 3 * np.ceil(neg_log_affinity / 3)
+    unit = pd.Series(exponent).map({3: 'mM', 6: 'uM', 9: 'nM', 12: 'pM'})
+    value = pd.Series(10 ** (exponent - neg_log_affinity))
+    lines = pdb_code.str.cat([
+        resolution,
+        pd.Series(rng.integers(1990, 2020, size=n_complexes).astype(str)),
+        pd.Series(neg_log_affinity).map('{:.2f}'.format),
+        pd.Series(rng.choice(['Kd', 'Ki', 'IC50'], size=n_complexes)).str.cat(
+            [pd.Series(rng.choice(['=', '=', '=', '<', '>', '~'],
+                                  size=n_complexes)),
+             value.map('{:.2f}'.format), unit]),
+        pd.Series('//', index=pdb_code.index),
+        pdb_code + '.pdf',
+        '(' + pd.Series(rng.integers(1000, size=n_complexes).astype(
+            str)).str.zfill(3).radd('L') + ')'], sep='  ')
+    with open(path, 'w') as f:
+        f.write('# ==============================================\n'
+                '# List of protein-ligand complexes with known binding data\n'
+                '# PDB code, resolution, release year, -logKd/Ki, Kd/Ki, '
+                'reference, ligand name\n')
+        f.write('\n'.join(lines) + '\n')
+
+
+def write_training_logs(logdir, versions=1, n_epochs=50, steps_per_epoch=20,
+                        seed=0):
+    """
+    Writes synthetic TensorBoard event files of the DENVIS models (see
+    `training_logs`), with one run per training dataset, model and version in
+    the `<training_dataset>/<model>/<name>/version_<n>` layout. Each run logs
+    a step loss, an epoch loss and a validation loss.
+
+    Args:
+        logdir: str
+            Output log directory.
+
+        versions: int, optional (default: 1)
+            Number of versions (runs) per training dataset and model.
+
+        n_epochs: int, optional (default: 50)
+            Number of epochs per run.
+
+        steps_per_epoch: int, optional (default: 20)
+            Number of training steps per epoch.
+
+        seed: int, optional (default: 0)
+            Random seed.
+    """
+    rng = np.random.default_rng(seed)
+    for dataset in ['general', 'refined']:
+        for model in ['atom_level', 'surface_level', 'ligand_baseline']:
+            for version in range(versions):
+                writer = EventFileWriter(os.path.join(
+                    logdir, dataset, model, 'default', f'version_{version}'))
+                loss = 2. + rng.random()
+                for epoch in range(n_epochs):
+                    step = epoch * steps_per_epoch
+                    step_losses = loss * np.exp(
+                        -np.arange(step, step + steps_per_epoch) /
+                        (n_epochs * steps_per_epoch)) + rng.normal(
+                        scale=0.1, size=steps_per_epoch)
+                    scalars = [('train/loss_step', step + i, value)
+                               for i, value in enumerate(step_losses)]
+                    scalars += [
+                        ('train/loss_epoch', step, step_losses.mean()),
+                        ('val/loss', step, step_losses.mean() +
+                         abs(rng.normal(scale=0.2)))]
+                    for tag, scalar_step, value in scalars:
+                        writer.add_event(event_pb2.Event(
+                            wall_time=1.6e9 + scalar_step, step=scalar_step,
+                            summary=summary_pb2.Summary(value=[
+                                summary_pb2.Summary.Value(
+                                    tag=tag, simple_value=value)])))
+                writer.close()
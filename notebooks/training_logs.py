@@ -0,0 +1,295 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+from tensorboard.compat.proto import event_pb2
+from tensorboard.util import tensor_util
+from tqdm import tqdm
+
+"""
+Reads training/validation losses from local TensorBoard event files, e.g. a
+logdir with the following structure:
+
+    <logdir>/<training_dataset>/<model>/<name>/version_<n>/events.out.tfevents.*
+
+Event files are decoded in parallel, and the scalars of each file can be
+cached (`cache_dir`), so that only files that have grown since the last read
+are read again, starting from the last decoded record.
+"""
+
+EVENT_FILE_PREFIX = 'events.out.tfevents'
+CACHE_INDEX_FILENAME = '_index.json'
+LOSS_TAGS = ('train/loss_epoch', 'val/loss')
+
+# Display names of run name components and tags
+TRAINING_DATASETS = {'general': 'DENVIS-G', 'refined': 'DENVIS-R'}
+MODELS = {
+    'atom_level': 'Atom-level',
+    'surface_level': 'Surface-level',
+    'ligand_baseline': 'Ligand baseline'}
+METRICS = {'train': 'Training loss', 'val': 'Validation loss'}
+
+# TFRecord framing: uint64 length, uint32 length crc, data, uint32 data crc
+_HEADER_SIZE = 12
+_FOOTER_SIZE = 4
+
+
+def list_event_files(logdir):
+    """Returns the paths of all event files in ``logdir`` (relative to
+    ``logdir``, sorted). """
+    event_files = []
+    for root, _, files in os.walk(logdir):
+        for file in files:
+            if file.startswith(EVENT_FILE_PREFIX):
+                event_files.append(os.path.relpath(os.path.join(root, file),
+                                                   logdir))
+
+    return sorted(event_files)
+
+
+def _read_event_file(path, offset=0):
+    """Decodes the scalar summaries of an event file, starting at byte
+    ``offset``. A partially written record at the end of the file is left for
+    the next read. Record checksums are not verified.
+
+    Returns:
+        scalars: dict
+            Tags, steps, values and wall times of the scalars.
+
+        offset: int
+            Offset after the last complete record.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+
+    tags, steps, values, wall_times = [], [], [], []
+    position = 0
+    while position + _HEADER_SIZE <= len(data):
+        length, = struct.unpack('<Q', data[position:position + 8])
+        end = position + _HEADER_SIZE + length
+        if end + _FOOTER_SIZE > len(data):
+            break  # Incomplete record
+
+        event = event_pb2.Event.FromString(
+            data[position + _HEADER_SIZE:end])
+        position = end + _FOOTER_SIZE
+        if event.WhichOneof('what') != 'summary':
+            continue
+
+        for value in event.summary.value:
+            kind = value.WhichOneof('value')
+            if kind == 'simple_value':
+                scalar = value.simple_value
+            elif kind == 'tensor' and \
+                    value.metadata.plugin_data.plugin_name == 'scalars':
+                scalar = tensor_util.make_ndarray(value.tensor).item()
+            else:
+                continue
+            tags.append(value.tag)
+            steps.append(event.step)
+            values.append(scalar)
+            wall_times.append(event.wall_time)
+
+    scalars = {
+        'tag': np.array(tags, dtype=object),
+        'step': np.array(steps, dtype=np.int64),
+        'value': np.array(values, dtype=np.float64),
+        'wall_time': np.array(wall_times, dtype=np.float64)}
+    return scalars, offset + position
+
+
+def _read_cache_index(cache_dir):
+    path = os.path.join(cache_dir, CACHE_INDEX_FILENAME)
+    if not os.path.exists(path):
+        return dict()
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_cache_index(cache_dir, index):
+    """Writes the cache index atomically. """
+    path = os.path.join(cache_dir, CACHE_INDEX_FILENAME)
+    tmp_path = os.path.join(cache_dir, '.' + CACHE_INDEX_FILENAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _shard_name(event_file):
+    return hashlib.sha1(event_file.encode()).hexdigest() + '.parquet'
+
+
+def load_scalars(logdir, cache_dir=None, n_jobs=None, prog_bar=False):
+    """
+    Reads the scalar summaries of all event files in a logdir.
+
+    Args:
+        logdir: str
+            Log directory.
+
+        cache_dir: str, optional (default: None)
+            Directory where the scalars of each event file are cached. If not
+            provided, all event files are read.
+
+        n_jobs: int, optional (default: None)
+            Number of worker processes. Defaults to the number of CPUs.
+
+        prog_bar: bool, optional (default: False)
+            Whether to display a progress bar.
+
+    Returns:
+        scalars: pd.DataFrame
+            DataFrame with the following columns: `['run', 'tag', 'step',
+            'value', 'wall_time']`. Runs are the directories of the event
+            files, relative to ``logdir``.
+    """
+    event_files = list_event_files(logdir)
+    index = dict()
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        index = _read_cache_index(cache_dir)
+
+    # Files that have been cached in full are not read; files that have grown
+    # are read from the last decoded record
+    offsets = dict()
+    for event_file in event_files:
+        size = os.path.getsize(os.path.join(logdir, event_file))
+        entry = index.get(event_file)
+        if entry is not None and os.path.exists(
+                os.path.join(cache_dir, entry['shard'])) and \
+                entry['offset'] <= size:
+            if entry['offset'] < size:
+                offsets[event_file] = entry['offset']
+        else:
+            index.pop(event_file, None)
+            offsets[event_file] = 0
+
+    paths = [os.path.join(logdir, event_file) for event_file in offsets]
+    if n_jobs == 1 or len(paths) <= 1:
+        outputs = map(_read_event_file, paths, offsets.values())
+        outputs = list(tqdm(outputs, total=len(paths)) if prog_bar
+                       else outputs)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(n_jobs) as executor:
+            outputs = executor.map(_read_event_file, paths, offsets.values())
+            outputs = list(tqdm(outputs, total=len(paths)) if prog_bar
+                           else outputs)
+
+    frames = dict()
+    for event_file, (scalars, offset) in zip(offsets, outputs):
+        frame = pd.DataFrame(scalars)
+        if cache_dir is not None:
+            shard = _shard_name(event_file)
+            if event_file in index:  # Append to the cached scalars
+                frame = pd.concat((pd.read_parquet(
+                    os.path.join(cache_dir, shard)), frame), axis='index',
+                    ignore_index=True)
+            frame.to_parquet(os.path.join(cache_dir, shard), index=False)
+            index[event_file] = {'shard': shard, 'offset': offset}
+        frames[event_file] = frame
+    if cache_dir is not None:
+        _write_cache_index(cache_dir, index)
+
+    for event_file in event_files:
+        if event_file not in frames:
+            frames[event_file] = pd.read_parquet(
+                os.path.join(cache_dir, index[event_file]['shard']))
+
+    columns = ['tag', 'step', 'value', 'wall_time']
+    scalars = pd.concat(
+        [frames[event_file][columns] for event_file in event_files] or
+        [pd.DataFrame(columns=columns)], axis='index', ignore_index=True)
+    runs = [os.path.dirname(event_file).replace(os.sep, '/')
+            for event_file in event_files]
+    scalars.insert(0, 'run', pd.Categorical(np.repeat(
+        runs, [len(frames[event_file]) for event_file in event_files])))
+    scalars['tag'] = scalars['tag'].astype('category')
+
+    return scalars.astype({'step': np.int64, 'value': np.float64,
+                           'wall_time': np.float64})
+
+
+def _map_names(values, names, kind):
+    """Maps categorical values to display names, raising an error for
+    unexpected values. """
+    mapped = values.map(names)
+    unknown = values[mapped.isna()]
+    if len(unknown) > 0:
+        raise ValueError(f"Found {kind} {sorted(set(unknown))}.")
+    return mapped
+
+
+def tidy_losses(scalars, tags=LOSS_TAGS):
+    """
+    Converts loss scalars into a tidy DataFrame. Run names must be in the
+    `<training_dataset>/<model>/<name>/version_<n>` format.
+
+    Args:
+        scalars: pd.DataFrame
+            Scalars, as returned by `load_scalars`.
+
+        tags: tuple, optional (default: ('train/loss_epoch', 'val/loss'))
+            Tags to keep.
+
+    Returns:
+        losses: pd.DataFrame
+            Tidy DataFrame with the following columns: `['Training dataset',
+            'Model', 'Version', 'Metric', 'Step', 'Loss']`.
+    """
+    scalars = scalars[scalars['tag'].isin(tags)].reset_index(drop=True)
+
+    # Run name components are parsed once per unique run and tag
+    runs = pd.Series(pd.unique(scalars['run'].astype(str)), dtype=object)
+    components = runs.str.split('/', expand=True)
+    if len(runs) > 0 and (components.shape[1] != 4 or
+                          components.isna().any(axis=None)):
+        raise ValueError(f"Found run names not in the "
+                         f"`<training_dataset>/<model>/<name>/version_<n>` "
+                         f"format: {list(runs)}.")
+    run_df = pd.DataFrame({
+        'Training dataset': _map_names(
+            components[0], TRAINING_DATASETS, 'training dataset'),
+        'Model': _map_names(components[1], MODELS, 'model'),
+        'Version': components[3].str.split('_').str[1].astype(int)}) \
+        if len(runs) > 0 else pd.DataFrame(
+        columns=['Training dataset', 'Model', 'Version'])
+    run_codes = pd.Index(runs).get_indexer(scalars['run'].astype(str))
+
+    metrics = pd.Series(list(tags), dtype=object)
+    metric_names = _map_names(metrics.str.split('/').str[0], METRICS,
+                              'metric')
+    metric_codes = pd.Index(metrics).get_indexer(scalars['tag'].astype(str))
+
+    return pd.DataFrame({
+        'Training dataset': pd.Categorical(
+            run_df['Training dataset'].to_numpy()[run_codes],
+            categories=list(TRAINING_DATASETS.values())),
+        'Model': pd.Categorical(run_df['Model'].to_numpy()[run_codes],
+                                categories=list(MODELS.values())),
+        'Version': run_df['Version'].to_numpy(dtype=np.int64)[run_codes],
+        'Metric': pd.Categorical(metric_names.to_numpy()[metric_codes],
+                                 categories=list(METRICS.values())),
+        'Step': scalars['step'].to_numpy(dtype=np.int64),
+        'Loss': scalars['value'].to_numpy(dtype=np.float64)})
+
+
+def load_training_losses(logdir, tags=LOSS_TAGS, cache_dir=None, n_jobs=None,
+                         prog_bar=False):
+    """
+    Reads training/validation losses from a logdir into a tidy DataFrame. See
+    `load_scalars` and `tidy_losses` for the arguments.
+
+    Returns:
+        losses: pd.DataFrame
+            Tidy DataFrame with the following columns: `['Training dataset',
+            'Model', 'Version', 'Metric', 'Step', 'Loss']`.
+    """
+    scalars = load_scalars(logdir, cache_dir=cache_dir, n_jobs=n_jobs,
+                           prog_bar=prog_bar)
+    return tidy_losses(scalars, tags=tags)
@@ -0,0 +1,702 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
+import sqlite3
+import time
+
+import aiohttp
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from parsing import parse_results_webservice
+
+DEFAULT_URL = 'https://denvis.deeplab.ai'
+MAX_LIGANDS_PER_REQUEST = 100  # Only the first 100 ligands are screened
+RETRY_STATUSES = (429, 500, 502, 503, 504)  # Transient HTTP errors
+
+
+def read_sdf_records(path):
+    """
+    Reads an .sdf ligand library file into a list of records.
+
+    Args:
+        path: str
+            Path of the .sdf file.
+
+    Returns:
+        records: list
+            One string per ligand, including the `$$$$` delimiter line. The
+            delimiter is added to a last record that does not end with one.
+    """
+    records = []
+    record = []
+    with open(path, 'r') as f:
+        for line in f:
+            record.append(line)
+            # mols are separated with $$$$ in the sdf file
+            if line.rstrip('\r\n') == '$$$$':
+                records.append(''.join(record))
+                record = []
+
+    if ''.join(record).strip():
+        if not record[-1].endswith('\n'):
+            record[-1] += '\n'
+        records.append(''.join(record) + '$$$$\n')
+
+    return records
+
+
+def split_records(records, chunk_size=MAX_LIGANDS_PER_REQUEST):
+    """
+    Splits a list of .sdf records into chunks that can be screened with a
+    single request.
+
+    Args:
+        records: list
+            Ligand records, as returned by `read_sdf_records`.
+
+        chunk_size: int, optional (default: 100)
+            Maximum number of ligands per chunk. Must not be larger than 100.
+
+    Returns:
+        chunks: list
+            List of chunks, each one being a list of records.
+    """
+    if not (0 < chunk_size <= MAX_LIGANDS_PER_REQUEST):
+        raise ValueError(f"``chunk_size`` must be in range "
+                         f"(0, {MAX_LIGANDS_PER_REQUEST}], but {chunk_size} "
+                         f"was provided.")
+
+    return [records[i:i + chunk_size]
+            for i in range(0, len(records), chunk_size)]
+
+
+def _chunk_path(work_dir, chunk_id, chunk):
+    """Returns the path where the response for a chunk is stored. The file
+    name includes a checksum of the chunk, so that stale responses are not
+    reused if the library changes. """
+    checksum = hashlib.sha1(''.join(chunk).encode()).hexdigest()[:12]
+    return os.path.join(work_dir, f'chunk_{chunk_id:05d}_{checksum}.json')
+
+
+async def _submit_chunk(session, semaphore, url, model, protein,
+                        crystal_ligand, chunk, max_retries, backoff):
+    """Submits a single chunk of ligands and returns the (json) response text.
+    Transient failures are retried with exponential backoff. """
+    attempt = 0
+    while True:
+        form = aiohttp.FormData()
+        form.add_field('model', model)
+        form.add_field('protein', protein, filename='protein.pdb')
+        form.add_field('crystal_ligand', crystal_ligand,
+                       filename='crystal_ligand.mol2')
+        form.add_field('ligand', ''.join(chunk).encode(),
+                       filename='ligands.sdf')
+        try:
+            async with semaphore:
+                async with session.post(url, data=form) as response:
+                    text = await response.text()
+                    if response.status not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        return text
+                    error = aiohttp.ClientResponseError(
+                        response.request_info, response.history,
+                        status=response.status, message=response.reason)
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+                asyncio.TimeoutError) as e:
+            error = e
+
+        if attempt >= max_retries:
+            raise error
+        # Exponential backoff with jitter
+        await asyncio.sleep(backoff * 2 ** attempt * (1 + random.random()))
+        attempt += 1
+
+
+async def screen_library_async(protein, crystal_ligand, ligands, model,
+                               target_id=None, url=DEFAULT_URL,
+                               chunk_size=MAX_LIGANDS_PER_REQUEST,
+                               max_concurrency=4, max_retries=5, backoff=2.0,
+                               timeout=900., work_dir=None, verify_ssl=False,
+                               cache=None, prog_bar=False):
+    """
+    Asynchronous version of `screen_library`. Use this one from environments
+    that already run an event loop (e.g., Jupyter notebooks), by awaiting it:
+    ``results = await webservice.screen_library_async(...)``. See
+    `screen_library` for the arguments.
+    """
+    with open(protein, 'rb') as f:
+        protein_bytes = f.read()
+    with open(crystal_ligand, 'rb') as f:
+        crystal_ligand_bytes = f.read()
+
+    records = read_sdf_records(ligands)
+    if not records:
+        raise ValueError(f"No ligands found in {ligands}.")
+
+    if cache is not None:
+        # Only the last entry of ligands with duplicate IDs is kept in the
+        # output, so the rest do not need to be screened
+        records = _drop_duplicate_records(records)
+        keys = cache_keys(model, protein_bytes, crystal_ligand_bytes, records)
+        cached = cache.get_many(keys)
+        records_to_screen = [record for record, key in zip(records, keys)
+                             if key not in cached]
+    else:
+        records_to_screen = records
+
+    chunks = split_records(records_to_screen, chunk_size=chunk_size)
+    if work_dir is not None:
+        os.makedirs(work_dir, exist_ok=True)
+
+    pbar = tqdm(total=len(chunks), disable=not prog_bar)
+    responses = [None] * len(chunks)
+    pending = []
+    for chunk_id, chunk in enumerate(chunks):
+        if work_dir is not None:
+            path = _chunk_path(work_dir, chunk_id, chunk)
+            if os.path.exists(path):  # Resume: chunk screened in previous run
+                with open(path) as f:
+                    responses[chunk_id] = f.read()
+                pbar.update(1)
+                continue
+        pending.append(chunk_id)
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    connector = aiohttp.TCPConnector(limit=max_concurrency,
+                                     ssl=None if verify_ssl else False)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def run_chunk(session, chunk_id):
+        text = await _submit_chunk(
+            session, semaphore, url, model, protein_bytes,
+            crystal_ligand_bytes, chunks[chunk_id], max_retries, backoff)
+        responses[chunk_id] = text
+        if work_dir is not None:
+            # Write into a temporary file first so that a crash does not leave
+            # a partial response behind
+            path = _chunk_path(work_dir, chunk_id, chunks[chunk_id])
+            with open(path + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(path + '.tmp', path)
+        pbar.update(1)
+
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=client_timeout) as session:
+        outcomes = await asyncio.gather(
+            *[run_chunk(session, chunk_id) for chunk_id in pending],
+            return_exceptions=True)
+    pbar.close()
+
+    failed = {chunk_id: outcome for chunk_id, outcome in zip(pending, outcomes)
+              if isinstance(outcome, BaseException)}
+    if failed:
+        resume_msg = " Re-run with the same ``work_dir`` to resume." \
+            if work_dir is not None else ""
+        raise RuntimeError(
+            f"{len(failed)} out of {len(chunks)} chunks failed (chunk ids: "
+            f"{sorted(failed)}). First error: "
+            f"{failed[min(failed)]!r}.{resume_msg}")
+
+    if cache is None:
+        return merge_responses(responses, target_id=target_id)
+
+    # Store new scores in the cache and merge them with the cached ones,
+    # preserving library order
+    screened = _split_responses_by_ligand(responses)
+    cache.put_many({
+        key: screened[_record_id(record)]
+        for record, key in zip(records, keys)
+        if key not in cached and _record_id(record) in screened})
+    rows = []
+    for record, key in zip(records, keys):
+        value = cached[key] if key in cached else screened.get(
+            _record_id(record), '[]')
+        rows.extend(json.loads(value))
+    if not rows:
+        return parse_results_webservice(_empty_output(), target_id=target_id)
+    output = pd.DataFrame.from_records(rows)
+    output['ligand_id'] = output['ligand_id'].astype(str)
+    return parse_results_webservice(output, target_id=target_id)
+
+
+def screen_library(protein, crystal_ligand, ligands, model, target_id=None,
+                   url=DEFAULT_URL, chunk_size=MAX_LIGANDS_PER_REQUEST,
+                   max_concurrency=4, max_retries=5, backoff=2.0, timeout=900.,
+                   work_dir=None, verify_ssl=False, cache=None,
+                   prog_bar=False):
+    """
+    Screens an arbitrarily large ligand library with the Web service. The
+    library is split into chunks of at most 100 ligands, which are submitted
+    concurrently over a pooled HTTP connection. Chunk responses are merged
+    into a single results DataFrame.
+
+    If a cache is provided, only ligands whose scores are not cached for the
+    same model, protein and crystal ligand are submitted.
+
+    Args:
+        protein: str
+            Path of the protein file in .pdb format.
+
+        crystal_ligand: str
+            Path of the crystal ligand file in .mol2 format, used to specify
+            the protein pocket.
+
+        ligands: str
+            Path of the ligand library in .sdf format.
+
+        model: str, {'pdbbind_2019_refined', 'pdbbind_2019_general'}
+            Model that will be used for screening.
+
+        target_id: str, optional (default: None)
+            Target id. It will be stored in the `target_id` column of the
+            output.
+
+        url: str, optional (default: 'https://denvis.deeplab.ai')
+            Web service URL. Can be pointed to a local server for testing.
+
+        chunk_size: int, optional (default: 100)
+            Maximum number of ligands per request.
+
+        max_concurrency: int, optional (default: 4)
+            Maximum number of requests in flight at any time.
+
+        max_retries: int, optional (default: 5)
+            Maximum number of retries for each chunk on connection errors,
+            timeouts and transient HTTP errors.
+
+        backoff: float, optional (default: 2.0)
+            Base delay (in seconds) for exponential backoff between retries.
+
+        timeout: float, optional (default: 900.)
+            Timeout (in seconds) for each request.
+
+        work_dir: str, optional (default: None)
+            If provided, the response for each chunk will be stored in this
+            directory as soon as it is received. Re-running with the same
+            directory resumes after a failure, only submitting chunks without
+            a stored response.
+
+        verify_ssl: bool, optional (default: False)
+            Whether to verify SSL certificates (``curl -k`` is used in the
+            examples, i.e., no verification).
+
+        cache: ResultCache, optional (default: None)
+            Cache of scores from previous requests. Scores of newly screened
+            ligands will be added to it.
+
+        prog_bar: bool, optional (default: False)
+            Whether to display progress bar while screening.
+
+    Returns:
+        results_df: pd.DataFrame
+            Results DataFrame as returned by
+            `parsing.parse_results_webservice`.
+    """
+    return asyncio.run(screen_library_async(
+        protein=protein, crystal_ligand=crystal_ligand, ligands=ligands,
+        model=model, target_id=target_id, url=url, chunk_size=chunk_size,
+        max_concurrency=max_concurrency, max_retries=max_retries,
+        backoff=backoff, timeout=timeout, work_dir=work_dir,
+        verify_ssl=verify_ssl, cache=cache, prog_bar=prog_bar))
+
+
+def merge_responses(responses, target_id=None):
+    """
+    Merges Web service responses into a single results DataFrame.
+
+    Args:
+        responses: list
+            Responses (json text) in library order.
+
+        target_id: str, optional (default: None)
+            Target id. It will be stored in the `target_id` column.
+
+    Returns:
+        results_df: pd.DataFrame
+            Results DataFrame as returned by
+            `parsing.parse_results_webservice`.
+    """
+    if not responses:
+        return parse_results_webservice(_empty_output(), target_id=target_id)
+    output = pd.concat(
+        [_read_response(response) for response in responses],
+        axis='index', ignore_index=True)
+    return parse_results_webservice(output, target_id=target_id)
+
+
+def _empty_output():
+    """Web service output without any ligands. """
+    return pd.DataFrame({'ligand_id': pd.Series(dtype=object),
+                         'modality': pd.Series(dtype=object),
+                         'version': pd.Series(dtype=object)})
+
+
+def _read_response(response):
+    """Loads a response into a DataFrame. Ligand ids are kept as strings even
+    if they look numeric. """
+    return pd.read_json(io.StringIO(response), dtype={'ligand_id': str})
+
+
+def _record_id(record):
+    """Returns the ligand id of an .sdf record (first line). """
+    return record.split('\n', 1)[0].strip()
+
+
+def _drop_duplicate_records(records):
+    """Removes records with duplicate ligand ids, keeping the last one. """
+    last = {_record_id(record): i for i, record in enumerate(records)}
+    return [record for i, record in enumerate(records)
+            if last[_record_id(record)] == i]
+
+
+def _split_responses_by_ligand(responses):
+    """Splits responses into json records (one string per ligand id, with
+    the rows for all modalities and versions). """
+    if not responses:
+        return dict()
+
+    output = pd.concat(
+        [_read_response(response) for response in responses],
+        axis='index', ignore_index=True)
+    if output.empty:
+        return dict()
+
+    # Serialized with `json` (shortest repr) so that cached scores are not
+    # rounded
+    return {ligand_id: json.dumps(group.to_dict(orient='records'),
+                                  default=_json_default)
+            for ligand_id, group in output.groupby('ligand_id', sort=False)}
+
+
+def _json_default(value):
+    """Converts numpy scalars for `json.dumps`. """
+    return value.item()
+
+
+def _normalize_text(content):
+    """Normalizes file content so that the cache is not affected by line
+    endings or trailing whitespace. """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='replace')
+    lines = [line.rstrip() for line in content.splitlines()]
+    while lines and not lines[-1]:
+        lines.pop()
+
+    return '\n'.join(lines)
+
+
+def cache_keys(model, protein, crystal_ligand, records):
+    """
+    Computes the cache keys for a list of ligand records.
+
+    Args:
+        model: str
+            Model name.
+
+        protein: bytes or str
+            Content of the protein .pdb file.
+
+        crystal_ligand: bytes or str
+            Content of the crystal ligand .mol2 file.
+
+        records: list
+            Ligand .sdf records, as returned by `read_sdf_records`.
+
+    Returns:
+        keys: list
+            One key (sha256 hex digest) per record.
+    """
+    context = hashlib.sha256()
+    for content in (model, _normalize_text(protein),
+                    _normalize_text(crystal_ligand)):
+        context.update(content.encode())
+        context.update(b'\0')
+
+    keys = []
+    for record in records:
+        key = context.copy()
+        key.update(_normalize_text(record).encode())
+        keys.append(key.hexdigest())
+
+    return keys
+
+
+class ResultCache:
+    """
+    Bounded on-disk cache of Web service scores, with least-recently-used
+    eviction. Entries are keyed by a hash of the model name, the protein, the
+    crystal ligand and the ligand record (see `cache_keys`), and hold the json
+    rows returned for the ligand.
+
+    Args:
+        path: str
+            Path of the cache database (sqlite) file.
+
+        max_size: int, optional (default: 2 ** 30)
+            Maximum total size of cached entries in bytes. When exceeded, the
+            least recently used entries are evicted.
+    """
+
+    def __init__(self, path, max_size=2 ** 30):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, '
+            'value TEXT NOT NULL, size INTEGER NOT NULL, '
+            'last_access REAL NOT NULL)')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS entries_last_access ON entries '
+            '(last_access)')
+        self._conn.commit()
+
+    def get_many(self, keys):
+        """
+        Looks up multiple keys.
+
+        Args:
+            keys: list
+                Cache keys.
+
+        Returns:
+            entries: dict
+                Cached values for the keys found in the cache.
+        """
+        keys = list(dict.fromkeys(keys))
+        entries = dict()
+        batch_size = 500  # Stay below the sqlite variable limit
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            placeholders = ','.join('?' * len(batch))
+            entries.update(self._conn.execute(
+                f'SELECT key, value FROM entries WHERE key IN '
+                f'({placeholders})', batch).fetchall())
+        now = time.time()
+        self._conn.executemany(
+            'UPDATE entries SET last_access = ? WHERE key = ?',
+            [(now, key) for key in entries])
+        self._conn.commit()
+
+        self.hits += len(entries)
+        self.misses += len(keys) - len(entries)
+        return entries
+
+    def put_many(self, entries):
+        """
+        Adds multiple entries, evicting least recently used entries if the
+        cache size is exceeded.
+
+        Args:
+            entries: dict
+                Keys and values (str) to store.
+        """
+        now = time.time()
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO entries (key, value, size, last_access) '
+            'VALUES (?, ?, ?, ?)',
+            [(key, value, len(value), now) for key, value in entries.items()])
+        self._evict()
+        self._conn.commit()
+
+    def _evict(self):
+        """Evicts least recently used entries until the size limit is met. """
+        excess = self._size() - self.max_size
+        if excess <= 0:
+            return
+
+        evict_keys = []
+        for key, size in self._conn.execute(
+                'SELECT key, size FROM entries ORDER BY last_access ASC'):
+            evict_keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany('DELETE FROM entries WHERE key = ?',
+                               evict_keys)
+        self.evictions += len(evict_keys)
+
+    def _size(self):
+        """Returns the total size of cached entries in bytes. """
+        return self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def stats(self):
+        """
+        Returns cache statistics.
+
+        Returns:
+            stats: dict
+                Number of entries, total size and size limit (bytes), and
+                hits, misses and evictions since the cache was opened.
+        """
+        num_entries = self._conn.execute(
+            'SELECT COUNT(*) FROM entries').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': num_entries,
+            'size': self._size(),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else float('nan'),
+            'evictions': self.evictions}
+
+    def clear(self):
+        """Removes all entries. """
+        self._conn.execute('DELETE FROM entries')
+        self._conn.commit()
+
+    def close(self):
+        """Closes the cache database. """
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _read_published_scores(path, targets, heads):
+    """Reads the scores of the specified targets and heads from a DENVIS
+    outputs file (only the required columns and row groups). """
+    columns = ['target_id', 'ligand_id', 'version'] + heads
+    published = pd.read_parquet(path, columns=columns,
+                                filters=[('target_id', 'in', list(targets))])
+    # Scores of multiple checkpoints of a version (if any) are averaged
+    return published.groupby(by=['target_id', 'ligand_id', 'version'],
+                             sort=False, observed=True).mean().reset_index()
+
+
+def _grouped_spearman(codes, num_groups, x, y):
+    """Spearman correlation of ``x`` and ``y`` within groups. """
+    frame = pd.DataFrame({'group': codes, 'x': x, 'y': y})
+    ranks = frame.groupby('group')[['x', 'y']].rank().to_numpy()
+    n = np.bincount(codes, minlength=num_groups)
+    sums = [np.bincount(codes, weights=weights, minlength=num_groups)
+            for weights in (ranks[:, 0], ranks[:, 1], ranks[:, 0] ** 2,
+                            ranks[:, 1] ** 2, ranks[:, 0] * ranks[:, 1])]
+    sum_x, sum_y, sum_xx, sum_yy, sum_xy = sums
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sum_xy - sum_x * sum_y / n
+        var_x = sum_xx - sum_x ** 2 / n
+        var_y = sum_yy - sum_y ** 2 / n
+        return cov / np.sqrt(var_x * var_y)
+
+
+def reconcile_outputs(api_results, published_paths, heads=None):
+    """
+    Compares Web service outputs with the published DENVIS scores, for all
+    targets, models, modalities and output heads at once.
+
+    Args:
+        api_results: dict
+            Keys are Web service models (e.g. `'pdbbind_2019_refined'`) and
+            values are merged responses for one or more targets, as returned
+            by `merge_responses` or `screen_library` (with ``target_id``).
+
+        published_paths: dict
+            Keys are Web service models and values are dicts with the paths
+            of the DENVIS outputs of each modality, e.g. ``{'atom':
+            'dude_main_refined_atom.parquet', 'surface':
+            'dude_main_refined_surface.parquet'}``.
+
+        heads: list, optional (default: None)
+            Score columns to compare. Defaults to all `y_score_*` columns
+            found in both the responses and the DENVIS outputs.
+
+    Returns:
+        report: pd.DataFrame
+            DataFrame with one row per model, modality, head and target and
+            the following columns: `['model', 'modality', 'head',
+            'target_id', 'num_pairs', 'num_missing', 'max_abs_diff',
+            'max_rel_diff', 'spearman', 'missing_ligands']`. Pairs are
+            (ligand, version) entries of the responses; missing pairs are
+            not found in the DENVIS outputs and their ligand ids are listed
+            in `missing_ligands`.
+    """
+    reports = []
+    for model, api_model in api_results.items():
+        if api_model['target_id'].isna().any():
+            raise ValueError(f"Responses of ``{model}`` do not have target "
+                             f"ids (see `merge_responses`).")
+        for modality, path in published_paths[model].items():
+            api = api_model[api_model['modality'] == modality]
+            api = api.reset_index(drop=True)
+            targets = pd.unique(api['target_id'])
+            published_cols = pq.read_schema(path).names
+            model_heads = [col for col in (heads or api.columns)
+                           if col.startswith('y_score') and col in api and
+                           col in published_cols]
+            published = _read_published_scores(path, targets, model_heads)
+
+            # Integer-coded join on (target, ligand, version)
+            target_codes, target_vocab = pd.factorize(np.concatenate((
+                api['target_id'].to_numpy(dtype=object),
+                published['target_id'].to_numpy(dtype=object))), sort=True)
+            ligand_codes, ligand_vocab = pd.factorize(np.concatenate((
+                api['ligand_id'].to_numpy(dtype=str).astype(object),
+                published['ligand_id'].to_numpy(dtype=str).astype(object))))
+            versions = np.concatenate((
+                api['version'].to_numpy(dtype=np.int64),
+                published['version'].to_numpy(dtype=np.int64)))
+            keys = (target_codes.astype(np.int64) * len(ligand_vocab) +
+                    ligand_codes) * (versions.max(initial=0) + 1) + versions
+            api_keys, published_keys = keys[:len(api)], keys[len(api):]
+            matches = pd.Index(published_keys).get_indexer(api_keys)
+            found = matches >= 0
+
+            api_targets = target_codes[:len(api)]
+            num_pairs = np.bincount(api_targets, minlength=len(target_vocab))
+            num_missing = np.bincount(api_targets[~found],
+                                      minlength=len(target_vocab))
+            missing_ligands = pd.Series(
+                ligand_vocab[ligand_codes[:len(api)][~found]]).groupby(
+                api_targets[~found]).unique()
+
+            codes = api_targets[found]
+            present = np.flatnonzero(num_pairs > 0)
+            for head in model_heads:
+                api_scores = api[head].to_numpy(dtype=np.float64)[found]
+                published_scores = published[head].to_numpy(
+                    dtype=np.float64)[matches[found]]
+                abs_diff = np.abs(api_scores - published_scores)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    rel_diff = abs_diff / np.abs(published_scores)
+                max_abs_diff = np.full(len(target_vocab), np.nan)
+                max_rel_diff = np.full(len(target_vocab), np.nan)
+                if len(codes) > 0:
+                    np.fmax.at(max_abs_diff, codes, abs_diff)
+                    np.fmax.at(max_rel_diff, codes, rel_diff)
+                spearman = _grouped_spearman(
+                    codes, len(target_vocab), api_scores, published_scores)
+
+                reports.append(pd.DataFrame({
+                    'model': model,
+                    'modality': modality,
+                    'head': head,
+                    'target_id': target_vocab[present],
+                    'num_pairs': num_pairs[present],
+                    'num_missing': num_missing[present],
+                    'max_abs_diff': max_abs_diff[present],
+                    'max_rel_diff': max_rel_diff[present],
+                    'spearman': spearman[present],
+                    'missing_ligands': [
+                        list(missing_ligands.get(code, [])) for code in
+                        present]}))
+
+    columns = ['model', 'modality', 'head', 'target_id', 'num_pairs',
+               'num_missing', 'max_abs_diff', 'max_rel_diff', 'spearman',
+               'missing_ligands']
+    if not reports:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(reports, axis='index', ignore_index=True)[columns]
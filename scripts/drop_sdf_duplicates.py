@@ -1,51 +1,175 @@
+import itertools
+import multiprocessing
+
 import click
 import pandas as pd
+from rdkit import Chem, RDLogger
+from rdkit.Chem.MolStandardize import rdMolStandardize
 
 """
 Removes duplicate entries from an .sdf ligand library file.
-Duplicate entries are ones that have the same ID in the file.
-It keeps the last entry in the file.
+Duplicate entries are ones that have the same ID in the file (`--mode id`),
+or the same chemical structure (`--mode structure`), i.e. the same canonical
+identifier (InChIKey or canonical SMILES, optionally after standardization of
+charges, fragments and tautomers). It keeps the last entry in the file.
+
+In structure mode, entries with the same ID are removed first (as in id mode),
+then entries with the same structure. Canonical identifiers are computed in
+parallel, reading the file in chunks, and a mapping from the IDs that are no
+longer in the output to the IDs of the kept entries is saved in csv format, so
+that screening scores can be assigned back to all IDs. Entries that cannot be
+parsed by rdkit are only removed if they have the same ID as a later entry.
 """
 
 
-@click.command()
-@click.argument('sdf_file', type=str)
-@click.option('--output_file', '-o', type=str, default='ligands_dedup.sdf')
-def drop_sdf_duplicates(sdf_file, output_file):
-    assert sdf_file.endswith(".sdf")
-    assert output_file.endswith(".sdf")
-
-    # Read sdf file
+def _iter_records(sdf_file):
+    """Iterates over the records of an .sdf file (including the `$$$$`
+    separator line). """
     with open(sdf_file, "r") as f:
-        contents = f.readlines()
+        lines = []
+        for line in f:
+            lines.append(line)
+            # mols are separated with $$$$ in the sdf file
+            if line == "$$$$\n":
+                yield "".join(lines)
+                lines = []
+
+
+def _iter_chunks(records, chunk_size):
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _init_worker():
+    RDLogger.DisableLog('rdApp.*')
+
+
+def _canonical_ids(records, key, standardize):
+    """Returns the canonical identifier of each record (None if the record
+    cannot be parsed). """
+    if standardize:
+        uncharger = rdMolStandardize.Uncharger()
+        tautomer_enumerator = rdMolStandardize.TautomerEnumerator()
 
     ids = []
-    mols = []
-
-    start_of_mol = 0
-    end_of_mol = None
-    for i, line in enumerate(contents):
-        # mols are separated with $$$$ in the sdf file
-        if line == "$$$$\n":
-            end_of_mol = i
-            ids.append(contents[start_of_mol])
-            # joins all the lines that correspond to a single molecule
-            # and saves them in the mols list
-            mols.append("".join(contents[start_of_mol:end_of_mol + 1]))
-            # re init for next
-            start_of_mol = i + 1
+    for record in records:
+        mol = Chem.MolFromMolBlock(record)
+        if mol is None:
+            ids.append(None)
+            continue
+        try:
+            if standardize:
+                mol = rdMolStandardize.Cleanup(mol)
+                mol = rdMolStandardize.FragmentParent(mol)
+                mol = uncharger.uncharge(mol)
+                mol = tautomer_enumerator.Canonicalize(mol)
+            if key == 'inchikey':
+                ids.append(Chem.MolToInchiKey(mol) or None)
+            else:
+                ids.append(Chem.MolToSmiles(mol) or None)
+        except (ValueError, RuntimeError):
+            ids.append(None)
+
+    return ids
+
+
+def _canonical_ids_chunk(args):
+    return _canonical_ids(*args)
+
+
+def _drop_id_duplicates(sdf_file, output_file):
+    # Read sdf file
+    mols = list(_iter_records(sdf_file))
+    ids = [mol.split("\n", 1)[0] for mol in mols]
 
     # save the ids into a DataFrame for easy deduplication
     id_df = pd.DataFrame({"ligand_id": ids})
 
     # drop duplicates, keeping last
     id_df = id_df.drop_duplicates(subset='ligand_id', keep="last")
-    ligands_to_keep = list(id_df.index)
+    ligands_to_keep = set(id_df.index)
     # save to new sdf file
     with open(output_file, "w") as f:
         for i, mol in enumerate(mols):
             if i in ligands_to_keep:
-                f.write(mols[i])
+                f.write(mol)
+
+
+def _drop_structure_duplicates(sdf_file, output_file, mapping_file, key,
+                               standardize, n_jobs, chunk_size):
+    # First pass: IDs and canonical identifiers of all records
+    ids = [mol.split("\n", 1)[0].strip() for mol in _iter_records(sdf_file)]
+    chunks = ((chunk, key, standardize) for chunk in _iter_chunks(
+        _iter_records(sdf_file), chunk_size))
+    with multiprocessing.Pool(n_jobs, initializer=_init_worker) as pool:
+        canonical_ids = [canonical_id for chunk_ids in pool.imap(
+            _canonical_ids_chunk, chunks) for canonical_id in chunk_ids]
+
+    # Records with the same ID are collapsed first, keeping the last one (as
+    # in id mode), then the last record of each canonical identifier is kept
+    last_id = {ligand_id: i for i, ligand_id in enumerate(ids)}
+    last = dict()
+    for i in last_id.values():
+        if canonical_ids[i] is not None:
+            last[canonical_ids[i]] = max(i, last.get(canonical_ids[i], i))
+    keep = {i for i in last_id.values()
+            if canonical_ids[i] is None or last[canonical_ids[i]] == i}
+
+    # Second pass: write kept records
+    with open(output_file, "w") as f:
+        for i, mol in enumerate(_iter_records(sdf_file)):
+            if i in keep:
+                f.write(mol)
+
+    # Map the IDs that are no longer in the output to the kept IDs
+    mapping = pd.DataFrame([
+        {'removed_id': ligand_id, 'kept_id': ids[last[canonical_ids[i]]],
+         key: canonical_ids[i]}
+        for ligand_id, i in last_id.items() if i not in keep],
+        columns=['removed_id', 'kept_id', key])
+    assert not set(mapping['removed_id']) & {ids[i] for i in keep}
+    mapping.to_csv(mapping_file, index=False)
+
+    print(f"Kept {len(keep)} out of {len(ids)} entries "
+          f"({sum(canonical_id is None for canonical_id in canonical_ids)} "
+          f"could not be parsed).")
+
+
+@click.command()
+@click.argument('sdf_file', type=str)
+@click.option('--output_file', '-o', type=str, default='ligands_dedup.sdf')
+@click.option('--mode', type=click.Choice(['id', 'structure']), default='id',
+              help='Duplicate entries have the same ID or the same '
+                   'structure.')
+@click.option('--key', type=click.Choice(['inchikey', 'smiles']),
+              default='inchikey',
+              help='Canonical identifier (structure mode).')
+@click.option('--standardize', is_flag=True, default=False,
+              help='Standardize charges, fragments and tautomers before '
+                   'computing identifiers (structure mode).')
+@click.option('--mapping_file', type=str, default=None,
+              help='Output csv with the IDs of removed and kept entries '
+                   '(structure mode). Defaults to <output_file>_mapping.csv.')
+@click.option('--n_jobs', type=int, default=None,
+              help='Number of worker processes (structure mode).')
+@click.option('--chunk_size', type=int, default=1000,
+              help='Number of entries per chunk (structure mode).')
+def drop_sdf_duplicates(sdf_file, output_file, mode, key, standardize,
+                        mapping_file, n_jobs, chunk_size):
+    assert sdf_file.endswith(".sdf")
+    assert output_file.endswith(".sdf")
+
+    if mode == 'id':
+        _drop_id_duplicates(sdf_file, output_file)
+    else:
+        if mapping_file is None:
+            mapping_file = output_file[:-len(".sdf")] + "_mapping.csv"
+        _drop_structure_duplicates(sdf_file, output_file, mapping_file, key,
+                                   standardize, n_jobs, chunk_size)
 
 
 if __name__ == '__main__':
@@ -4,23 +4,124 @@ import os
 from tqdm import tqdm
 import click
 import gzip
+import hashlib
+import json
 import shutil
+import tempfile
 
 """
 Parses docked dude data downloaded from:
 http://bits.csb.pitt.edu/files/docked_dude.tar used in the paper:
 https://journals.plos.org/plosone/article?id=10.1371/journal.pone.0220113
-and saves them in a csv format.
+and saves them in a parquet format, one shard per target.
+
+Shards are written to the output directory as soon as each target has been
+parsed, along with a manifest (`_manifest.json`) recording the size and
+checksum of the source files used for each shard. When the script is re-run,
+targets whose shards are up to date are skipped, so that an interrupted job
+can be resumed and only changed or missing targets are parsed again. Shards of
+targets that are no longer in the source directory are removed (unless
+`--keep_stale` is set). The shard directory can be read directly with
+`parsing.parse_results_vina`.
 """
 
+MANIFEST_FILENAME = '_manifest.json'
 
-@click.command()
-@click.option('--output_path',
-                default='../data/outputs/vina_outputs/dude.csv')
-@click.option('--docked_dude_path',
-              default='../data/outputs/vina_outputs/docked_dude')
-def parse_docked_dude_vina(output_path, docked_dude_path):
 
+def _file_md5(path, chunk_size=2 ** 20):
+    """Returns the md5 checksum of a file, reading it in chunks. """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+
+    return md5.hexdigest()
+
+
+def _read_manifest(output_path):
+    """Reads the shard manifest. Returns an empty dict if there is none. """
+    manifest_path = os.path.join(output_path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return dict()
+
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _write_manifest(output_path, manifest):
+    """Writes the shard manifest atomically so that a crash while writing
+    does not leave a corrupted manifest behind. """
+    manifest_path = os.path.join(output_path, MANIFEST_FILENAME)
+    tmp_path = os.path.join(output_path, '.' + MANIFEST_FILENAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def _list_sources(target_path):
+    """Returns the sorted (gzipped) active/decoy source files of a target. """
+    sources = []
+    for file in sorted(os.listdir(target_path)):
+        if (file.startswith('actives') or file.startswith('decoys')) and \
+                file.endswith('.gz'):
+            sources.append(file)
+        else:
+            print(f'file {os.path.join(target_path, file)} not in correct '
+                  f'form')
+
+    return sources
+
+
+def _shard_is_up_to_date(output_path, entry, target_path, sources, md5s):
+    """Checks whether the shard recorded in a manifest entry was produced from
+    the current source files. Sizes are compared first, so that checksums only
+    need to be computed for files that may not have changed. Computed
+    checksums are stored in ``md5s``, so that they can be reused. """
+    if entry is None:
+        return False
+
+    if not os.path.exists(os.path.join(output_path, entry['shard'])):
+        return False
+
+    if sorted(entry['sources']) != sources:
+        return False
+
+    for file in sources:
+        abs_path = os.path.join(target_path, file)
+        if os.path.getsize(abs_path) != entry['sources'][file]['size']:
+            return False
+
+    for file in sources:
+        md5s[file] = _file_md5(os.path.join(target_path, file))
+        if md5s[file] != entry['sources'][file]['md5']:
+            return False
+
+    return True
+
+
+def _prune_stale_shards(output_path, manifest, targets):
+    """Removes the shards and manifest entries of targets that are not in
+    ``targets``. Returns the names of the removed targets. """
+    targets = set(targets)
+    stale = {target for target in manifest if target not in targets}
+    for file in os.listdir(output_path):
+        if file.endswith('.parquet') and not file.startswith('.') and \
+                file[:-len('.parquet')] not in targets:
+            stale.add(file[:-len('.parquet')])
+
+    for target in sorted(stale):
+        entry = manifest.pop(target, None)
+        shard = entry['shard'] if entry is not None else f'{target}.parquet'
+        shard_path = os.path.join(output_path, shard)
+        if os.path.exists(shard_path):
+            os.remove(shard_path)
+
+    return sorted(stale)
+
+
+def _parse_target(target, target_path, sources):
+    """Parses the docking scores of all source files of a single target into
+    a DataFrame. """
     # need to provide these two arguments but
     # their value is not important because we dont use the
     # actual molecule here
@@ -28,24 +129,17 @@ def parse_docked_dude_vina(output_path, docked_dude_path):
     sanitize = False
 
     ligand_id = []
-    target_id = []
     y_score = []
     y_true = []
+    for file in sources:
+        abs_path = os.path.join(target_path, file)
+        y = 1 if file.startswith('actives') else 0
 
-    for target in tqdm(os.listdir(docked_dude_path)):
-        for file in os.listdir(os.path.join(docked_dude_path, target)):
-            abs_path = os.path.join(docked_dude_path, target, file)
-            if file.startswith('actives'):
-                y = 1
-            elif file.startswith('decoys'):
-                y = 0
-            else:
-                print(f'file {abs_path} not in correct form')
-                continue
-
-            # Unzip data and save into new file because SDMolSupplier takes
-            # filepath as input argument only
-            save_fn = abs_path[:-3]  # remove .gz file extension
+        # Unzip data and save into new file because SDMolSupplier takes
+        # filepath as input argument only. The file is written outside of
+        # the source directory, so that a crash does not leave it behind.
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            save_fn = os.path.join(tmp_dir, file[:-3])  # remove .gz
             with gzip.open(abs_path, 'rb') as f_in:
                 with open(save_fn, 'wb') as f_out:
                     shutil.copyfileobj(f_in, f_out)
@@ -53,23 +147,72 @@ def parse_docked_dude_vina(output_path, docked_dude_path):
             supplier = Chem.SDMolSupplier(save_fn, removeHs=remove_hs,
                                           sanitize=sanitize)
             for mol in supplier:
-                vina_score = mol.GetProp('minimizedAffinity')
-                ligand_name = mol.GetProp('_Name')
-
-                ligand_id.append(ligand_name)
-                target_id.append(target)
-                y_score.append(vina_score)
+                ligand_id.append(mol.GetProp('_Name'))
+                y_score.append(float(mol.GetProp('minimizedAffinity')))
                 y_true.append(y)
-
-            os.remove(save_fn)
+            del supplier
 
     df_vina = pd.DataFrame()
-    df_vina['target_list'] = target_id
-    df_vina['ligand_list'] = ligand_id
-    df_vina['score_list'] = y_score
-    df_vina['y_list'] = y_true
+    df_vina['target_list'] = [target] * len(ligand_id)
+    df_vina['ligand_list'] = pd.Series(ligand_id, dtype=object)
+    df_vina['score_list'] = pd.Series(y_score, dtype='float64')
+    df_vina['y_list'] = pd.Series(y_true, dtype='int64')
+
+    return df_vina
+
+
+@click.command()
+@click.option('--output_path',
+              default='../data/outputs/vina_outputs/dude',
+              help='Directory where the per-target shards will be saved.')
+@click.option('--docked_dude_path',
+              default='../data/outputs/vina_outputs/docked_dude')
+@click.option('--force', is_flag=True, default=False,
+              help='Re-parse all targets, even if their shards are up to '
+                   'date.')
+@click.option('--keep_stale', is_flag=True, default=False,
+              help='Keep the shards of targets that are no longer in the '
+                   'source directory.')
+def parse_docked_dude_vina(output_path, docked_dude_path, force, keep_stale):
+    os.makedirs(output_path, exist_ok=True)
+    manifest = dict() if force else _read_manifest(output_path)
+    targets = sorted(os.listdir(docked_dude_path))
+
+    if not keep_stale:
+        stale = _prune_stale_shards(output_path, manifest, targets)
+        if stale:
+            print(f'Removed shards of targets not in {docked_dude_path}: '
+                  f'{stale}')
+            _write_manifest(output_path, manifest)
+
+    for target in tqdm(targets):
+        target_path = os.path.join(docked_dude_path, target)
+        sources = _list_sources(target_path)
+        md5s = dict()
+        if _shard_is_up_to_date(output_path, manifest.get(target),
+                                target_path, sources, md5s):
+            continue
+
+        df_vina = _parse_target(target, target_path, sources)
+
+        # Write into a temporary file first so that a crash does not leave a
+        # partially written shard behind. Files starting with '.' are ignored
+        # when reading the shard directory.
+        shard = f'{target}.parquet'
+        tmp_path = os.path.join(output_path, '.' + shard + '.tmp')
+        df_vina.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, os.path.join(output_path, shard))
 
-    df_vina.to_csv(output_path, index=False)
+        manifest[target] = {
+            'shard': shard,
+            'num_rows': len(df_vina),
+            'sources': {
+                file: {
+                    'size': os.path.getsize(os.path.join(target_path, file)),
+                    'md5': md5s[file] if file in md5s else _file_md5(
+                        os.path.join(target_path, file))}
+                for file in sources}}
+        _write_manifest(output_path, manifest)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,588 @@
+import datetime
+import functools
+import gc
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from sklearn import metrics as skmetrics
+
+# The evaluation modules live next to the notebooks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'notebooks'))
+
+import ensembling  # noqa: E402
+import evaluation  # noqa: E402
+import filtering  # noqa: E402
+import hitlist  # noqa: E402
+import incremental  # noqa: E402
+import ligand_index  # noqa: E402
+import metrics  # noqa: E402
+import parsing  # noqa: E402
+import pipeline  # noqa: E402
+import postprocessing  # noqa: E402
+import synthetic  # noqa: E402
+import training_logs  # noqa: E402
+
+"""
+Times and memory-profiles the public functions of the evaluation modules
+(`parsing`, `ensembling`, `postprocessing`, `filtering`, `metrics`,
+`pipeline`, `evaluation`, `hitlist`, `incremental`, `ligand_index` and
+`training_logs`) on synthetic screening results (and training logs) of
+different scales (see `synthetic.SCALES`), and saves the measurements in json
+format. Measurements of two runs can be
+compared with the `--compare` option to catch performance regressions.
+
+Synthetic inputs are written to disk one target at a time. Functions that
+load whole results tables into memory are benchmarked on the first targets of
+a scale, so that they have at most `--max_rows` rows (`capped` is set in the
+measurements), since at the `stress` scale (~10^8 rows) the tables alone
+would not fit in memory. Out-of-core functions (e.g. `hitlist.top_hits`) are
+benchmarked on all targets.
+
+Example:
+    python run_benchmarks.py --scale small --scale dude -o bench.json
+    python run_benchmarks.py --scale small -o new.json --compare bench.json
+"""
+
+OUTPUT_COMBINATION_KWS = {'y_kd_weight': 0.5, 'y_ki_weight': 0.5}
+EF_ALPHA = 0.01
+BEDROC_ALPHA = 80.5
+MAX_POSES = 3  # Docking poses per pair of the baseline results
+OUT_OF_CORE_BENCHMARKS = ('hitlist.top_hits',)
+
+
+def _rows_per_target(spec):
+    """Maximum number of rows per target of the synthetic inputs. """
+    n_ligands, n_templates = spec['n_ligands'], spec['n_templates']
+    return (max(n_ligands) if isinstance(n_ligands, tuple) else n_ligands) * \
+        (max(n_templates) if isinstance(n_templates, tuple) else
+         n_templates) * max(spec['versions'] * spec['ckpts'], MAX_POSES)
+
+
+class BenchmarkData:
+    """Generates (once, on disk) and loads the synthetic inputs of a scale.
+    Inputs are only generated when a benchmark requires them. """
+
+    def __init__(self, data_dir, scale, seed, max_rows):
+        self.path = os.path.join(data_dir, scale)
+        self.spec = synthetic.SCALES[scale]
+        self.seed = seed
+        self._cache = dict()
+        os.makedirs(self.path, exist_ok=True)
+
+        # Inputs of in-memory benchmarks only include the first targets
+        n_targets = max(1, min(self.spec['n_targets'], max_rows //
+                               _rows_per_target(self.spec)))
+        self.capped = n_targets < self.spec['n_targets']
+        self.memory_spec = dict(self.spec, n_targets=n_targets)
+
+    def _file(self, name, write):
+        path = os.path.join(self.path, name)
+        if not os.path.exists(path):
+            write(path + '.tmp')
+            os.replace(path + '.tmp', path)
+        return path
+
+    def denvis_path(self, level, full=False):
+        """Path of DENVIS results. Only the first targets are included,
+        unless ``full`` is set (for out-of-core benchmarks). """
+        seed = self.seed + (0 if level == 'atom' else 1)
+        spec = self.spec if full else self.memory_spec
+        name = f'{level}.parquet' if full or not self.capped else \
+            f"{level}_{spec['n_targets']}targets.parquet"
+        # Targets are generated in order, so the first targets are the same
+        # in both files
+        return self._file(name, lambda path: (
+            synthetic.write_denvis_results(path, seed=seed, **spec)))
+
+    def _pair_results(self, n_poses):
+        key = ('pairs', n_poses)
+        if key not in self._cache:
+            self._cache[key] = synthetic.generate_pair_results(
+                n_poses=n_poses, seed=self.seed + 2, **self.memory_spec)
+        return self._cache[key]
+
+    def vina_path(self):
+        return self._file('vina.csv', lambda path: (
+            synthetic.write_vina_results(path, self._pair_results(MAX_POSES))))
+
+    def gnina_path(self):
+        return self._file('gnina.summary', lambda path: (
+            synthetic.write_gnina_results(path, self._pair_results(1))))
+
+    def deeppurpose_path(self):
+        return self._file('deeppurpose.json', lambda path: (
+            synthetic.write_deeppurpose_results(path, self._pair_results(1))))
+
+    def rf_nn_path(self):
+        return self._file('rfnn', lambda path: synthetic.write_rf_nn_results(
+            path, self._pair_results(MAX_POSES)))
+
+    def pdbbind_index_path(self):
+        """Path of a PDBbind index with one complex per ligand of the
+        in-memory targets. """
+        n_ligands = self.spec['n_ligands']
+        n_complexes = self.memory_spec['n_targets'] * (
+            max(n_ligands) if isinstance(n_ligands, tuple) else n_ligands)
+        return self._file('INDEX_PL_data.txt', lambda path: (
+            synthetic.write_pdbbind_index(path, n_complexes,
+                                          seed=self.seed + 3)))
+
+    def training_logs_path(self):
+        """Log directory of synthetic training runs, with more training steps
+        per epoch at larger scales. """
+        return self._file('training_logs', lambda path: (
+            synthetic.write_training_logs(
+                path, versions=self.spec['versions'],
+                steps_per_epoch=2 * self.spec['n_targets'],
+                seed=self.seed + 4)))
+
+    def training_logs_cache_dir(self):
+        """Scalar cache of the training logs, filled from scratch (so that it
+        matches the current code). """
+        path = os.path.join(self.path, 'training_logs_cache')
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        training_logs.load_scalars(self.training_logs_path(), cache_dir=path)
+        return path
+
+    def get(self, name):
+        """Returns (cached) parsed inputs. """
+        if name not in self._cache:
+            self._cache[name] = self._load(name)
+        return self._cache[name]
+
+    def _load(self, name):
+        if name in ('raw_atom', 'raw_surface'):
+            return parsing.parse_results_denvis(
+                self.denvis_path(name.split('_')[1]))[0]
+        if name in ('combined_atom', 'combined_surface'):
+            return postprocessing.combine_outputs(
+                self.get('raw_' + name.split('_')[1]),
+                **OUTPUT_COMBINATION_KWS)
+        if name in ('final_atom', 'final_surface'):
+            return postprocessing.combine_outputs(
+                self.get('ens_' + name.split('_')[1]),
+                **OUTPUT_COMBINATION_KWS)
+        if name in ('ens_atom', 'ens_surface'):
+            return ensembling.compute_ensemble_scores(
+                self.get('raw_' + name.split('_')[1]), version=True,
+                ckpt=True)
+        if name == 'ens_level':
+            return ensembling.compute_level_ensemble_scores(
+                self.get('ens_atom'), self.get('ens_surface'),
+                atom_weight=0.5)
+        if name == 'final':
+            return postprocessing.combine_outputs(
+                self.get('ens_level'), **OUTPUT_COMBINATION_KWS)
+        if name == 'targets':
+            return list(self.get('final')['target_id'].unique())
+        if name == 'output_grid':
+            return postprocessing.output_combination_grid(
+                y_kd_weight=np.linspace(0.1, 1., 5),
+                y_ki_weight=np.linspace(0.1, 1., 5))
+        raise KeyError(name)
+
+    def ligand_index_path(self):
+        """Builds a ligand index of the final results (rebuilt each time, so
+        that it matches the current code). """
+        path = os.path.join(self.path, 'ligand_index')
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        ligand_index.LigandIndex(path).add(self.get('final_atom'))
+        return path
+
+
+def _litpcba_target_ids(results):
+    """Returns a copy of ``results`` with target ids in the LIT-PCBA format
+    (`<target_id>#<pdb_code>`). """
+    results = results.copy()
+    if not results['target_id'].str.contains('#').all():
+        results['target_id'] = results['target_id'] + '#P000'
+    return results
+
+
+def _run_incremental(paths):
+    """Runs an incremental evaluation from scratch. """
+    with tempfile.TemporaryDirectory() as state_dir:
+        evaluator = incremental.IncrementalEvaluator(
+            state_dir, paths, scoring={'AUROC': skmetrics.roc_auc_score},
+            combine=OUTPUT_COMBINATION_KWS)
+        evaluator.update()
+        return evaluator.scores()
+
+
+def _add_ligand_index(results):
+    with tempfile.TemporaryDirectory() as path:
+        ligand_index.LigandIndex(path).add(results)
+
+
+def _use_views(results, configs, scores):
+    """Accesses the final predictions of each combined output view. """
+    for _, view in postprocessing.combined_output_views(results, configs,
+                                                        scores):
+        view['y_score'].to_numpy().sum()
+        view.to_frame(columns=['target_id', 'y_true'])
+
+
+def _benchmarks():
+    """Returns the benchmarks as (name, setup, run) tuples. ``setup`` takes
+    the scale data and returns the arguments of ``run``, and is not timed. """
+    def half(targets):
+        return targets[:len(targets) // 2]
+
+    return [
+        # parsing
+        ('parsing.parse_results_denvis',
+         lambda d: (d.denvis_path('atom'),),
+         lambda path: parsing.parse_results_denvis(path)),
+        ('parsing.parse_results_vina',
+         lambda d: (d.vina_path(),),
+         lambda path: parsing.parse_results_vina(path)),
+        ('parsing.parse_results_gnina',
+         lambda d: (d.gnina_path(),),
+         lambda path: parsing.parse_results_gnina(path)),
+        ('parsing.parse_results_rf_score',
+         lambda d: (d.rf_nn_path(),),
+         lambda path: parsing.parse_results_rf_score(path)),
+        ('parsing.parse_results_nn_score',
+         lambda d: (d.rf_nn_path(),),
+         lambda path: parsing.parse_results_nn_score(path)),
+        ('parsing.parse_results_deeppurpose',
+         lambda d: (d.deeppurpose_path(),),
+         lambda path: parsing.parse_results_deeppurpose(path)),
+        ('parsing.parse_pdbbind_index',
+         lambda d: (d.pdbbind_index_path(),),
+         lambda path: parsing.parse_pdbbind_index(path)),
+        ('parsing.target_ligand_pair_reduction',
+         lambda d: (d.get('raw_atom'),),
+         lambda results: parsing.target_ligand_pair_reduction(
+             results, reduce='max')),
+        ('parsing.load_results',
+         lambda d: ({'atom': d.denvis_path('atom'),
+                     'surface': d.denvis_path('surface')},),
+         lambda paths: parsing.load_results(
+             paths, {'atom': {'parser': 'denvis'},
+                     'surface': {'parser': 'denvis'}})),
+        ('parsing.reduce_templates',
+         lambda d: (parsing.process_target_id(
+             _litpcba_target_ids(d.get('final')), 'LIT-PCBA'),),
+         lambda results: parsing.reduce_templates(results, reduce='max')),
+        ('parsing.process_target_id',
+         lambda d: (_litpcba_target_ids(d.get('raw_atom')),),
+         # Target ids are split in place, so each run gets a copy
+         lambda results: parsing.process_target_id(results.copy(),
+                                                   'LIT-PCBA')),
+        # ensembling
+        ('ensembling.compute_ensemble_scores',
+         lambda d: (d.get('raw_atom'),),
+         lambda results: ensembling.compute_ensemble_scores(
+             results, version=True, ckpt=True)),
+        ('ensembling.compute_ensemble_scores (percentile)',
+         lambda d: (d.get('raw_atom'),),
+         lambda results: ensembling.compute_ensemble_scores(
+             results, version=True, ckpt=True, normalization='percentile')),
+        ('ensembling.normalize_scores',
+         lambda d: (d.get('ens_level'),),
+         lambda results: ensembling.normalize_scores(results, 'zscore')),
+        ('ensembling.compute_level_ensemble_scores',
+         lambda d: (d.get('ens_atom'), d.get('ens_surface')),
+         lambda atom, surface: ensembling.compute_level_ensemble_scores(
+             atom, surface, atom_weight=0.5)),
+        ('ensembling.level_ensemble_grid_search',
+         lambda d: (postprocessing.combine_outputs(
+             d.get('ens_atom'), **OUTPUT_COMBINATION_KWS),
+             postprocessing.combine_outputs(
+             d.get('ens_surface'), **OUTPUT_COMBINATION_KWS)),
+         lambda atom, surface: ensembling.level_ensemble_grid_search(
+             atom, surface, atom_weight_grid=np.linspace(0., 1., 5),
+             metric_avg_fun=np.median)),
+        # postprocessing
+        ('postprocessing.combine_outputs',
+         lambda d: (d.get('ens_level'),),
+         lambda results: postprocessing.combine_outputs(
+             results, **OUTPUT_COMBINATION_KWS)),
+        ('postprocessing.combine_outputs_batch',
+         lambda d: (d.get('ens_level'), d.get('output_grid')),
+         lambda results, configs: postprocessing.combine_outputs_batch(
+             results, configs)),
+        ('postprocessing.CombinedOutputView',
+         lambda d: (d.get('ens_level'), d.get('output_grid'),
+                    postprocessing.combine_outputs_batch(
+                        d.get('ens_level'), d.get('output_grid'))),
+         lambda results, configs, scores: _use_views(results, configs,
+                                                     scores)),
+        # filtering
+        ('filtering.target_intersection',
+         lambda d: ([d.get('targets'), half(d.get('targets'))],),
+         lambda targets: filtering.target_intersection(targets)),
+        ('filtering.target_union',
+         lambda d: ([d.get('targets'), half(d.get('targets'))],),
+         lambda targets: filtering.target_union(targets)),
+        ('filtering.target_difference',
+         lambda d: (d.get('targets'), half(d.get('targets'))),
+         lambda targets_1, targets_2: filtering.target_difference(
+             targets_1, targets_2)),
+        ('filtering.filter_targets',
+         lambda d: (d.get('final'), half(d.get('targets'))),
+         lambda results, targets: filtering.filter_targets(results, targets)),
+        ('filtering.TargetIndex',
+         lambda d: (d.get('final')['target_id'].values,),
+         lambda target_ids: filtering.TargetIndex(target_ids)),
+        ('filtering.sort_by_target',
+         lambda d: (d.get('final'),),
+         lambda results: filtering.sort_by_target(results)),
+        # metrics
+        ('metrics.compute_auroc_scores',
+         lambda d: (d.get('final'),),
+         lambda results: metrics.compute_auroc_scores(
+             results, avg_fun=np.median)),
+        ('metrics.compute_ef_scores',
+         lambda d: (d.get('final'),),
+         lambda results: metrics.compute_ef_scores(
+             results, alpha=EF_ALPHA, avg_fun=np.median)),
+        ('metrics.compute_bedroc_scores',
+         lambda d: (d.get('final'),),
+         lambda results: metrics.compute_bedroc_scores(
+             results, alpha=BEDROC_ALPHA, avg_fun=np.median)),
+        ('metrics.compute_pr_scores',
+         lambda d: (d.get('final'),),
+         lambda results: metrics.compute_pr_scores(results)),
+        ('metrics.score_per_target',
+         lambda d: (d.get('final'),),
+         lambda results: metrics.score_per_target(
+             results['y_true'].values, results['y_score'].values,
+             results['target_id'].values, skmetrics.roc_auc_score)),
+        ('metrics.compute_leaderboard',
+         lambda d: (d.get('combined_atom'),),
+         lambda results: metrics.compute_leaderboard(
+             results, avg_fun=np.median, ef_alpha=EF_ALPHA,
+             bedroc_alpha=BEDROC_ALPHA)),
+        ('metrics.compute_subsampled_scores',
+         lambda d: (d.get('final'),),
+         lambda results: metrics.compute_subsampled_scores(
+             results, avg_fun=np.median, ef_alpha=EF_ALPHA,
+             bedroc_alpha=BEDROC_ALPHA)),
+        ('evaluation.evaluate_models',
+         lambda d: ({'atom': d.get('final_atom'),
+                     'surface': d.get('final_surface')},),
+         lambda results: evaluation.evaluate_models(results, {
+             'AUROC': skmetrics.roc_auc_score,
+             'EF1': functools.partial(metrics.ef_score, alpha=EF_ALPHA)})),
+        ('pipeline.EvaluationPipeline.collect',
+         lambda d: ({'atom': d.denvis_path('atom'),
+                     'surface': d.denvis_path('surface')},),
+         lambda paths: pipeline.read_denvis(paths).ensemble(
+             ckpt=True, version=True).level_ensemble(
+             atom_weight=0.5).combine_outputs(
+             **OUTPUT_COMBINATION_KWS).collect()),
+        # out-of-core and incremental
+        ('hitlist.top_hits',
+         lambda d: (d.denvis_path('atom', full=True),),
+         lambda path: hitlist.top_hits(path, k=100,
+                                       combine=OUTPUT_COMBINATION_KWS,
+                                       average=True)),
+        ('incremental.IncrementalEvaluator.update',
+         lambda d: ({'atom': d.denvis_path('atom'),
+                     'surface': d.denvis_path('surface')},),
+         lambda paths: _run_incremental(paths)),
+        # Single level results, with one row per target-ligand pair
+        ('ligand_index.LigandIndex.add',
+         lambda d: (d.get('final_atom'),),
+         lambda results: _add_ligand_index(results)),
+        ('ligand_index.LigandIndex.lookup',
+         lambda d: (ligand_index.LigandIndex(d.ligand_index_path()),
+                    d.get('final_atom')['ligand_id'].unique()[:1000]),
+         lambda index, ligand_ids: index.lookup(ligand_ids,
+                                                min_percentile=0.99)),
+        # training logs
+        ('training_logs.load_scalars',
+         lambda d: (d.training_logs_path(),),
+         lambda logdir: training_logs.load_scalars(logdir)),
+        ('training_logs.load_scalars (cached)',
+         lambda d: (d.training_logs_path(), d.training_logs_cache_dir()),
+         lambda logdir, cache_dir: training_logs.load_scalars(
+             logdir, cache_dir=cache_dir)),
+        ('training_logs.load_training_losses',
+         lambda d: (d.training_logs_path(),),
+         lambda logdir: training_logs.load_training_losses(logdir)),
+    ]
+
+
+def _num_rows(args):
+    """Number of rows of the first DataFrame/array argument or parquet file,
+    if any. """
+    for arg in args:
+        if isinstance(arg, (pd.DataFrame, np.ndarray)):
+            return len(arg)
+        if isinstance(arg, str) and arg.endswith('.parquet'):
+            return pq.read_metadata(arg).num_rows
+    return None
+
+
+def _max_rss():
+    """Peak resident set size of the process in bytes. """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _measure(run, args, repeat, memory):
+    """Times ``repeat`` runs, and measures peak allocations in an extra run
+    (tracing allocations slows down execution, so it is not timed). """
+    wall_times, cpu_times = [], []
+    for _ in range(repeat):
+        gc.collect()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        run(*args)
+        wall_times.append(time.perf_counter() - wall_start)
+        cpu_times.append(time.process_time() - cpu_start)
+
+    peak_alloc = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        run(*args)
+        peak_alloc = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'wall_time': float(np.median(wall_times)),
+        'wall_time_min': float(np.min(wall_times)),
+        'cpu_time': float(np.median(cpu_times)),
+        'peak_alloc': peak_alloc,
+        'max_rss': _max_rss()}
+
+
+def compare_runs(current, baseline, threshold):
+    """
+    Compares the measurements of two runs.
+
+    Args:
+        current: dict
+            Current measurements (as saved by this script).
+
+        baseline: dict
+            Baseline measurements.
+
+        threshold: float
+            Wall time ratio above which a benchmark is flagged as regressed.
+
+    Returns:
+        comparison: pd.DataFrame
+            One row per benchmark and scale found in both runs.
+    """
+    keys = ['scale', 'benchmark']
+    cols = ['wall_time', 'peak_alloc']
+    runs = []
+    for run in [baseline, current]:
+        run = pd.DataFrame(run['results'])
+        if 'error' in run:  # Failed benchmarks cannot be compared
+            run = run[run['error'].isna()]
+        runs.append(run[keys + cols])
+    comparison = pd.merge(*runs, on=keys, suffixes=('_baseline', '_current'))
+    for col in cols:
+        comparison[f'{col}_ratio'] = comparison[f'{col}_current'] / \
+            comparison[f'{col}_baseline']
+    comparison['regression'] = comparison['wall_time_ratio'] > threshold
+    return comparison
+
+
+@click.command()
+@click.option('--scale', '-s', 'scales', multiple=True, default=['small'],
+              type=click.Choice(sorted(synthetic.SCALES)),
+              help='Synthetic dataset scale(s).')
+@click.option('--output', '-o', type=str, default='benchmarks.json',
+              help='Output path (json).')
+@click.option('--data_dir', type=str, default='../data/benchmarks',
+              help='Directory where synthetic inputs are generated.')
+@click.option('--only', type=str, default=None,
+              help='Only run benchmarks whose name matches this regex.')
+@click.option('--repeat', type=int, default=3,
+              help='Number of timed runs per benchmark.')
+@click.option('--no_memory', is_flag=True, default=False,
+              help='Skip peak allocation measurements.')
+@click.option('--compare', type=str, default=None,
+              help='Baseline measurements (json) to compare with.')
+@click.option('--threshold', type=float, default=1.2,
+              help='Wall time ratio above which a regression is reported.')
+@click.option('--max_rows', type=int, default=2 ** 24,
+              help='Maximum number of rows of the inputs of in-memory '
+                   'benchmarks.')
+@click.option('--seed', type=int, default=0)
+def run_benchmarks(scales, output, data_dir, only, repeat, no_memory,
+                   compare, threshold, max_rows, seed):
+    benchmarks = [benchmark for benchmark in _benchmarks()
+                  if only is None or re.search(only, benchmark[0])]
+
+    results = []
+    for scale in scales:
+        data = BenchmarkData(data_dir, scale, seed, max_rows)
+        for name, setup, run in benchmarks:
+            # A failing benchmark (e.g., due to an incompatible dependency
+            # version) is reported, but does not abort the whole run. The
+            # exit status is non-zero if any benchmark failed.
+            try:
+                args = setup(data)
+                measurement = _measure(run, args, repeat,
+                                       memory=not no_memory)
+            except Exception as e:
+                error = repr(e)[:200]
+                print(f'[{scale}] {name}: failed ({error})')
+                results.append({'scale': scale, 'benchmark': name,
+                                'error': error})
+                continue
+
+            measurement.update({'scale': scale, 'benchmark': name,
+                                'num_rows': _num_rows(args),
+                                'capped': data.capped and name not in
+                                OUT_OF_CORE_BENCHMARKS,
+                                'repeat': repeat})
+            results.append(measurement)
+            print(f"[{scale}] {name}: {measurement['wall_time']:.3f}s "
+                  f"(cpu {measurement['cpu_time']:.3f}s)")
+
+    report = {
+        'metadata': {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'seed': seed,
+            'max_rows': max_rows},
+        'results': results}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if compare is not None:
+        with open(compare) as f:
+            baseline = json.load(f)
+        comparison = compare_runs(report, baseline, threshold)
+        print(comparison.to_string(index=False))
+        if comparison['regression'].any():
+            regressed = comparison.loc[comparison['regression'], 'benchmark']
+            print(f"Regressions (wall time ratio > {threshold}): "
+                  f"{list(regressed)}")
+
+    failed = [f"[{result['scale']}] {result['benchmark']}"
+              for result in results if 'error' in result]
+    if failed:
+        print(f"{len(failed)} benchmark(s) failed: {failed}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run_benchmarks()
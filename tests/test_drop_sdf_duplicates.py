@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pandas as pd
+from rdkit import Chem
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'scripts'))
+
+from drop_sdf_duplicates import _drop_structure_duplicates  # noqa: E402
+
+"""
+Tests of the structure mode of `drop_sdf_duplicates`.
+"""
+
+
+def _write_sdf(path, records):
+    """Writes (ID, SMILES) records to an .sdf file. """
+    with open(path, 'w') as f:
+        for ligand_id, smiles in records:
+            mol = Chem.MolFromSmiles(smiles)
+            mol.SetProp('_Name', ligand_id)
+            f.write(Chem.MolToMolBlock(mol) + '$$$$\n')
+
+
+def _deduplicate(tmp_path, records):
+    sdf_file = str(tmp_path / 'ligands.sdf')
+    output_file = str(tmp_path / 'ligands_dedup.sdf')
+    mapping_file = str(tmp_path / 'mapping.csv')
+    _write_sdf(sdf_file, records)
+    _drop_structure_duplicates(sdf_file, output_file, mapping_file,
+                               'inchikey', standardize=False, n_jobs=1,
+                               chunk_size=2)
+    kept_ids = [mol.GetProp('_Name') for mol in Chem.SDMolSupplier(
+        output_file)]
+    return kept_ids, pd.read_csv(mapping_file)
+
+
+def test_same_id_different_structures(tmp_path):
+    # Protonation variants, without standardization
+    kept_ids, mapping = _deduplicate(tmp_path, [
+        ('A1', 'CC(=O)O'), ('A1', 'CC(=O)[O-]'),
+        ('A2', 'CCN'), ('A2', 'CC[NH3+]')])
+    assert kept_ids == ['A1', 'A2']
+    assert len(mapping) == 0
+
+
+def test_removed_ids_are_not_in_output(tmp_path):
+    kept_ids, mapping = _deduplicate(tmp_path, [
+        ('A1', 'c1ccccc1'), ('A1', 'Cc1ccccc1'), ('A2', 'Cc1ccccc1'),
+        ('A3', 'Oc1ccccc1')])
+    assert kept_ids == ['A2', 'A3']
+    assert list(mapping['removed_id']) == ['A1']
+    assert list(mapping['kept_id']) == ['A2']
+    assert not set(mapping['removed_id']) & set(kept_ids)
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'notebooks'))
+
+import filtering  # noqa: E402
+
+"""
+Tests of the target membership masks of `filtering.target_membership`.
+"""
+
+
+def test_target_membership():
+    vocabulary, masks = filtering.target_membership({
+        'atom': filtering.TargetIndex(np.array(['T1', 'T0', 'T1'],
+                                               dtype=object)),
+        'surface': filtering.TargetIndex(np.array(['T2', 'T1'],
+                                                  dtype=object))})
+    assert list(vocabulary) == ['T0', 'T1', 'T2']
+    assert masks['atom'].tolist() == [True, True, False]
+    assert masks['surface'].tolist() == [False, True, True]
+
+
+def test_target_membership_without_tables():
+    vocabulary, masks = filtering.target_membership([])
+    assert len(vocabulary) == 0
+    assert masks.shape == (0, 0)
+
+    vocabulary, masks = filtering.target_membership(dict())
+    assert len(vocabulary) == 0
+    assert masks == dict()
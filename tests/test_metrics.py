@@ -0,0 +1,77 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The evaluation modules live next to the notebooks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'notebooks'))
+
+import metrics  # noqa: E402
+
+"""
+Tests of the subsampled metric estimates against the exact metrics.
+"""
+
+N_SEEDS = 30
+
+
+@pytest.fixture(scope='module')
+def results():
+    """Screening results of targets with different numbers of actives and
+    separation between actives and inactives. """
+    rng = np.random.default_rng(0)
+    frames = []
+    for i, (num_actives, num_inactives, shift) in enumerate(
+            [(20, 60000, 0.5), (100, 40000, 1.), (50, 80000, 2.)]):
+        y_true = np.r_[np.ones(num_actives, dtype=bool),
+                       np.zeros(num_inactives, dtype=bool)]
+        frames.append(pd.DataFrame({
+            'target_id': f'T{i}', 'y_true': y_true,
+            'y_score': rng.normal(size=len(y_true)) + shift * y_true}))
+    return pd.concat(frames, axis='index', ignore_index=True)
+
+
+@pytest.fixture(scope='module')
+def estimates(results):
+    """Per-target estimates of multiple seeds. """
+    return [metrics.compute_subsampled_scores(
+        results, np.mean, tolerance=0.02, seed=seed)[0].set_index('Target')
+        for seed in range(N_SEEDS)]
+
+
+@pytest.fixture(scope='module')
+def exact_scores(results):
+    return {
+        'AUROC': metrics.compute_auroc_scores(results, np.mean)[0],
+        'EF1': metrics.compute_ef_scores(results, 0.01, np.mean)[0],
+        'BEDROC80.5': metrics.compute_bedroc_scores(results, 80.5,
+                                                    np.mean)[0]}
+
+
+def test_inactives_are_subsampled(estimates):
+    per_target = estimates[0]
+    assert (per_target['num_sampled'] < per_target['num_inactives']).all()
+
+
+@pytest.mark.parametrize('metric, tolerance', [
+    ('AUROC', 0.002), ('EF1', 1e-9), ('BEDROC80.5', 0.002)])
+def test_seed_average_matches_exact_scores(estimates, exact_scores, metric,
+                                           tolerance):
+    exact = pd.Series(exact_scores[metric])
+    average = pd.concat([per_target[metric] for per_target in estimates],
+                        axis=1).mean(axis=1)
+    np.testing.assert_allclose(average[exact.index], exact, rtol=0,
+                               atol=tolerance)
+
+
+@pytest.mark.parametrize('metric', ['AUROC', 'EF1', 'BEDROC80.5'])
+def test_bounds_cover_exact_scores(estimates, exact_scores, metric):
+    exact = pd.Series(exact_scores[metric])
+    covered = [((per_target[metric + '_low'][exact.index] <= exact + 1e-12) &
+                (exact - 1e-12 <= per_target[metric + '_high'][exact.index]))
+               for per_target in estimates]
+    # Nominal coverage is 95%
+    assert np.mean(covered) >= 0.85
@@ -0,0 +1,42 @@
+import json
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'notebooks'))
+
+import profiling  # noqa: E402
+
+"""
+Tests of the profiling of calls that raise.
+"""
+
+
+@profiling.profiled
+def _head(results, fail=False):
+    if fail:
+        raise ValueError("Failed.")
+    return results.head(2)
+
+
+def test_trace_with_failed_call(tmp_path):
+    results = pd.DataFrame({'y_score': range(5)})
+    with profiling.profile():
+        _head(results)
+        with pytest.raises(ValueError):
+            _head(results, fail=True)
+
+    calls = profiling.records()
+    assert list(calls['rows_in']) == [5, 5]
+    assert calls['rows_out'].iloc[0] == 2
+    assert pd.isna(calls['rows_out'].iloc[1])
+
+    path = str(tmp_path / 'trace.json')
+    profiling.to_chrome_trace(path)
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    assert [event['args']['rows_out'] for event in events] == [2, None]
+    assert all(event['args']['process_max_rss'] > 0 for event in events)
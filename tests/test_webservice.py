@@ -0,0 +1,155 @@
+import asyncio
+import collections
+import os
+import sys
+
+import pytest
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'notebooks'))
+
+import webservice  # noqa: E402
+
+"""
+Tests of `webservice.screen_library_async` against a local stub of the Web
+service.
+"""
+
+MODEL = 'pdbbind_2019_refined'
+
+
+class StubService:
+    """Stub of the Web service, which scores each ligand of a request and
+    records the ligand ids of the requests it answers. The first
+    ``num_failures`` attempts of each chunk are answered with HTTP 503. """
+
+    def __init__(self, num_failures=0):
+        self.num_failures = num_failures
+        self.requests = []
+        self.attempts = collections.Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, request):
+        form = await request.post()
+        ligands = form['ligand'].file.read().decode()
+        ligand_ids = [record.split('\n', 1)[0].strip()
+                      for record in ligands.split('$$$$\n') if record.strip()]
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)  # So that requests overlap
+        finally:
+            self.in_flight -= 1
+
+        self.attempts[tuple(ligand_ids)] += 1
+        if self.attempts[tuple(ligand_ids)] <= self.num_failures:
+            return web.Response(status=503)
+        self.requests.append(ligand_ids)
+        return web.json_response([
+            {'ligand_id': ligand_id, 'modality': modality,
+             'version': 'version_0',
+             'y_score_Kd': int(ligand_id[3:]) + (modality == 'surface') / 2}
+            for ligand_id in ligand_ids for modality in ['atom', 'surface']])
+
+
+def _write_library(path, ligand_ids, delimiter=True):
+    """Writes stub .sdf records, optionally without the last delimiter. """
+    content = ''.join(f'{ligand_id}\n  stub\n\nM  END\n$$$$\n'
+                      for ligand_id in ligand_ids)
+    with open(path, 'w') as f:
+        f.write(content if delimiter else content[:-len('$$$$\n')])
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    protein = str(tmp_path / 'protein.pdb')
+    crystal_ligand = str(tmp_path / 'crystal_ligand.mol2')
+    for path in (protein, crystal_ligand):
+        with open(path, 'w') as f:
+            f.write('stub\n')
+    ligands = str(tmp_path / 'ligands.sdf')
+    _write_library(ligands, [f'LIG{i}' for i in range(250)])
+    return {'protein': protein, 'crystal_ligand': crystal_ligand,
+            'ligands': ligands}
+
+
+def _screen(service, inputs, **kwargs):
+    """Screens the library against the stub service on a local port. """
+    async def screen():
+        app = web.Application()
+        app.router.add_post('/', service.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            return await webservice.screen_library_async(
+                model=MODEL, target_id='T0', url=f'http://127.0.0.1:{port}/',
+                backoff=0., **inputs, **kwargs)
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(screen())
+
+
+def test_read_sdf_records_without_trailing_delimiter(tmp_path):
+    path = str(tmp_path / 'ligands.sdf')
+    _write_library(path, ['LIG0', 'LIG1'], delimiter=False)
+    records = webservice.read_sdf_records(path)
+    assert [record.split('\n', 1)[0] for record in records] == ['LIG0', 'LIG1']
+    assert all(record.endswith('$$$$\n') for record in records)
+
+
+def test_chunks_are_merged_in_library_order(inputs):
+    service = StubService()
+    results = _screen(service, inputs, chunk_size=100)
+    assert sorted(len(ligand_ids) for ligand_ids in service.requests) == \
+        [50, 100, 100]
+    assert list(results.columns) == ['target_id', 'ligand_id', 'modality',
+                                     'version', 'y_score_Kd']
+    assert list(results['ligand_id'][::2]) == [f'LIG{i}' for i in range(250)]
+    assert (results['target_id'] == 'T0').all()
+
+
+def test_concurrency_is_capped(inputs):
+    service = StubService()
+    _screen(service, inputs, chunk_size=10, max_concurrency=3)
+    assert len(service.requests) == 25
+    assert 1 < service.max_in_flight <= 3
+
+
+def test_transient_errors_are_retried(inputs):
+    service = StubService(num_failures=2)
+    results = _screen(service, inputs, chunk_size=100, max_retries=2)
+    assert all(attempts == 3 for attempts in service.attempts.values())
+    assert results['ligand_id'].nunique() == 250
+
+    with pytest.raises(RuntimeError, match='3 out of 3 chunks failed'):
+        _screen(StubService(num_failures=2), inputs, chunk_size=100,
+                max_retries=1)
+
+
+def test_cached_ligands_are_not_submitted(inputs, tmp_path):
+    with webservice.ResultCache(str(tmp_path / 'cache.sqlite')) as cache:
+        service = StubService()
+        results = _screen(service, inputs, cache=cache)
+        assert sum(map(len, service.requests)) == 250
+
+        service = StubService()
+        cached_results = _screen(service, inputs, cache=cache)
+        assert service.requests == []
+        assert cached_results.equals(results)
+
+        # Only new ligands are submitted
+        _write_library(inputs['ligands'],
+                       [f'LIG{i}' for i in range(260)])
+        service = StubService()
+        results = _screen(service, inputs, cache=cache)
+        assert service.requests == [[f'LIG{i}' for i in range(250, 260)]]
+        assert list(results['ligand_id'][::2]) == \
+            [f'LIG{i}' for i in range(260)]
+        assert cache.stats()['hits'] == 500